@@ -0,0 +1,155 @@
+"""
+ClientLink - The Pi's end of a resumable session with the server
+
+Sends heartbeats, notices a dead connection, reconnects and resumes the session with
+its token. Frames lost in either direction while the link was down are replayed, so the
+application just calls send() and recv() as on a plain FramedConnection.
+"""
+import queue
+import socket
+import threading
+import time
+
+from protocol import (CONTROL_TYPES, MSG_PING, MSG_PONG, MSG_RESUME, MSG_RESUMED, MSG_SESSION, ReplayBuffer,
+                      client_handshake, encode_frame)
+
+_DISCONNECTED = object()
+
+class ClientLink:
+    def __init__(self, host, port, heartbeat_interval=5.0, heartbeat_timeout=15.0, reconnect_attempts=5):
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        # No frame from the server for this long means the connection is dead
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.token = None
+        self.received = 0
+        self.replay = ReplayBuffer()
+        self.hello = None  # First frame of the session (NAME), resent if the session has to start over
+        self.inbox = queue.Queue()
+        self.conn = None
+        self.connected = threading.Event()
+        self.closed = False
+        self.failed = False  # Reconnecting gave up; the session is lost
+        self.last_heard = time.monotonic()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Open the first connection and start the reader and heartbeat threads"""
+        self._open()
+        threading.Thread(target=self._read_loop, name="link-reader", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="link-heartbeat", daemon=True).start()
+        return self
+
+    def _open(self):
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        conn = client_handshake(sock)
+        reply = None
+        if self.token:
+            conn.send(MSG_RESUME, f"{self.token} {self.received}")
+            reply = conn.recv()
+        sock.settimeout(None)
+        # Under the send lock, so nothing sent meanwhile can miss both the replay and the new socket
+        with self._lock:
+            if reply and reply[0] == MSG_RESUMED:
+                missed = self.replay.since(int(reply[1])) or []
+                for frame in missed:
+                    sock.sendall(frame)
+                print(f"Link: resumed session, replayed {len(missed)} frames")
+            elif reply and reply[0] == MSG_SESSION:
+                # The server no longer knows the session: start a new one
+                print("Link: session expired on the server, starting a new one")
+                self.token, self.received, self.replay = reply[1], 0, ReplayBuffer()
+                if self.hello:
+                    self.replay.record(self.hello)
+                    sock.sendall(self.hello)
+            self.conn = conn
+            self.last_heard = time.monotonic()
+            self.connected.set()
+
+    def _reconnect(self) -> bool:
+        self.connected.clear()
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        for attempt in range(1, self.reconnect_attempts + 1):
+            if self.closed:
+                return False
+            try:
+                self._open()
+                return True
+            except (OSError, ConnectionError) as e:
+                print(f"Link: reconnection attempt {attempt}/{self.reconnect_attempts} failed: {e}")
+                time.sleep(min(2 ** (attempt - 1), 10))
+        return False
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                message = self.conn.recv()
+            except (OSError, ConnectionError):
+                if self.closed or not self._reconnect():
+                    self.failed = True
+                    self.inbox.put(_DISCONNECTED)
+                    return
+                continue
+            self.last_heard = time.monotonic()
+            msg_type, text = message
+            if msg_type == MSG_PONG:
+                with self._lock:
+                    self.replay.acknowledge(int(text or 0))
+            elif msg_type == MSG_SESSION:
+                self.token = text
+            elif msg_type not in CONTROL_TYPES:
+                self.received += 1
+                self.inbox.put(message)
+
+    def _heartbeat_loop(self):
+        while not self.closed:
+            time.sleep(self.heartbeat_interval)
+            if not self.connected.is_set():
+                continue
+            if time.monotonic() - self.last_heard > self.heartbeat_timeout:
+                print(f"Link: no reply from the server for {self.heartbeat_timeout:.0f}s, reconnecting")
+                # Unblocks the reader, which then reconnects
+                try:
+                    self.conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                continue
+            try:
+                with self._lock:
+                    self.conn.sock.sendall(encode_frame(MSG_PING, str(self.received)))
+            except OSError:
+                pass  # The reader notices the broken connection
+
+    def send(self, msg_type: int, text: str = "", trace_id: str = None):
+        """Send a message; if the link is down it is delivered after the reconnect"""
+        if self.closed or self.failed:
+            raise ConnectionError("Link is closed" if self.closed else "Lost the connection to the server")
+        frame = encode_frame(msg_type, text, trace_id)
+        with self._lock:
+            if self.hello is None:
+                self.hello = frame
+            self.replay.record(frame)
+            try:
+                if self.connected.is_set():
+                    self.conn.sock.sendall(frame)
+            except OSError:
+                pass  # Kept in the replay buffer
+
+    def recv(self):
+        """Block until the next message; raises ConnectionResetError once reconnecting has failed"""
+        message = self.inbox.get()
+        if message is _DISCONNECTED:
+            self.inbox.put(_DISCONNECTED)
+            raise ConnectionResetError("Lost the connection to the server")
+        return message
+
+    def close(self):
+        self.closed = True
+        self.connected.clear()
+        if self.conn:
+            self.conn.close()
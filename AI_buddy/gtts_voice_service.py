@@ -3,14 +3,22 @@ import queue
 import threading
 import time
 import tempfile
-import pygame
-from gtts import gTTS
 import logging
 
+import metrics
+import tracing
+from lazy_import import lazy_import
+
+# Imported on first use rather than when the client starts
+pygame = lazy_import("pygame")
+gtts = lazy_import("gtts")
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+SYNTHESIS_SECONDS = metrics.histogram("tts_synthesis_seconds", "Time for gTTS to synthesize one chunk of speech")
+
 class GTTSVoiceService:
     def __init__(self, lang="en", slow=False, sentence_buffer_size=3):
         self.lang = lang
@@ -24,6 +32,11 @@ class GTTSVoiceService:
         self.sentence_endings = ".!?"
         self.playing = False
         self.stop_requested = False
+        # Turn being spoken, set by pi_client so synthesis and playback spans join its trace
+        self.trace_id = None
+        self._first_audio_traced = None
+        metrics.gauge("tts_text_queue_depth", "Tokens waiting to be synthesized", fn=self.text_queue.qsize)
+        metrics.gauge("tts_audio_queue_depth", "Synthesized chunks waiting to be played", fn=self.audio_queue.qsize)
     
     def start(self):
         self.active = True
@@ -133,8 +146,9 @@ class GTTSVoiceService:
         if not text:
             return
         temp_file = os.path.join(self.temp_dir, f"speech_{time.time()}.mp3")
-        tts = gTTS(text=text, lang=self.lang, slow=self.slow)
-        tts.save(temp_file)
+        with tracing.span("tts.synthesis", self.trace_id, chars=len(text)), SYNTHESIS_SECONDS.time():
+            tts = gtts.gTTS(text=text, lang=self.lang, slow=self.slow)
+            tts.save(temp_file)
         self.audio_queue.put(temp_file)
         logger.info(f"Audio file queued: {temp_file}")
     
@@ -148,6 +162,12 @@ class GTTSVoiceService:
                 audio_file = self.audio_queue.get(timeout=0.5)
                 if os.path.exists(audio_file):
                     self.playing = True
+                    trace_id = self.trace_id
+                    if trace_id and trace_id != self._first_audio_traced:
+                        # The moment the user starts hearing the answer
+                        self._first_audio_traced = trace_id
+                        tracing.instant("tts.first_audio", trace_id)
+                    playback_span = tracing.span("tts.playback", trace_id)
                     pygame.mixer.music.load(audio_file)
                     pygame.mixer.music.play()
                     logger.info(f"Playing audio: {audio_file}")
@@ -155,7 +175,9 @@ class GTTSVoiceService:
                         time.sleep(0.1)
                         if not self.active or self.stop_requested:
                             pygame.mixer.music.stop()
+                            playback_span.set(interrupted=True)
                             break
+                    playback_span.end()
                     try:
                         os.remove(audio_file)
                         logger.info(f"Deleted audio file: {audio_file}")
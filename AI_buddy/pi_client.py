@@ -1,14 +1,26 @@
 import socket
+import sys
 import time
 import logging
 import os
 import queue
 import random
 import threading
-import pygame
-import cv2
-from real_time_face_recognition.src.face_recognizer import detect_face_once
+
+# AI_buddy is deployed on its own, so it carries copies of the server's wire protocol and
+# telemetry modules (protocol, metrics, tracing, lazy_import); keep them identical to the
+# ones in the repository root
+import metrics
+import tracing
+from lazy_import import lazy_import, preload
 from gtts_voice_service import GTTSVoiceService
+from client_link import ClientLink
+from protocol import (MSG_NAME, MSG_INPUT, MSG_TTS, MSG_TTS_END, MSG_EXIT, MSG_CANCEL,
+                      MSG_CANCEL_ACK)
+
+# Imported on first use; the camera stack (OpenCV, Picamera2) loads while we connect
+pygame = lazy_import("pygame")
+face_recognizer = lazy_import("real_time_face_recognition.src.face_recognizer")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,10 +30,9 @@ logger = logging.getLogger(__name__)
 SONGS_DIR = os.path.join(os.path.dirname(__file__), "songs")
 
 def connect_to_server(host='192.168.143.248', port=65432):
-    """Connect to the laptop server"""
+    """Connect to the laptop server; the link resumes the session by itself after short drops"""
     try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((host, port))
+        client_socket = ClientLink(host, port).connect()
         logger.info(f"Connected to server at {host}:{port}")
         return client_socket
     except Exception as e:
@@ -29,12 +40,11 @@ def connect_to_server(host='192.168.143.248', port=65432):
         raise
 
 def reconnect_to_server(host='192.168.143.248', port=65432, max_attempts=3):
-    """Try to reconnect to the server with multiple attempts"""
+    """Start a new session after the link gave up resuming the old one"""
     for attempt in range(1, max_attempts + 1):
         try:
             logger.info(f"Reconnection attempt {attempt}/{max_attempts}")
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect((host, port))
+            client_socket = ClientLink(host, port).connect()
             logger.info(f"Reconnected to server at {host}:{port}")
             return client_socket
         except Exception as e:
@@ -83,25 +93,44 @@ def input_listener(running_event, input_queue):
             logger.error(f"Input error: {e}")
             break
 
-def process_server_response(client_socket, voice_service, stop_event):
-    """Process server responses and speak them until completion or interruption"""
+def process_server_response(client_socket, voice_service, stop_event, turn_span=None):
+    """
+    Process server responses and speak them until completion or interruption
+
+    Once stop_event is set a CANCEL has been sent: frames still in flight are discarded
+    until the server's CANCEL_ACK. turn_span, if given, is ended when the response is.
+    """
+    first_frame = True
     try:
-        while not stop_event.is_set():
+        while True:
             try:
-                data = client_socket.recv(1024).decode()
-                if not data:
-                    break
-                if data.startswith("TTS:"):
-                    text = data.replace("TTS:", "", 1).strip()
+                msg_type, text = client_socket.recv()
+                if msg_type == MSG_TTS:
+                    if stop_event.is_set():
+                        continue
+                    if first_frame and turn_span:
+                        tracing.instant("pi.first_tts_frame", turn_span.trace_id)
+                    first_frame = False
+                    text = text.strip()
                     if text:
                         logger.info(f"Speaking token: '{text}'")
                         voice_service.speak_token(text)
-                elif data == "TTS_END:":
+                elif msg_type == MSG_TTS_END:
+                    if stop_event.is_set():
+                        continue  # Finished before the CANCEL arrived; the ACK is still coming
                     logger.info("End of response received")
                     break
-                else:
-                    logger.warning(f"Unknown data: '{data}'")
+                elif msg_type == MSG_CANCEL_ACK:
+                    if stop_event.is_set():
+                        logger.info("Server confirmed the cancel")
+                        break
+                    # Late ACK for a response that had already finished
+                    continue
+                elif msg_type == MSG_EXIT:
+                    logger.info("Server closed the session")
                     break
+                else:
+                    logger.warning(f"Unknown message type {msg_type}: '{text}'")
             except socket.timeout:
                 logger.warning("Socket timeout, retrying...")
                 continue
@@ -111,9 +140,44 @@ def process_server_response(client_socket, voice_service, stop_event):
     except Exception as e:
         logger.error(f"Error in response processing: {e}")
     finally:
+        if turn_span:
+            turn_span.end(cancelled=stop_event.is_set())
         logger.info("Response processing completed")
 
+def start_response_thread(client_socket, voice_service, turn_span=None):
+    """Speak the server's next response in the background; returns (thread, stop event)"""
+    stop_response = threading.Event()
+    response_thread = threading.Thread(
+        target=process_server_response,
+        args=(client_socket, voice_service, stop_response, turn_span)
+    )
+    response_thread.daemon = True
+    response_thread.start()
+    return response_thread, stop_response
+
+def cancel_server_response(client_socket, response_thread, stop_event):
+    """Stop the response in flight on the server and wait until its frames are drained"""
+    if response_thread is None or not response_thread.is_alive():
+        return False
+    stop_event.set()
+    try:
+        client_socket.send(MSG_CANCEL)
+    except ConnectionError:
+        logger.error("Connection lost while cancelling the response")
+    response_thread.join(timeout=5.0)
+    logger.info("Cancelled the server response")
+    return True
+
 def main():
+    preload(face_recognizer)
+    # TRACE_FILE=pi_trace.json records per-turn spans; merge with the server's using tracing.py
+    tracing.configure(os.environ.get("TRACE_FILE"), process_name="pi")
+    # METRICS_PORT serves TTS and link metrics in the Prometheus format; METRICS_FILE keeps them at exit.
+    # Only on localhost unless METRICS_HOST says otherwise (0.0.0.0 lets a scraper on the LAN in)
+    metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+    if metrics_port:
+        metrics.start_http_server(metrics_port, host=os.environ.get("METRICS_HOST", "127.0.0.1"))
+
     # Initialize pygame mixer for sound operations
     if not pygame.mixer.get_init():
         pygame.mixer.init()
@@ -128,11 +192,11 @@ def main():
         
         # Perform face recognition with video display and send the name
         logger.info("Starting face detection with Picamera2 (10 seconds timeout)")
-        name, confidence = detect_face_once(timeout=10.0, show_video=True)
+        name, confidence = face_recognizer.detect_face_once(timeout=10.0, show_video=True)
         logger.info(f"Detected: {name} with confidence {confidence:.1f}%")
         
         # Send detected name to the server
-        client_socket.sendall(f"NAME:{name}".encode())
+        client_socket.send(MSG_NAME, name)
         logger.info(f"Sent name '{name}' to server")
         
         # Initialize GTTSVoiceService
@@ -149,12 +213,13 @@ def main():
             voice_service.speak_token("Hello! How can I help you today?")
         
         # Receive and speak the greeting from server
-        data = client_socket.recv(1024).decode()
-        if data.startswith("TTS:"):
-            greeting = data.replace("TTS:", "", 1).strip()
+        msg_type, greeting = client_socket.recv()
+        while msg_type == MSG_TTS:
+            greeting = greeting.strip()
             if greeting:
                 logger.info(f"Speaking greeting: '{greeting}'")
                 voice_service.speak_token(greeting)
+            msg_type, greeting = client_socket.recv()
         
         # Setup async input listener
         running = threading.Event()
@@ -165,6 +230,9 @@ def main():
         input_thread.start()
         
         music_playing = False
+        # The response being spoken; the main loop keeps reading input meanwhile so the user can barge in
+        response_thread = None
+        stop_response = None
         
         # Print initial prompt
         print("\nYou: ", end="", flush=True)
@@ -185,13 +253,16 @@ def main():
                 if user_input.lower() in ["exit", "quit", "bye"] or "ok bye" in user_input.lower():
                     # Say goodbye before exiting
                     voice_service.speak_token("Goodbye! It was nice talking with you.")
+                    cancel_server_response(client_socket, response_thread, stop_response)
                     voice_service.wait_until_done()  # Wait for goodbye to finish speaking
-                    client_socket.sendall("INPUT:exit".encode())
+                    client_socket.send(MSG_INPUT, "exit")
                     break
                 
                 # Check for stop commands
                 if any(command in user_input.lower() for command in ["stop", "stop speaking", "shut up"]):
-                    if voice_service.is_speaking():
+                    # Also stop the server generating the rest of the answer
+                    cancelled = cancel_server_response(client_socket, response_thread, stop_response)
+                    if cancelled or voice_service.is_speaking():
                         voice_service.stop_speaking()
                         logger.info("Stopped TTS playback")
                         continue
@@ -222,22 +293,38 @@ def main():
                     logger.info("Detected 'song' in input, playing a random song.")
                     music_playing = play_random_song()
                 else:
+                    # A new question interrupts the answer still in progress
+                    cancel_server_response(client_socket, response_thread, stop_response)
                     # Stop any current TTS before sending new input
                     voice_service.stop_speaking()
                     
                     # Give immediate feedback
                     voice_service.speak_token("Let me think about that...")
                     
-                    # Send input to server
+                    # Send input to server, tagged with a new trace ID for this turn
+                    trace_id = tracing.new_trace_id()
+                    voice_service.trace_id = trace_id
+                    turn_span = tracing.span("pi.turn", trace_id, input_chars=len(user_input))
                     try:
-                        client_socket.sendall(f"INPUT:{user_input}".encode())
+                        client_socket.send(MSG_INPUT, user_input, trace_id=trace_id)
                         logger.info(f"Sent input to server: '{user_input}'")
-                    except ConnectionError:
+                    except ConnectionError as e:
                         logger.error("Connection lost while sending input")
+                        # The question never reached the server; close the turn so it shows in the trace
+                        turn_span.end(error=f"send failed: {e}")
                         voice_service.speak_token("I'm having trouble connecting to the server. Let me try to reconnect.")
                         client_socket = reconnect_to_server()
                         if client_socket:
+                            # A new session on the server: skip its greeting and ask the question again
+                            client_socket.send(MSG_NAME, name)
+                            while client_socket.recv()[0] == MSG_TTS:
+                                pass
                             voice_service.speak_token("Connection restored!")
+                            turn_span = tracing.span("pi.turn", trace_id, input_chars=len(user_input), resent=True)
+                            client_socket.send(MSG_INPUT, user_input, trace_id=trace_id)
+                            logger.info(f"Resent input to server: '{user_input}'")
+                            response_thread, stop_response = start_response_thread(client_socket, voice_service,
+                                                                                   turn_span)
                             continue
                         else:
                             voice_service.speak_token("Sorry, I couldn't reconnect to the server. Please restart me.")
@@ -247,16 +334,7 @@ def main():
                     voice_service.stop_speaking()
                     
                     # Process server response
-                    stop_response = threading.Event()
-                    response_thread = threading.Thread(
-                        target=process_server_response,
-                        args=(client_socket, voice_service, stop_response)
-                    )
-                    response_thread.daemon = True
-                    response_thread.start()
-                    
-                    # Wait for response to complete or be interrupted
-                    response_thread.join()
+                    response_thread, stop_response = start_response_thread(client_socket, voice_service, turn_span)
             
             # Sleep to avoid high CPU usage
             time.sleep(0.1)
@@ -269,7 +347,11 @@ def main():
             voice_service.stop()
         if client_socket:
             client_socket.close()
-        cv2.destroyAllWindows()  # Ensure all OpenCV windows are closed
+        if "cv2" in sys.modules:
+            sys.modules["cv2"].destroyAllWindows()  # Ensure all OpenCV windows are closed
+        tracing.configure(None)
+        if os.environ.get("METRICS_FILE"):
+            metrics.dump(os.environ["METRICS_FILE"])
         logger.info("Client shut down")
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+"""
+AsyncBridge - Runs async LLM streams on a shared background event loop for sync callers
+"""
+import asyncio
+import queue
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+_DONE = object()
+
+class StreamStatus:
+    """
+    Outcome of one async LLM stream
+
+    The services report failures as text; given a StreamStatus, agenerate_stream also sets
+    its error just before yielding that text. Unlike the services' last_error it belongs to
+    a single call, so streams interleaved on the shared loop never see each other's errors.
+    """
+
+    def __init__(self):
+        self.error = None
+
+class _StreamError:
+    def __init__(self, exc):
+        self.exc = exc
+
+def get_event_loop():
+    """Return the shared background event loop, starting it on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="async-bridge", daemon=True)
+            thread.start()
+        return _loop
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the background loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+def iterate_sync(agen):
+    """
+    Iterate an async generator from synchronous code
+
+    Items are handed over through a queue as soon as the background loop produces them.
+    Closing the returned generator (or breaking out of a for loop over it) cancels the
+    async stream, so the backend request is torn down instead of running to completion.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            items.put(_StreamError(e))
+        finally:
+            await agen.aclose()
+            items.put(_DONE)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), get_event_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StreamError):
+                raise item.exc
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,166 @@
+"""
+BackendRouter - Picks the LLM backend per request from observed latency and errors
+"""
+import threading
+import time
+from typing import Dict, List
+
+class BackendStats:
+    """Exponentially weighted moving averages of a backend's recent behaviour"""
+
+    def __init__(self, alpha=0.3, prior_ttft=2.0, prior_tps=15.0, error_half_life=60.0):
+        self.alpha = alpha
+        self.ttft = prior_ttft
+        self.tokens_per_sec = prior_tps
+        # Errors fade with time as well as with successes, so a backend that was skipped
+        # for failing gets another chance once things have had time to recover
+        self.error_half_life = error_half_life
+        self._error_rate = 0.0
+        self._error_rate_at = time.monotonic()
+        self.samples = 0
+
+    @property
+    def error_rate(self):
+        elapsed = time.monotonic() - self._error_rate_at
+        return self._error_rate * 0.5 ** (elapsed / self.error_half_life)
+
+    def _set_error_rate(self, value):
+        self._error_rate = value
+        self._error_rate_at = time.monotonic()
+
+    def _update(self, current, value):
+        return value if self.samples == 0 else (1 - self.alpha) * current + self.alpha * value
+
+    def record_success(self, ttft, tokens_per_sec):
+        self.ttft = self._update(self.ttft, ttft)
+        if tokens_per_sec:
+            self.tokens_per_sec = self._update(self.tokens_per_sec, tokens_per_sec)
+        self._set_error_rate((1 - self.alpha) * self.error_rate)
+        self.samples += 1
+
+    def record_error(self):
+        self._set_error_rate((1 - self.alpha) * self.error_rate + self.alpha)
+        self.samples += 1
+
+    def expected_latency(self, expected_tokens=150):
+        """Seconds until a typical answer has finished streaming"""
+        return self.ttft + expected_tokens / max(self.tokens_per_sec, 0.1)
+
+    def __str__(self):
+        return f"ttft {self.ttft:.2f}s, {self.tokens_per_sec:.1f} tok/s, err {self.error_rate:.0%}"
+
+class BackendRouter:
+    def __init__(self, local_service, cloud_service, short_prompt_tokens=600, long_prompt_tokens=2000,
+                 max_error_rate=0.5):
+        self.local_service = local_service
+        self.cloud_service = cloud_service
+        # Prompts below short_prompt_tokens stay local and above long_prompt_tokens go to the
+        # cloud, unless that backend is unhealthy; in between the faster backend wins
+        self.short_prompt_tokens = short_prompt_tokens
+        self.long_prompt_tokens = long_prompt_tokens
+        self.max_error_rate = max_error_rate
+        self.stats = {
+            local_service: BackendStats(),
+            cloud_service: BackendStats(),
+        }
+        # The router is shared by all sessions, so the backend that answered is tracked per thread
+        self._request_state = threading.local()
+
+    @property
+    def last_service(self):
+        return getattr(self._request_state, "last_service", None)
+
+    @last_service.setter
+    def last_service(self, service):
+        self._request_state.last_service = service
+
+    @property
+    def last_error(self):
+        service = self.last_service
+        return service.last_error if service else "No backend was tried"
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]]) -> int:
+        # ~4 characters per token is close enough for routing
+        return sum(len(msg.get("content", "")) for msg in messages) // 4
+
+    def _is_usable(self, service) -> bool:
+        return (service.breaker.cached_health() is not False
+                and self.stats[service].error_rate <= self.max_error_rate)
+
+    def choose(self, messages: List[Dict[str, str]]):
+        """
+        Rank the backends for this request
+
+        Returns:
+        - (ordered list of services to try, reason for the first choice, estimated prompt tokens)
+        """
+        prompt_tokens = self._estimate_tokens(messages)
+        local, cloud = self.local_service, self.cloud_service
+        usable = [service for service in (local, cloud) if self._is_usable(service)]
+
+        if len(usable) == 1:
+            first, reason = usable[0], "only healthy backend"
+        elif not usable:
+            first, reason = local, "no healthy backend, trying local first"
+        elif prompt_tokens >= self.long_prompt_tokens:
+            first, reason = cloud, "long prompt"
+        elif prompt_tokens < self.short_prompt_tokens:
+            first, reason = local, "short prompt"
+        else:
+            first = min(usable, key=lambda service: self.stats[service].expected_latency())
+            reason = "lowest expected latency"
+
+        second = cloud if first is local else local
+        return [first, second], reason, prompt_tokens
+
+    def generate_stream(self, messages: List[Dict[str, str]]):
+        """
+        Stream from the best backend, failing over to the other one automatically if the
+        first fails before producing any token
+        """
+        candidates, reason, prompt_tokens = self.choose(messages)
+        print(f"\n[Router: {candidates[0].model_name} ({reason}, prompt ~{prompt_tokens} tokens) | "
+              f"local: {self.stats[self.local_service]} | cloud: {self.stats[self.cloud_service]}]", flush=True)
+
+        for attempt, service in enumerate(candidates):
+            self.last_service = service
+            stats = self.stats[service]
+            start_time = time.perf_counter()
+            first_token_time = None
+            tokens = 0
+            failed_before_output = False
+
+            stream = service.generate_stream(messages)
+            try:
+                for token in stream:
+                    # The services report failures as text and set last_error just before yielding it
+                    if first_token_time is None and service.last_error:
+                        failed_before_output = True
+                        stream.close()
+                        break
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    tokens += 1
+                    yield token
+            except GeneratorExit:
+                # Cancelled by the caller: pass the close on so the backend request is torn down
+                stream.close()
+                raise
+
+            if failed_before_output:
+                stats.record_error()
+                if attempt + 1 < len(candidates):
+                    print(f"\n[Router: {service.model_name} failed ({service.last_error}), "
+                          f"failing over to {candidates[attempt + 1].model_name}]", flush=True)
+                    continue
+                yield f"[Both models failed: {service.last_error}]"
+                return
+
+            if service.last_error or first_token_time is None:
+                stats.record_error()
+            else:
+                # Speed after the first token, so the time to first token is not counted twice
+                elapsed = time.perf_counter() - first_token_time
+                tokens_per_sec = (tokens - 1) / elapsed if tokens > 1 and elapsed > 0 else None
+                stats.record_success(first_token_time - start_time, tokens_per_sec)
+            return
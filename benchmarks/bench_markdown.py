@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for stripping Markdown from the LLM token stream
+
+Feeds a Markdown-heavy answer, split into LLM-sized tokens, through the old per-token
+regex chain and the streaming MarkdownStripper, and reports throughput and how many
+Markdown markers each one let through to the TTS.
+
+    python benchmarks/bench_markdown.py [--repeats 200]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from markdown_stripper import MarkdownStripper
+
+ANSWER = """## Reversing a list in Python
+
+There are **two common ways** to do it:
+
+1. Call `items.reverse()` to reverse the list *in place*.
+2. Use slicing, `items[::-1]`, which returns a **new** list.
+
+- The first one is **faster** for big lists
+- The second keeps the __original__ list unchanged
+
+```python
+items = [1, 2, 3]
+print(items[::-1])
+```
+
+See the [Python docs](https://docs.python.org/3/tutorial/datastructures.html) for more.
+"""
+
+def tokenize(text):
+    """Split roughly the way LLM tokenizers do: words, leading spaces and punctuation apart"""
+    return re.findall(r" ?\w+|\s+|[^\w\s]{1,2}", text)
+
+def regex_strip(text):
+    """The previous implementation, applied to every token"""
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'__(.*?)__', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'_(.*?)_', r'\1', text)
+    text = re.sub(r'#+\s*', '', text)
+    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+    return text.strip()
+
+def run_regex(tokens):
+    return "".join(regex_strip(token) for token in tokens)
+
+def run_streaming(tokens):
+    stripper = MarkdownStripper()
+    return "".join(stripper.feed(token) for token in tokens) + stripper.flush()
+
+def leaked_markers(text):
+    return len(re.findall(r"\*|__|^#|```|\]\(", text, re.MULTILINE))
+
+def run(name, function, tokens, repeats):
+    output = function(tokens)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function(tokens)
+    elapsed = time.perf_counter() - start_time
+    per_token_us = elapsed / (repeats * len(tokens)) * 1e6
+    mb_per_sec = repeats * sum(map(len, tokens)) / elapsed / 1e6
+    print(f"{name:<28} {per_token_us:6.2f} us/token  {mb_per_sec:6.2f} MB/s  "
+          f"{leaked_markers(output):>3} markers leaked")
+    return per_token_us
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    tokens = tokenize(ANSWER)
+    print(f"{len(tokens)} tokens, {len(ANSWER)} characters\n")
+    before = run("regex chain per token", run_regex, tokens, args.repeats)
+    after = run("streaming stripper", run_streaming, tokens, args.repeats)
+    print(f"\nPer-token cost reduced {before / after:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Loopback throughput test for the Pi <-> server wire protocol
+
+Streams a burst of TTS tokens over a TCP loopback socket, once with the legacy string
+prefixes (one recv() treated as one message) and once with length-prefixed frames, and
+reports throughput and how many tokens the receiver got back intact.
+
+    python benchmarks/bench_protocol.py [--tokens 20000]
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import accept_handshake, client_handshake, MSG_TTS, MSG_TTS_END
+
+WORDS = "The quick brown fox jumps over the lazy dog while the desk buddy explains it".split()
+
+def tokens(count):
+    return [" " + WORDS[i % len(WORDS)] for i in range(count)]
+
+def loopback_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return server, client
+
+def legacy_receiver(sock, received):
+    """The previous Pi client loop: each recv() is assumed to be exactly one message"""
+    while True:
+        data = sock.recv(1024).decode(errors="replace")
+        if not data or data == "TTS_END:":
+            return
+        # Glued messages still start with "TTS:" and are spoken as one garbled token;
+        # anything else was "Unknown data" to the old client. Keep reading either way
+        # so the sender never blocks on a full socket buffer.
+        received.append(data[len("TTS:"):] if data.startswith("TTS:") else None)
+
+def run_legacy(stream):
+    server, client = loopback_pair()
+    received = []
+    reader = threading.Thread(target=legacy_receiver, args=(client, received))
+    reader.start()
+    start_time = time.perf_counter()
+    for token in stream:
+        server.sendall(f"TTS:{token}".encode())
+    server.sendall("TTS_END:".encode())
+    server.shutdown(socket.SHUT_WR)
+    reader.join()
+    elapsed = time.perf_counter() - start_time
+    server.close()
+    client.close()
+    return elapsed, received
+
+def run_framed(stream):
+    server, client = loopback_pair()
+    # The client announces itself first, as pi_client does on connect
+    client_channel = client_handshake(client)
+    server_channel = accept_handshake(server)
+    received = []
+
+    def receiver():
+        while True:
+            msg_type, text = client_channel.recv()
+            if msg_type == MSG_TTS_END:
+                return
+            received.append(text)
+
+    reader = threading.Thread(target=receiver)
+    reader.start()
+    start_time = time.perf_counter()
+    for token in stream:
+        server_channel.send(MSG_TTS, token)
+    server_channel.send(MSG_TTS_END)
+    reader.join()
+    elapsed = time.perf_counter() - start_time
+    server_channel.close()
+    client_channel.close()
+    return elapsed, received
+
+def report(name, stream, elapsed, received):
+    intact = sum(1 for sent, got in zip(stream, received) if sent == got)
+    print(f"{name:<26} {intact / elapsed:10.0f} intact msgs/s  "
+          f"{len(received):>6} messages received, {intact}/{len(stream)} tokens intact")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    stream = tokens(args.tokens)
+    print(f"Sending {len(stream)} TTS tokens over 127.0.0.1\n")
+    report("legacy string prefixes", stream, *run_legacy(stream))
+    report("length-prefixed frames", stream, *run_framed(stream))
+
+if __name__ == "__main__":
+    main()
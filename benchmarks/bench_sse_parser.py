@@ -0,0 +1,121 @@
+"""
+Micro-benchmark for the DeepSeek SSE stream parser
+
+Replays a recorded chat completions stream (or a synthetic one shaped like DeepSeek's)
+through the old SSEClient + json.loads path and the raw-line parser, and reports the
+per-token parsing overhead of each.
+
+    python benchmarks/bench_sse_parser.py [--stream recorded.sse] [--tokens 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deepseek_service
+from deepseek_service import parse_sse_line
+
+def synthetic_stream(tokens):
+    """Build a raw SSE body with the same shape as DeepSeek's streaming responses"""
+    words = "The quick brown fox jumps over the lazy dog while the desk buddy explains it".split()
+    events = []
+    for i in range(tokens):
+        chunk = {
+            "id": "b2f1c6a0-0000-4000-8000-000000000000",
+            "object": "chat.completion.chunk",
+            "created": 1744000000,
+            "model": "deepseek-chat",
+            "system_fingerprint": "fp_3a5770e1b4",
+            "choices": [{"index": 0, "delta": {"content": " " + words[i % len(words)]},
+                         "logprobs": None, "finish_reason": None}],
+        }
+        events.append(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+    final = {"id": "b2f1c6a0", "object": "chat.completion.chunk", "model": "deepseek-chat",
+             "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}]}
+    events.append(b"data: " + json.dumps(final).encode() + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+def network_chunks(body, size=1024):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+def legacy_parse(chunks):
+    """The previous implementation: SSEClient events, json.loads and two choices lookups"""
+    from sseclient import SSEClient
+    tokens = 0
+    for event in SSEClient(iter(chunks)).events():
+        if event.event == "message":
+            try:
+                data = json.loads(event.data)
+                if "choices" in data and data["choices"]:
+                    token = data["choices"][0]["delta"].get("content", "")
+                    if token:
+                        tokens += 1
+                    if data.get("choices", [{}])[0].get("finish_reason") == "stop":
+                        break
+            except json.JSONDecodeError:
+                pass
+    return tokens
+
+def fast_parse(chunks):
+    """The current implementation: split raw lines and parse only data: payloads"""
+    tokens = 0
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            token, finished = parse_sse_line(line)
+            if token:
+                tokens += 1
+            if finished:
+                return tokens
+    return tokens
+
+def run(name, parser, chunks, repeats):
+    tokens = parser(chunks)
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        parser(chunks)
+    elapsed = time.perf_counter() - start_time
+    per_token_us = elapsed / (repeats * max(tokens, 1)) * 1e6
+    print(f"{name:<32} {tokens:>6} tokens  {per_token_us:8.2f} us/token")
+    return per_token_us
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stream", help="Raw SSE body recorded from the DeepSeek API")
+    parser.add_argument("--tokens", type=int, default=2000, help="Tokens in the synthetic stream")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.stream:
+        with open(args.stream, "rb") as f:
+            body = f.read()
+    else:
+        body = synthetic_stream(args.tokens)
+    chunks = network_chunks(body)
+    print(f"Replaying {len(body) / 1024:.0f} KiB of SSE in {len(chunks)} network chunks\n")
+
+    results = {}
+    try:
+        results["before"] = run("SSEClient + json.loads (before)", legacy_parse, chunks, args.repeats)
+    except ImportError:
+        print("SSEClient + json.loads (before)  skipped: sseclient-py not installed")
+
+    original_loads = deepseek_service._json_loads
+    deepseek_service._json_loads = json.loads
+    results["stdlib"] = run("raw lines + json.loads", fast_parse, chunks, args.repeats)
+    deepseek_service._json_loads = original_loads
+    if original_loads is not json.loads:
+        results["after"] = run("raw lines + orjson (after)", fast_parse, chunks, args.repeats)
+
+    if "before" in results:
+        best = results.get("after", results["stdlib"])
+        print(f"\nPer-token parsing overhead reduced {results['before'] / best:.1f}x")
+
+if __name__ == "__main__":
+    main()
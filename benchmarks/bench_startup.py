@@ -0,0 +1,98 @@
+"""
+Benchmark: import cost of the server and Pi client entry points
+
+Imports main.py and AI_buddy/pi_client.py in fresh interpreters with -X importtime,
+reports the median wall time of the import and the modules that take the longest, so a
+heavy dependency creeping back into the import path shows up immediately.
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    "server (main.py)": (REPO_DIR, "main"),
+    "Pi client (AI_buddy/pi_client.py)": (os.path.join(REPO_DIR, "AI_buddy"), "pi_client"),
+}
+
+def parse_importtime(stderr: str):
+    """
+    Parse -X importtime output
+
+    Returns:
+    - list of (module, depth, self µs, cumulative µs), in import order
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented two spaces per level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        modules.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return modules
+
+def direct_imports(profile, module: str):
+    """The modules imported directly by module; importtime lists children before their parent"""
+    for index in range(len(profile) - 1, -1, -1):
+        if profile[index][0] == module and profile[index][1] == 0:
+            break
+    else:
+        return []
+    children = []
+    for entry in reversed(profile[:index]):
+        if entry[1] == 0:
+            break
+        if entry[1] == 1:
+            children.append(entry)
+    return children
+
+def profile_import(cwd: str, module: str):
+    """Import module once in a fresh interpreter; returns (wall seconds, parsed profile, error)"""
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start_time
+    error = None
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+    return elapsed, parse_importtime(result.stderr), error
+
+def report(label: str, cwd: str, module: str, runs: int, top: int):
+    print(f"\n{label}")
+    walls = []
+    profile, error = [], None
+    for _ in range(runs):
+        elapsed, profile, error = profile_import(cwd, module)
+        walls.append(elapsed)
+    if error:
+        print(f"  import failed: {error}")
+    print(f"  wall time (median of {runs}): {statistics.median(walls) * 1000:.0f} ms")
+    entry = [m for m in profile if m[0] == module]
+    if entry:
+        print(f"  import {module}: {entry[-1][3] / 1000:.1f} ms cumulative")
+    print(f"  heaviest direct imports by cumulative time (top {top}):")
+    for name, _, _, cumulative_us in sorted(direct_imports(profile, module), key=lambda m: m[3], reverse=True)[:top]:
+        print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+    return statistics.median(walls)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    # Interpreter start-up without any of our modules, the floor both entry points pay
+    baseline = min(profile_import(REPO_DIR, "sys")[0] for _ in range(args.runs))
+    print(f"Bare interpreter start: {baseline * 1000:.0f} ms")
+    for label, (cwd, module) in ENTRY_POINTS.items():
+        report(label, cwd, module, args.runs, args.top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Local stand-in for the Ollama and DeepSeek APIs, for offline benchmarks and load tests
+
+Serves both APIs from one port with deterministic, configurable timing:
+
+- Ollama: POST /api/chat (NDJSON stream or single reply), POST /api/generate (the empty
+  prompt warm-up) and GET /api/tags
+- OpenAI-style (DeepSeek): POST /v1/chat/completions (SSE stream or single reply) and
+  GET /models
+
+Point the server at it and run it without a GPU or network:
+
+    python benchmarks/fake_llm_server.py --port 11500 --ttft 0.4 --inter-token 0.03
+    OLLAMA_HOST=http://127.0.0.1:11500 DEEPSEEK_BASE_URL=http://127.0.0.1:11500 python main.py
+
+Replies come from --responses (a JSON list of strings, or a text file with one reply per
+paragraph) and are picked by a hash of the last user message, so the same question
+always gets the same answer. --error-rate and --disconnect-rate inject failures using
+--seed, so a run with the same flags and inputs fails the same way.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSES = [
+    "Sure! Here is a quick overview. First, break the task into small steps. Then tackle the "
+    "hardest one while you are fresh, and take a short break every hour.",
+    "That is a great question. The short answer is yes, but it depends on the details. "
+    "Tell me a bit more and I can give you a more specific answer.",
+    "Here is what I found in your notes. You planned to review the report today, and the "
+    "meeting with the team is tomorrow at ten.",
+]
+
+class FakeModel:
+    """Timing, canned replies and failure injection shared by every request"""
+
+    def __init__(self, responses, ttft=0.3, inter_token=0.02, jitter=0.0, load_time=0.0,
+                 error_rate=0.0, disconnect_rate=0.0, max_tokens=None, seed=0):
+        self.responses = responses
+        self.ttft = ttft
+        self.inter_token = inter_token
+        self.jitter = jitter
+        # Simulated model load paid by the first request only, like a cold Ollama
+        self.load_time = load_time
+        self.loaded = load_time <= 0
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.max_tokens = max_tokens
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+
+    def pick_reply(self, messages, model=None, stream=True):
+        last_user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        reply = self.responses[zlib.crc32(last_user.encode("utf-8")) % len(self.responses)]
+        tokens = re.findall(r"\s*\S+", reply)
+        return tokens[:self.max_tokens] if self.max_tokens else tokens
+
+    def plan(self, tokens):
+        """
+        Decide the fate of one request for the reply tokens up front
+
+        Returns:
+        - (load seconds, fail with HTTP 500, number of tokens before the connection drops or None)
+        """
+        with self._lock:
+            self.requests += 1
+            load = 0.0 if self.loaded else self.load_time
+            self.loaded = True
+            fail = self.random.random() < self.error_rate
+            drop_after = (self.random.randrange(max(1, len(tokens)))
+                          if self.random.random() < self.disconnect_rate else None)
+        return load, fail, drop_after
+
+    def token_delays(self, tokens):
+        """Seconds to wait before each token: time to first token, then the inter-token gap"""
+        return [self.ttft] + [self.inter_token] * (len(tokens) - 1) if tokens else []
+
+    def delay(self, base):
+        if self.jitter:
+            with self._lock:
+                base *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, base))
+
+    def count_token(self):
+        with self._lock:
+            self.tokens += 1
+
+class _Disconnect(Exception):
+    pass
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, which the services' pooled clients rely on
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; Nagle would hold the body back ~40 ms
+    disable_nagle_algorithm = True
+    model: FakeModel = None
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        # Each token goes out as its own chunk, flushed at once, like a real streaming server
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _disconnect(self):
+        # Drop mid-body without the terminating chunk, as a crashed backend or network would
+        self.close_connection = True
+        self.wfile.flush()
+        raise _Disconnect()
+
+    def _stream_tokens(self, tokens, drop_after, write_token):
+        for i, (token, delay) in enumerate(zip(tokens, self.model.token_delays(tokens))):
+            self.model.delay(delay)
+            if drop_after is not None and i >= drop_after:
+                self._disconnect()
+            write_token(token)
+            self.model.count_token()
+        if drop_after is not None:
+            self._disconnect()  # Cut off after the last token, before the end of the response
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": name, "model": name, "size": 0}
+                                             for name in self.server.model_names]})
+        elif self.path in ("/models", "/v1/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": name, "object": "model"}
+                                                             for name in self.server.model_names]})
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        request = self._read_json()
+        try:
+            if self.path == "/api/chat":
+                self._ollama_chat(request)
+            elif self.path == "/api/generate":
+                self._ollama_generate(request)
+            elif self.path in ("/v1/chat/completions", "/chat/completions"):
+                self._openai_chat(request)
+            else:
+                self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+        except (_Disconnect, BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _ollama_generate(self, request):
+        load, fail, _ = self.model.plan([])
+        time.sleep(load)
+        if fail:
+            self._send_json(500, {"error": "injected failure"})
+            return
+        self._send_json(200, {"model": request.get("model", ""), "created_at": _now(), "response": "",
+                              "done": True, "done_reason": "load", "load_duration": int(load * 1e9)})
+
+    def _ollama_chat(self, request):
+        model_name = request.get("model", "")
+        tokens = self.model.pick_reply(request.get("messages", []), model_name, request.get("stream", True))
+        load, fail, drop_after = self.model.plan(tokens)
+        start_time = time.perf_counter()
+        time.sleep(load)
+        if fail:
+            self._send_json(500, {"error": "injected failure"})
+            return
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+
+        def final_stats():
+            elapsed = time.perf_counter() - start_time
+            return {"done": True, "done_reason": "stop", "total_duration": int(elapsed * 1e9),
+                    "load_duration": int(load * 1e9), "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(self.model.ttft * 1e9), "eval_count": len(tokens),
+                    "eval_duration": int(max(0.0, elapsed - load - self.model.ttft) * 1e9)}
+
+        if request.get("stream", True) is False:
+            self._stream_tokens(tokens, drop_after, lambda token: None)
+            self._send_json(200, {"model": model_name, "created_at": _now(),
+                                  "message": {"role": "assistant", "content": "".join(tokens)},
+                                  **final_stats()})
+            return
+
+        self._start_chunked("application/x-ndjson")
+
+        def write_token(token):
+            self._write_chunk(json.dumps({"model": model_name, "created_at": _now(),
+                                          "message": {"role": "assistant", "content": token},
+                                          "done": False}).encode("utf-8") + b"\n")
+
+        self._stream_tokens(tokens, drop_after, write_token)
+        self._write_chunk(json.dumps({"model": model_name, "created_at": _now(),
+                                      "message": {"role": "assistant", "content": ""},
+                                      **final_stats()}).encode("utf-8") + b"\n")
+        self._end_chunked()
+
+    def _openai_chat(self, request):
+        model_name = request.get("model", "")
+        tokens = self.model.pick_reply(request.get("messages", []), model_name, bool(request.get("stream")))
+        load, fail, drop_after = self.model.plan(tokens)
+        time.sleep(load)
+        if fail:
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+        completion_id = f"fake-{self.model.requests}"
+        created = int(time.time())
+
+        if not request.get("stream"):
+            self._stream_tokens(tokens, drop_after, lambda token: None)
+            self._send_json(200, {"id": completion_id, "object": "chat.completion", "created": created,
+                                  "model": model_name,
+                                  "choices": [{"index": 0, "finish_reason": "stop",
+                                               "message": {"role": "assistant", "content": "".join(tokens)}}],
+                                  "usage": {"completion_tokens": len(tokens)}})
+            return
+
+        self._start_chunked("text/event-stream")
+
+        def event(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                     "model": model_name,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self._write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+
+        event({"role": "assistant", "content": ""})
+        self._stream_tokens(tokens, drop_after, lambda token: event({"content": token}))
+        event({"content": ""}, "stop")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def load_responses(path):
+    """A JSON list of replies, or plain text with one reply per blank-line separated paragraph"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return [str(reply) for reply in json.loads(text)]
+    return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+def start_server(model: FakeModel, host="127.0.0.1", port=0, model_names=("llama3.2:3b", "deepseek-chat"),
+                 quiet=True):
+    """Run the fake server in a background thread; returns the server (server_address has the port)"""
+    handler = type("Handler", (FakeLLMHandler,), {"model": model, "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.model_names = list(model_names)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--inter-token", type=float, default=0.02, help="seconds between tokens")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction applied to every delay")
+    parser.add_argument("--load-time", type=float, default=0.0, help="extra delay of the first request (cold model)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                        help="fraction of streams cut off at a random token")
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--responses", help="JSON list or paragraph-separated text file of replies")
+    parser.add_argument("--models", default="llama3.2:3b,deepseek-chat", help="model names to advertise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    responses = load_responses(args.responses) if args.responses else DEFAULT_RESPONSES
+    model = FakeModel(responses, ttft=args.ttft, inter_token=args.inter_token, jitter=args.jitter,
+                      load_time=args.load_time, error_rate=args.error_rate,
+                      disconnect_rate=args.disconnect_rate, max_tokens=args.max_tokens, seed=args.seed)
+    server = start_server(model, args.host, args.port, args.models.split(","), quiet=not args.verbose)
+    print(f"Fake LLM server on http://{args.host}:{server.server_address[1]} "
+          f"(TTFT {args.ttft * 1000:.0f} ms, {args.inter_token * 1000:.0f} ms/token, {len(responses)} replies)")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"Served {model.requests} requests, {model.tokens} tokens")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Headless load generator: many simulated Pi clients against a running server
+
+Each simulated desk connects with the framed protocol, sends a NAME greeting, then asks
+questions with think time in between, like a person at the Pi would. Reports per-turn
+time to the first TTS frame, full response latency, barge-in (CANCEL) latency and
+throughput, to size the server for several desks.
+
+    # A server that needs no GPU or network: the fake LLM plus a local bind address
+    python benchmarks/fake_llm_server.py --port 11500 &
+    SERVER_HOST=127.0.0.1 HISTORY_FILE=/tmp/load_history.json \\
+        OLLAMA_HOST=http://127.0.0.1:11500 DEEPSEEK_BASE_URL=http://127.0.0.1:11500 python main.py &
+    python benchmarks/load_client.py --host 127.0.0.1 --clients 8 --turns 5 --think 2
+
+Every session ends up in the server's chat history, hence the separate HISTORY_FILE.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Histogram
+from protocol import (CONTROL_TYPES, MAGIC, MSG_CANCEL, MSG_CANCEL_ACK, MSG_EXIT, MSG_INPUT, MSG_NAME, MSG_TTS,
+                      MSG_TTS_END, encode_frame, read_frame, tune_socket)
+
+DEFAULT_PROMPTS = [
+    "What should I focus on this afternoon?",
+    "Can you explain how a hash map works?",
+    "Give me three tips for a productive meeting.",
+    "Summarize what we talked about yesterday.",
+    "How do I stay focused when working from home?",
+    "What is a good way to learn a new programming language?",
+    "Tell me a fun fact about space.",
+    "How can I write clearer emails?",
+]
+
+class LoadStats:
+    def __init__(self):
+        self.first_frame = Histogram()
+        self.full_response = Histogram()
+        self.cancel_ack = Histogram()
+        self.greeting = Histogram()
+        self.turns = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.connect_failures = 0
+        self.frames = 0
+        self.bytes = 0
+
+async def read_message(reader, stats):
+    """Next data message, skipping session control frames"""
+    while True:
+        message = await read_frame(reader)
+        if message[0] not in CONTROL_TYPES:
+            stats.frames += 1
+            stats.bytes += len(message[1].encode("utf-8"))
+            return message
+
+async def read_response(reader, stats, timeout):
+    """Read one response; returns (seconds to the first TTS frame or None, frames received)"""
+    start_time = time.perf_counter()
+    first_frame = None
+    frames = 0
+    while True:
+        msg_type, _ = await asyncio.wait_for(read_message(reader, stats), timeout)
+        if msg_type == MSG_TTS:
+            frames += 1
+            if first_frame is None:
+                first_frame = time.perf_counter() - start_time
+        elif msg_type in (MSG_TTS_END, MSG_EXIT):
+            return first_frame, frames
+
+async def run_turn(reader, writer, text, stats, args, rng):
+    start_time = time.perf_counter()
+    writer.write(encode_frame(MSG_INPUT, text))
+    await writer.drain()
+    barge_in = rng.random() < args.barge_in
+    first_frame = None
+    while True:
+        msg_type, _ = await asyncio.wait_for(read_message(reader, stats), args.timeout)
+        if msg_type == MSG_TTS and first_frame is None:
+            first_frame = time.perf_counter() - start_time
+            stats.first_frame.observe(first_frame)
+            if barge_in:
+                cancel_time = time.perf_counter()
+                writer.write(encode_frame(MSG_CANCEL))
+                await writer.drain()
+                # Frames already in flight arrive first; the ACK marks the end of the response
+                while (await asyncio.wait_for(read_message(reader, stats), args.timeout))[0] != MSG_CANCEL_ACK:
+                    pass
+                stats.cancel_ack.observe(time.perf_counter() - cancel_time)
+                stats.cancelled += 1
+                return
+        elif msg_type == MSG_TTS_END:
+            if first_frame is None:
+                # Empty response: the end marker is the first thing the user notices
+                stats.first_frame.observe(time.perf_counter() - start_time)
+            stats.full_response.observe(time.perf_counter() - start_time)
+            stats.turns += 1
+            return
+        elif msg_type == MSG_EXIT:
+            raise ConnectionResetError("Server ended the session")
+
+async def run_client(index, args, prompts, stats):
+    rng = random.Random(args.seed * 1000 + index)
+    # Stagger the connects over the ramp-up so the first turns do not all arrive at once
+    await asyncio.sleep(args.ramp_up * index / max(1, args.clients))
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), args.timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        stats.connect_failures += 1
+        print(f"Client {index}: could not connect: {e}")
+        return
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        tune_socket(sock)
+    try:
+        start_time = time.perf_counter()
+        writer.write(MAGIC + encode_frame(MSG_NAME, f"{args.name_prefix}{index}"))
+        await writer.drain()
+        await read_response(reader, stats, args.timeout)
+        stats.greeting.observe(time.perf_counter() - start_time)
+
+        for turn in range(args.turns):
+            think = rng.expovariate(1 / args.think) if args.poisson and args.think > 0 else args.think
+            await asyncio.sleep(think)
+            text = prompts[(index + turn) % len(prompts)] if args.script else rng.choice(prompts)
+            try:
+                await run_turn(reader, writer, text, stats, args, rng)
+            except asyncio.TimeoutError:
+                stats.errors += 1
+                print(f"Client {index}: no response within {args.timeout:.0f}s, giving up on this client")
+                return
+
+        writer.write(encode_frame(MSG_INPUT, "exit"))
+        await writer.drain()
+        await read_response(reader, stats, args.timeout)
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        stats.errors += 1
+        print(f"Client {index}: connection lost: {e}")
+    finally:
+        writer.close()
+
+def format_histogram(label, histogram):
+    if not histogram.count:
+        return f"  {label:<22} -"
+    quantiles = "  ".join(f"p{int(q * 100)} {histogram.quantile(q) * 1000:7.0f}" for q in (0.5, 0.9, 0.99))
+    return f"  {label:<22} {quantiles}  max {histogram.max * 1000:7.0f} ms  (n={histogram.count})"
+
+def report(stats, args, elapsed):
+    print(f"\n{args.clients} clients x {args.turns} turns against {args.host}:{args.port} in {elapsed:.1f}s")
+    print(format_histogram("greeting", stats.greeting))
+    print(format_histogram("first TTS frame", stats.first_frame))
+    print(format_histogram("full response", stats.full_response))
+    print(format_histogram("cancel -> ACK", stats.cancel_ack))
+    print(f"  turns completed {stats.turns}, cancelled {stats.cancelled}, errors {stats.errors}, "
+          f"connect failures {stats.connect_failures}")
+    print(f"  throughput {(stats.turns + stats.cancelled) / elapsed:.2f} turns/s, "
+          f"{stats.frames / elapsed:.1f} frames/s, {stats.bytes / elapsed / 1024:.1f} KiB/s of text")
+
+def summary(stats, args, elapsed):
+    def quantiles(histogram):
+        if not histogram.count:
+            return None
+        return {"p50": histogram.quantile(0.5), "p90": histogram.quantile(0.9), "p99": histogram.quantile(0.99),
+                "max": histogram.max, "count": histogram.count}
+    return {
+        "clients": args.clients, "turns_per_client": args.turns, "think": args.think, "elapsed": elapsed,
+        "greeting": quantiles(stats.greeting), "first_frame": quantiles(stats.first_frame),
+        "full_response": quantiles(stats.full_response), "cancel_ack": quantiles(stats.cancel_ack),
+        "turns": stats.turns, "cancelled": stats.cancelled, "errors": stats.errors,
+        "connect_failures": stats.connect_failures, "frames": stats.frames, "bytes": stats.bytes,
+    }
+
+async def run(args):
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        prompts = DEFAULT_PROMPTS
+    stats = LoadStats()
+    start_time = time.perf_counter()
+    await asyncio.gather(*(run_client(i, args, prompts, stats) for i in range(args.clients)))
+    return stats, time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent simulated desks")
+    parser.add_argument("--turns", type=int, default=5, help="questions per client")
+    parser.add_argument("--think", type=float, default=2.0, help="seconds between a response and the next question")
+    parser.add_argument("--poisson", action="store_true", help="draw think times from an exponential distribution")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds over which clients connect")
+    parser.add_argument("--barge-in", type=float, default=0.0, help="fraction of turns cancelled at the first frame")
+    parser.add_argument("--script", help="file with one question per line, asked in order instead of at random")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for any frame")
+    parser.add_argument("--name-prefix", default="loadtest")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    stats, elapsed = asyncio.run(run(args))
+    report(stats, args, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary(stats, args, elapsed), f, indent=2)
+        print(f"Report written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Replay a recorded conversation against the server and compare per-stage timings
+
+Record a real session (see recording.py), then replay it as often as needed:
+
+    RECORD_FILE=session.jsonl python main.py
+    python benchmarks/replay.py replay session.jsonl -o replay.jsonl
+    python benchmarks/replay.py compare replay_before.jsonl replay_after.jsonl
+
+`replay` starts main.py on a free local port, pointed at a fake LLM server that answers each
+backend request with the tokens recorded for it, at the recorded pace. It then plays every
+recorded client session again: each message is sent the recorded time after the server
+output it followed in the original. History, tasks and embeddings start empty in a
+temporary directory, so the real files are never touched. The replayed server records to
+-o, and the two runs are compared.
+
+`compare` breaks every turn into stages and prints their p50/p90 per run:
+
+- to_backend: client input to backend request (intent routing, retrieval, prompt, LLM slot)
+- backend_ttft: backend request to first token (recorded, so should barely move)
+- token_to_frame: first token to first TTS frame (sentence chunking and coalescing)
+- first_frame: client input to first TTS frame, what the user waits for
+- tail: last token to the end of the response
+- total: client input to the end of the response
+
+Turns are paired by session and position. Paired turns whose responses or backend prompts
+(system messages aside) differ are listed, as those point at behaviour changes rather than
+speed. Backend calls are attributed to the session thread that made them, so hedged
+requests and background summaries only count towards the backend stages of no turn.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_llm_server import DEFAULT_RESPONSES, FakeModel, start_server
+from metrics import Histogram
+from protocol import (CONTROL_TYPES, MAGIC, MSG_CANCEL_ACK, MSG_EXIT, MSG_INPUT, MSG_NAME, MSG_TTS, MSG_TTS_END,
+                      encode_frame, read_frame, tune_socket)
+from recording import load_events
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TURN_ENDS = {MSG_TTS_END, MSG_CANCEL_ACK, MSG_EXIT}
+STAGES = ["to_backend", "backend_ttft", "backend_stream", "token_to_frame", "first_frame", "tail", "total"]
+
+def load_sessions(path):
+    """Sessions of a recording in the order they started, each with its frames and backend calls"""
+    sessions = {}
+    calls = {}
+    for event in load_events(path):
+        kind = event["event"]
+        if kind == "frame":
+            session = sessions.setdefault(event["session"], {"id": event["session"], "start": event["time"],
+                                                             "frames": [], "calls": []})
+            session["frames"].append(event)
+        elif kind == "call":
+            call = dict(event, token_times=[], tokens=[], end=None)
+            calls[event["id"]] = call
+            if event["session"] in sessions:
+                sessions[event["session"]]["calls"].append(call)
+        elif kind == "token" and event["id"] in calls:
+            calls[event["id"]]["tokens"].append(event["text"])
+            calls[event["id"]]["token_times"].append(event["time"])
+        elif kind == "end" and event["id"] in calls:
+            calls[event["id"]]["end"] = event
+    return sorted(sessions.values(), key=lambda s: s["start"]), list(calls.values())
+
+def split_turns(session):
+    """A turn runs from a NAME or INPUT message to the TTS_END, CANCEL_ACK or EXIT that ends it"""
+    turns = []
+    turn = None
+    for frame in session["frames"]:
+        if frame["dir"] == "in" and frame["type"] in (MSG_NAME, MSG_INPUT):
+            turn = {"input": frame["text"], "start": frame["time"], "first_frame": None, "end": None,
+                    "end_type": None, "text": [], "call": None}
+            turns.append(turn)
+        elif turn is not None and frame["dir"] == "out":
+            if frame["type"] == MSG_TTS:
+                turn["text"].append(frame["text"])
+                if turn["first_frame"] is None:
+                    turn["first_frame"] = frame["time"]
+            elif frame["type"] in TURN_ENDS:
+                turn["end"] = frame["time"]
+                turn["end_type"] = frame["type"]
+                turn = None
+    for turn in turns:
+        end = turn["end"] if turn["end"] is not None else float("inf")
+        # The response streamed to the user; summaries and probes are not streamed
+        turn["call"] = next((call for call in session["calls"]
+                             if call["stream"] and turn["start"] <= call["time"] <= end), None)
+    return turns
+
+def turn_stages(turn):
+    """Seconds spent in each stage of a turn; stages that did not happen are left out"""
+    stages = {}
+    start, call = turn["start"], turn["call"]
+    if turn["first_frame"] is not None:
+        stages["first_frame"] = turn["first_frame"] - start
+    if turn["end"] is not None:
+        stages["total"] = turn["end"] - start
+    if call is not None:
+        stages["to_backend"] = call["time"] - start
+        if call["token_times"]:
+            first_token, last_token = call["token_times"][0], call["token_times"][-1]
+            stages["backend_ttft"] = first_token - call["time"]
+            stages["backend_stream"] = last_token - first_token
+            if turn["first_frame"] is not None:
+                stages["token_to_frame"] = turn["first_frame"] - first_token
+            if turn["end"] is not None:
+                stages["tail"] = turn["end"] - last_token
+    return stages
+
+def conversation(call):
+    """A backend prompt without its system messages, which carry the time of day and context"""
+    if call is None:
+        return None
+    return [(m.get("role"), m.get("content")) for m in call["messages"] if m.get("role") != "system"]
+
+def summarize(path):
+    sessions, _ = load_sessions(path)
+    runs = [split_turns(session) for session in sessions]
+    histograms = {stage: Histogram() for stage in STAGES}
+    for turns in runs:
+        for turn in turns:
+            for stage, seconds in turn_stages(turn).items():
+                histograms[stage].observe(seconds)
+    return runs, histograms
+
+def _ms(value):
+    return "-" if value != value else f"{value * 1000:.0f}"  # NaN for an empty histogram
+
+def compare(path_a, path_b=None):
+    runs_a, stages_a = summarize(path_a)
+    print(f"\nA: {path_a} ({len(runs_a)} sessions, {sum(len(t) for t in runs_a)} turns)")
+    if path_b is None:
+        print(f"{'stage':<16} {'p50 ms':>8} {'p90 ms':>8} {'n':>5}")
+        for stage in STAGES:
+            h = stages_a[stage]
+            print(f"{stage:<16} {_ms(h.quantile(0.5)):>8} {_ms(h.quantile(0.9)):>8} {h.count:>5}")
+        return
+
+    runs_b, stages_b = summarize(path_b)
+    print(f"B: {path_b} ({len(runs_b)} sessions, {sum(len(t) for t in runs_b)} turns)")
+    print(f"{'stage':<16} {'A p50':>8} {'B p50':>8} {'delta':>8} {'A p90':>8} {'B p90':>8} {'n A/B':>9}")
+    for stage in STAGES:
+        a, b = stages_a[stage], stages_b[stage]
+        delta = b.quantile(0.5) - a.quantile(0.5)
+        delta_text = "-" if delta != delta else f"{delta * 1000:+.0f}"
+        print(f"{stage:<16} {_ms(a.quantile(0.5)):>8} {_ms(b.quantile(0.5)):>8} {delta_text:>8} "
+              f"{_ms(a.quantile(0.9)):>8} {_ms(b.quantile(0.9)):>8} {f'{a.count}/{b.count}':>9}")
+
+    different = []
+    for session_index, (turns_a, turns_b) in enumerate(zip(runs_a, runs_b)):
+        if len(turns_a) != len(turns_b):
+            different.append(f"session {session_index}: {len(turns_a)} turns in A, {len(turns_b)} in B")
+        for turn_index, (a, b) in enumerate(zip(turns_a, turns_b)):
+            where = f"session {session_index} turn {turn_index} ({a['input'][:40]!r})"
+            if "".join(a["text"]) != "".join(b["text"]):
+                different.append(f"{where}: response differs\n    A: {''.join(a['text'])[:100]!r}\n"
+                                 f"    B: {''.join(b['text'])[:100]!r}")
+            elif conversation(a["call"]) != conversation(b["call"]):
+                different.append(f"{where}: backend prompt differs")
+    if len(runs_a) != len(runs_b):
+        different.append(f"{len(runs_a)} sessions in A, {len(runs_b)} in B")
+    if different:
+        print(f"\n{len(different)} differences in behaviour:")
+        for line in different[:10]:
+            print(f"  {line}")
+    else:
+        print("\nSame responses and backend prompts in every paired turn")
+
+class RecordedReply(list):
+    """Tokens of a recorded backend call with the delay before each and how the call ended"""
+
+    def __init__(self, call):
+        super().__init__(call["tokens"])
+        times = [call["time"]] + call["token_times"]
+        self.delays = [later - earlier for earlier, later in zip(times, times[1:])]
+        end = call["end"] or {}
+        # A failed call may have streamed the service's own error text; replay just the failure
+        self.error = end.get("error") if not end.get("cancelled") else None
+
+class ReplayModel(FakeModel):
+    """
+    Answers each backend request with the recorded call for the same model and user message
+
+    Identical questions get their recorded answers in order. A request that matches no
+    recorded message gets the next unused call of its model, and canned replies once those
+    run out.
+    """
+
+    def __init__(self, calls):
+        super().__init__(DEFAULT_RESPONSES)
+        self.by_message = collections.defaultdict(collections.deque)
+        self.by_model = collections.defaultdict(collections.deque)
+        for call in sorted(calls, key=lambda c: c["time"]):
+            key = (call["model"], call["stream"])
+            self.by_message[key + (_last_user(call["messages"]),)].append(call)
+            self.by_model[key].append(call)
+        self.used = set()
+        self.replayed = 0
+        self.unmatched = 0
+
+    def _next(self, queue):
+        while queue and queue[0]["id"] in self.used:
+            queue.popleft()
+        return queue.popleft() if queue else None
+
+    def pick_reply(self, messages, model=None, stream=True):
+        key = (model, bool(stream))
+        with self._lock:
+            call = self._next(self.by_message[key + (_last_user(messages),)]) or self._next(self.by_model[key])
+            if call is None:
+                self.unmatched += 1
+            else:
+                self.used.add(call["id"])
+                self.replayed += 1
+        if call is None:
+            return super().pick_reply(messages, model, stream)
+        return RecordedReply(call)
+
+    def plan(self, tokens):
+        if not isinstance(tokens, RecordedReply):
+            return super().plan(tokens)
+        with self._lock:
+            self.requests += 1
+        return 0.0, tokens.error is not None, None
+
+    def token_delays(self, tokens):
+        if isinstance(tokens, RecordedReply):
+            return tokens.delays
+        return super().token_delays(tokens)
+
+def _last_user(messages):
+    return next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+
+def client_script(session):
+    """
+    The client messages of a session, each anchored to the server output it followed
+
+    Returns a list of (msg_type, text, turn ends seen, TTS frames seen since, seconds after that point).
+    """
+    script = []
+    ends = frames = 0
+    last_time = session["start"]
+    for frame in session["frames"]:
+        if frame["dir"] == "out":
+            if frame["type"] in TURN_ENDS:
+                ends, frames = ends + 1, 0
+            elif frame["type"] == MSG_TTS:
+                frames += 1
+        else:
+            script.append((frame["type"], frame["text"], ends, frames, frame["time"] - last_time))
+        last_time = frame["time"]
+    return script
+
+async def replay_session(index, script, delay, host, port, args):
+    await asyncio.sleep(delay)
+    reader, writer = await asyncio.open_connection(host, port)
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        tune_socket(sock)
+    state = {"ends": 0, "frames": 0, "closed": False}
+    changed = asyncio.Event()
+
+    async def read_loop():
+        try:
+            while True:
+                msg_type, _ = await read_frame(reader)
+                if msg_type in CONTROL_TYPES:
+                    continue
+                if msg_type in TURN_ENDS:
+                    state["ends"], state["frames"] = state["ends"] + 1, 0
+                elif msg_type == MSG_TTS:
+                    state["frames"] += 1
+                changed.set()
+                if msg_type == MSG_EXIT:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            state["closed"] = True
+            changed.set()
+
+    reader_task = asyncio.create_task(read_loop())
+    try:
+        for i, (msg_type, text, ends, frames, gap) in enumerate(script):
+            deadline = time.monotonic() + args.timeout
+            # Wait for the output this message followed in the recording, however the server got there
+            while not (state["closed"] or state["ends"] > ends or
+                       (state["ends"] == ends and state["frames"] >= frames)):
+                changed.clear()
+                try:
+                    await asyncio.wait_for(changed.wait(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    print(f"Session {index}: the output message {i} followed never came, sending it anyway")
+                    break
+            if state["closed"]:
+                print(f"Session {index}: server closed the connection with {len(script) - i} messages left")
+                break
+            await asyncio.sleep(gap * args.think_scale)
+            writer.write((MAGIC if i == 0 else b"") + encode_frame(msg_type, text))
+            await writer.drain()
+        await asyncio.wait_for(reader_task, args.timeout)
+    except asyncio.TimeoutError:
+        print(f"Session {index}: no end of session within {args.timeout:.0f}s")
+    finally:
+        reader_task.cancel()
+        writer.close()
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_listening(process, log_path, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            if "Server listening on" in f.read():
+                return True
+        if process.poll() is not None:
+            return False
+        time.sleep(0.1)
+    return False
+
+def replay(args):
+    sessions, calls = load_sessions(args.recording)
+    if not sessions:
+        print(f"No client sessions in {args.recording}")
+        return 1
+    model = ReplayModel(calls)
+    models = sorted({call["model"] for call in calls} | {"llama3.2:3b", "deepseek-chat"})
+    backend = start_server(model, model_names=models)
+    backend_url = f"http://127.0.0.1:{backend.server_address[1]}"
+    output = os.path.abspath(args.output)
+    port = _free_port()
+    state_dir = tempfile.mkdtemp(prefix="replay-")
+    log_path = os.path.join(state_dir, "server.log")
+    env = dict(os.environ, SERVER_HOST="127.0.0.1", SERVER_PORT=str(port), RECORD_FILE=output,
+               OLLAMA_HOST=backend_url, DEEPSEEK_BASE_URL=backend_url, DEEPSEEK_API_KEY="replay",
+               HISTORY_FILE=os.path.join(state_dir, "chat_history.json"),
+               TASKS_FILE=os.path.join(state_dir, "tasks.json"),
+               EMBEDDINGS_FILE=os.path.join(state_dir, "chat_embeddings.json"),
+               METRICS_PORT="0", METRICS_FILE="", TRACE_FILE=args.trace or "", PYTHONUNBUFFERED="1")
+    main_path = os.path.abspath(args.main)
+
+    print(f"Replaying {len(sessions)} sessions and {len(calls)} backend calls from {args.recording}")
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, main_path], cwd=os.path.dirname(main_path), env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not _wait_listening(process, log_path, args.timeout):
+            print(f"Server did not start, see {log_path}")
+            return 1
+        first_start = sessions[0]["start"]
+
+        async def run_all():
+            await asyncio.gather(*(replay_session(i, client_script(session),
+                                                  (session["start"] - first_start) * args.think_scale,
+                                                  "127.0.0.1", port, args)
+                                   for i, session in enumerate(sessions)))
+
+        start_time = time.perf_counter()
+        asyncio.run(run_all())
+        print(f"Replay finished in {time.perf_counter() - start_time:.1f}s: {model.replayed} backend calls "
+              f"replayed, {model.unmatched} unmatched. Server log: {log_path}")
+    finally:
+        # SIGINT lets main.py save and close its files like on Ctrl+C
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        backend.shutdown()
+
+    compare(args.recording, output)
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="drive a server with a recording and compare the runs")
+    replay_parser.add_argument("recording")
+    replay_parser.add_argument("-o", "--output", default="replay.jsonl", help="recording of the replayed run")
+    replay_parser.add_argument("--main", default=os.path.join(ROOT, "main.py"),
+                               help="server entry point, e.g. from another checkout")
+    replay_parser.add_argument("--think-scale", type=float, default=1.0,
+                               help="factor on the recorded pauses between messages; 0 sends at once")
+    replay_parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for any response")
+    replay_parser.add_argument("--trace", help="TRACE_FILE for the replayed server")
+    compare_parser = commands.add_parser("compare", help="per-stage timings of one recording, or two side by side")
+    compare_parser.add_argument("recording")
+    compare_parser.add_argument("other", nargs="?")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        sys.exit(replay(args))
+    compare(args.recording, args.other)
+
+if __name__ == "__main__":
+    main()
@@ -3,29 +3,46 @@ from datetime import datetime
 import re
 import socket
 
-def strip_markdown(text):
-    """Remove common Markdown formatting from text."""
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'__(.*?)__', r'\1', text)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-    text = re.sub(r'_(.*?)_', r'\1', text)
-    text = re.sub(r'#+\s*', '', text)
-    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
-    return text.strip()
+import metrics
+import tracing
+from intent_router import IntentRouter
+from markdown_stripper import MarkdownStripper
+from output_stage import TokenCoalescer
+from token_reader import TokenReader
+from protocol import MSG_NAME, MSG_INPUT, MSG_TTS, MSG_TTS_END, MSG_EXIT, MSG_CANCEL, MSG_CANCEL_ACK
+
+SLOT_WAIT_SECONDS = metrics.histogram("llm_slot_wait_seconds", "Time a turn waited for a free LLM slot")
+SLOT_WAITERS = metrics.gauge("llm_slot_waiters", "Turns waiting for a free LLM slot")
+LONG_PAUSES = metrics.counter("llm_long_pauses_total", "Gaps of more than 5 s between two tokens")
+
+def _count_turn(kind):
+    metrics.counter("chat_turns_total", "User turns by how they were answered", kind=kind).inc()
 
 class ChatController:
     def __init__(self, ollama_service, deepseek_service, history_service, context_engine, 
-                 task_service, conn, system_prompt=None, use_pi_input=True):
+                 task_service, conn, system_prompt=None, use_pi_input=True, intent_router=None,
+                 hedged_generator=None, backend_router=None, response_cache=None, conversation_window=None,
+                 coalesce_window=0.25, llm_semaphore=None):
         # Initialize with both Ollama and DeepSeek services
         self.ollama_service = ollama_service
         self.deepseek_service = deepseek_service
         self.history_service = history_service
         self.context_engine = context_engine
         self.task_service = task_service
+        self.intent_router = intent_router or IntentRouter(task_service)
+        self.hedged_generator = hedged_generator
+        self.backend_router = backend_router
+        self.response_cache = response_cache
+        self.conversation_window = conversation_window
+        self.coalesce_window = coalesce_window
+        # Shared by all client sessions to bound concurrent LLM generations
+        self.llm_semaphore = llm_semaphore
         self.conn = conn
         self.use_pi_input = use_pi_input
         self.current_session = []
         self.current_service = ollama_service  # Default to local Ollama
+        # Set by _stream_response when the user interrupted the response
+        self.turn_cancelled = False
         if system_prompt:
             self.current_session.append({"role": "system", "content": system_prompt})
         
@@ -33,9 +50,8 @@ class ChatController:
 
     def _greet_user_with_face_recognition(self):
         try:
-            data = self.conn.recv(1024).decode()
-            if data.startswith("NAME:"):
-                name = data.split(":")[1]
+            msg_type, name = self.conn.recv()
+            if msg_type == MSG_NAME:
                 current_hour = datetime.now().hour
                 
                 if 5 <= current_hour < 12:
@@ -54,9 +70,9 @@ class ChatController:
                 
                 self.current_session.append({"role": "assistant", "content": greeting_message})
                 print(f"AI: {greeting_message}")
-                self.conn.sendall(f"TTS:{greeting_message}".encode())
+                self.conn.send(MSG_TTS, greeting_message)
                 # Send the TTS_END signal to complete the greeting
-                self.conn.sendall("TTS_END:".encode())
+                self.conn.send(MSG_TTS_END)
         except Exception as e:
             print(f"Error in greeting: {e}")
             # Continue even if greeting fails
@@ -70,20 +86,28 @@ class ChatController:
             print("Waiting for input from Raspberry Pi...")
             while True:
                 try:
-                    data = self.conn.recv(1024).decode()
-                    if data.startswith("INPUT:"):
-                        user_input = data.split(":", 1)[1].strip()
+                    message = self.conn.recv()
+                    msg_type, text = message
+                    if msg_type == MSG_CANCEL:
+                        self._acknowledge_cancel()
+                    elif msg_type == MSG_INPUT:
+                        # The Pi's trace ID ties this turn's spans to its own; legacy clients send none
+                        tracing.set_trace_id(getattr(message, "trace_id", None) or tracing.new_trace_id())
+                        user_input = text.strip()
                         if user_input.lower() in ["exit", "quit", "bye"] or "ok bye" in user_input.lower():
                             self.history_service.add_session(self.current_session)
-                            self.conn.sendall("EXIT:".encode())
+                            self.conn.send(MSG_EXIT)
                             print("Shutting down AI Desk Buddy.")
                             break
                         print(f"You: {user_input}")
-                        self._process_user_message(user_input)
+                        with tracing.span("server.turn", input_chars=len(user_input)):
+                            self._process_user_message(user_input)
                 except socket.timeout:
                     # Just a timeout, continue waiting
                     continue
                 except ConnectionResetError:
+                    # The client did not come back within the grace period; keep the conversation
+                    self.history_service.add_session(self.current_session)
                     print("Connection was reset. Shutting down.")
                     break
                 except Exception as e:
@@ -95,7 +119,7 @@ class ChatController:
                 user_input = input("You: ").strip()
                 if user_input.lower() in ["exit", "quit", "bye"] or "ok bye" in user_input.lower():
                     self.history_service.add_session(self.current_session)
-                    self.conn.sendall("EXIT:".encode())
+                    self.conn.send(MSG_EXIT)
                     print("Shutting down AI Desk Buddy.")
                     break
                 self._process_user_message(user_input)
@@ -126,19 +150,32 @@ class ChatController:
         """Helper method to send a message followed by the TTS_END signal"""
         try:
             print(f"AI: {message}")
-            self.conn.sendall(f"TTS:{message}".encode())
-            self.conn.sendall("TTS_END:".encode())
+            self.conn.send(MSG_TTS, message)
+            self.conn.send(MSG_TTS_END)
         except Exception as e:
             print(f"Error sending message: {e}")
 
+    def _acknowledge_cancel(self):
+        """
+        Confirm a CANCEL from the Pi. Every CANCEL is acknowledged once, after any frames of
+        the interrupted response, so the Pi can discard everything up to the ACK.
+        """
+        self.conn.cancel_event.clear()
+        try:
+            self.conn.send(MSG_CANCEL_ACK)
+        except Exception as e:
+            print(f"Error sending CANCEL_ACK: {e}")
+
     def _get_user_confirmation(self, timeout=30):
         """Get user confirmation with improved timeout handling"""
         start_time = time.time()
         while (time.time() - start_time) < timeout:
             try:
-                data = self.conn.recv(1024).decode()
-                if data.startswith("INPUT:"):
-                    response = data.split(":", 1)[1].strip().lower()
+                msg_type, text = self.conn.recv()
+                if msg_type == MSG_CANCEL:
+                    self._acknowledge_cancel()
+                elif msg_type == MSG_INPUT:
+                    response = text.strip().lower()
                     print(f"You: {response}")
                     self.current_session.append({"role": "user", "content": response})
                     if response in ["yes", "no"]:
@@ -230,66 +267,84 @@ class ChatController:
     def _process_user_message(self, user_input):
         user_input_lower = user_input.lower()
         # Handle switching commands before processing regular messages
-        if user_input_lower == "switch to cloud" and self.current_service == self.ollama_service:
+        if user_input_lower in ("switch to cloud", "switch to local") and self.backend_router:
+            # The router picks the backend for every request, so a manual choice would not stick
+            refuse_message = ("Automatic routing is on, so I pick the local or cloud model for each question "
+                              "myself. Set AUTO_ROUTING=false in config.env to choose the model yourself.")
+            self._send_message_with_end(refuse_message)
+            self.current_session.append({"role": "assistant", "content": refuse_message})
+            return
+        elif user_input_lower == "switch to cloud" and self.current_service == self.ollama_service:
             self._switch_to_cloud()
             return
         elif user_input_lower == "switch to local" and self.current_service == self.deepseek_service:
             self._switch_to_local()
             return
         
+        # Answer deterministic intents (date/time, task list, ...) without an LLM round-trip
+        local_response = self.intent_router.route(user_input)
+        if local_response is not None:
+            self.current_session.append({"role": "user", "content": user_input})
+            self.current_session.append({"role": "assistant", "content": local_response})
+            self._send_message_with_end(local_response)
+            _count_turn("local_intent")
+            return
+        
         user_message = {"role": "user", "content": user_input}
         self.current_session.append(user_message)
         
         task_info = self.task_service.extract_task(user_input)
-        augmented_messages = self.context_engine.augment_with_context(self.current_session, user_input)
+        
+        # Self-contained, timeless questions may already have an answer in the cache
+        cacheable = (self.response_cache is not None and not task_info
+                     and self.response_cache.is_cacheable(user_input))
+        with tracing.span("cache.lookup", cacheable=cacheable) as cache_span:
+            cached_response = self.response_cache.lookup(user_input) if cacheable else None
+            cache_span.set(hit=cached_response is not None)
         
         try:
             print("AI: ", end="", flush=True)
-            response_text = ""
-            tokens_received = 0
-            last_update_time = time.time()
-            
-            # Use the current service (Ollama or DeepSeek) to generate response
-            for token in self.current_service.generate_stream(augmented_messages):
-                current_time = time.time()
-                tokens_received += 1
-                
-                # Periodically log status for long responses
-                if tokens_received % 100 == 0:
-                    print(f"\n[Received {tokens_received} tokens]", end="", flush=True)
-                
-                # Check for long pauses between tokens
-                if current_time - last_update_time > 5.0 and tokens_received > 1:
-                    print(f"\n[Long pause detected ({current_time - last_update_time:.1f}s)]", end="", flush=True)
-                
-                last_update_time = current_time
-                clean_token = strip_markdown(token)
-                
-                if response_text and not response_text.endswith(" ") and not clean_token.startswith(" "):
-                    print(" ", end="", flush=True)
-                    response_text += " "
-                    
-                print(clean_token, end="", flush=True)
-                response_text += clean_token
-                
-                try:
-                    self.conn.sendall(f"TTS:{clean_token}".encode())  # Send each token
-                except Exception as e:
-                    print(f"\n[Error sending token: {e}]", end="", flush=True)
-                    # Continue even if sending fails
-            
-            print()  # Newline after response
-            
-            try:
-                self.conn.sendall("TTS_END:".encode())  # Signal the end of the response
-            except Exception as e:
-                print(f"Error sending TTS_END: {e}")
+            if cached_response is not None:
+                # Replay word by word through the same output path so the Pi sees no difference
+                response_text = self._stream_response(re.findall(r"\S+\s*", cached_response), source="cache")
+            else:
+                # Keep the prompt bounded on long sessions: recent turns verbatim, older ones summarized
+                with tracing.span("prompt.build"):
+                    prompt_messages = (self.conversation_window.build(self.current_session)
+                                       if self.conversation_window else self.current_session)
+                augmented_messages = self.context_engine.augment_with_context(prompt_messages, user_input)
+                with tracing.span("llm.slot_wait"):
+                    got_slot = self._acquire_llm_slot()
+                if got_slot:
+                    # Read on a separate thread, so a barge-in is noticed before the first token;
+                    # the reader gives the slot back once the backend request is closed
+                    reader = TokenReader(lambda: self._generate_stream(augmented_messages), self._turn_failed,
+                                         self.conn.cancel_event, on_done=self._release_llm_slot)
+                    try:
+                        response_text = self._stream_response(reader)
+                    finally:
+                        reader.close()
+                    if cacheable and not self.turn_cancelled and not reader.failed:
+                        self.response_cache.store(user_input, response_text)
+                else:
+                    print("\n[Cancelled by the user before generation started]")
+                    self.turn_cancelled = True
+                    response_text = ""
             
-            assistant_message = {"role": "assistant", "content": response_text}
+            _count_turn("cancelled" if self.turn_cancelled else "cache" if cached_response is not None else "llm")
+            if self.turn_cancelled:
+                # Keep what the user heard, so the next turn knows the answer was cut short
+                assistant_message = {"role": "assistant", "content": f"{response_text} [interrupted by the user]"}
+            else:
+                assistant_message = {"role": "assistant", "content": response_text}
             self.current_session.append(assistant_message)
-            
-            self.context_engine.add_message(user_message)
-            self.context_engine.add_message(assistant_message)
+            with tracing.span("memory.update"):
+                if self.conversation_window:
+                    self.conversation_window.maybe_summarize(self.current_session)
+                
+                self.context_engine.add_message(user_message, current_query=user_input)
+                if not self.turn_cancelled:
+                    self.context_engine.add_message(assistant_message, current_query=user_input)
             
             if task_info:
                 task_id = self.task_service.add_task(
@@ -301,10 +356,156 @@ class ChatController:
                     
         except Exception as e:
             print(f"\nError generating response: {e}")
+            _count_turn("error")
             error_message = f"Sorry, I encountered an error while generating a response: {str(e)}"
             self._send_message_with_end(error_message)
             self._attempt_recovery()
     
+    def _acquire_llm_slot(self):
+        """Take an LLM slot; returns False instead if the user barged in before one was free"""
+        if self.conn.cancel_event.is_set():
+            return False
+        if not self.llm_semaphore:
+            return True
+        if self.llm_semaphore.acquire(blocking=False):
+            SLOT_WAIT_SECONDS.observe(0.0)
+            return True
+        print("[Waiting for a free LLM slot]", end="", flush=True)
+        SLOT_WAITERS.inc()
+        try:
+            with SLOT_WAIT_SECONDS.time():
+                while not self.llm_semaphore.acquire(timeout=0.05):
+                    if self.conn.cancel_event.is_set():
+                        return False
+        finally:
+            SLOT_WAITERS.dec()
+        return True
+
+    def _release_llm_slot(self):
+        if self.llm_semaphore:
+            self.llm_semaphore.release()
+
+    def _generate_stream(self, augmented_messages):
+        """
+        Pick how this turn is generated
+
+        Returns:
+        - (object reporting the backend that answered, token iterator)
+        """
+        # Let the router pick the backend per request when automatic routing is on,
+        # otherwise use the current service (Ollama or DeepSeek), optionally hedged
+        # with the other backend in case the preferred one is slow to start
+        if self.backend_router:
+            return self.backend_router, self.backend_router.generate_stream(augmented_messages)
+        if self.hedged_generator:
+            return self.hedged_generator, self.hedged_generator.generate_stream(
+                self.current_service, self._alternative_service(), augmented_messages)
+        return self.current_service, self.current_service.generate_stream(augmented_messages)
+    
+    def _turn_failed(self, source):
+        """Check if the backend that produced the last response reported an error"""
+        # The router and hedged generator expose the backend that ended up answering and its error
+        return getattr(source, "last_service", source) is None or source.last_error is not None
+    
+    def _stream_response(self, token_stream, source="llm"):
+        """
+        Send tokens to the Pi in coalesced phrases as they arrive and return the full response text
+
+        source labels the turn's latency metrics: "llm" or "cache"
+        """
+        response_text = ""
+        tokens_received = 0
+        last_update_time = time.time()
+        stream_start = time.perf_counter()
+        first_token_time = None
+        self.turn_cancelled = False
+        
+        def emit(clean_chunk):
+            nonlocal response_text
+            if not response_text:
+                clean_chunk = clean_chunk.lstrip()
+                if not clean_chunk:
+                    return
+            print(clean_chunk, end="", flush=True)
+            response_text += clean_chunk
+            try:
+                self.conn.send(MSG_TTS, clean_chunk)  # One frame per phrase
+            except Exception as e:
+                print(f"\n[Error sending token: {e}]", end="", flush=True)
+                # Continue even if sending fails
+        
+        # Markdown is stripped from the raw token stream, so markers split across tokens
+        # never reach the Pi and phrase boundaries are found on the clean text
+        stripper = MarkdownStripper()
+        coalescer = TokenCoalescer(emit, window=self.coalesce_window)
+        # Ended on every path, including a backend stream that raises
+        with tracing.span("response.stream") as stream_span:
+            for token in token_stream:
+                # The Pi sent CANCEL (barge-in): stop here instead of generating the rest
+                if self.conn.cancel_event.is_set():
+                    self.turn_cancelled = True
+                    break
+                current_time = time.time()
+                tokens_received += 1
+                if tokens_received == 1:
+                    first_token_time = time.perf_counter()
+                    tracing.instant("response.first_token")
+                    metrics.histogram("llm_time_to_first_token_seconds", "Time from request to the first token",
+                                      source=source).observe(first_token_time - stream_start)
+            
+                # Periodically log status for long responses
+                if tokens_received % 100 == 0:
+                    print(f"\n[Received {tokens_received} tokens]", end="", flush=True)
+            
+                # Check for long pauses between tokens
+                if current_time - last_update_time > 5.0 and tokens_received > 1:
+                    print(f"\n[Long pause detected ({current_time - last_update_time:.1f}s)]", end="", flush=True)
+                    LONG_PAUSES.inc()
+            
+                last_update_time = current_time
+                coalescer.add(stripper.feed(token))
+            
+            # A barge-in while the backend was silent (e.g. before its first token) ends the stream
+            if self.conn.cancel_event.is_set():
+                self.turn_cancelled = True
+        
+            if self.turn_cancelled:
+                # Closing the stream tears down the backend request, which stops generation.
+                # Buffered text is dropped and no TTS_END is sent: the CANCEL_ACK that the chat
+                # loop sends next marks the end of this response for the Pi.
+                close = getattr(token_stream, "close", None)
+                if close:
+                    close()
+                print(f"\n[Cancelled by the user after {tokens_received} tokens "
+                      f"({(time.perf_counter() - stream_start) * 1000:.0f} ms into the response)]")
+                stream_span.end(tokens=tokens_received, cancelled=True)
+                return response_text
+        
+            coalescer.add(stripper.flush())
+            coalescer.flush()
+            self._record_stream_metrics(source, tokens_received, first_token_time)
+        
+            print(f"\n[{tokens_received} tokens sent in {coalescer.batches} writes]")
+            stream_span.end(tokens=tokens_received, writes=coalescer.batches)
+        
+        try:
+            self.conn.send(MSG_TTS_END)  # Signal the end of the response
+        except Exception as e:
+            print(f"Error sending TTS_END: {e}")
+        return response_text
+    
+    def _record_stream_metrics(self, source, tokens_received, first_token_time):
+        metrics.counter("llm_tokens_total", "Tokens streamed to clients", source=source).inc(tokens_received)
+        # Generation speed after the first token, so queueing and prefill don't count against it
+        if first_token_time is not None and tokens_received > 1:
+            elapsed = time.perf_counter() - first_token_time
+            if elapsed > 0:
+                metrics.histogram("llm_tokens_per_second", "Streaming speed of a response after its first token",
+                                  source=source).observe((tokens_received - 1) / elapsed)
+    
+    def _alternative_service(self):
+        return self.ollama_service if self.current_service == self.deepseek_service else self.deepseek_service
+
     def _attempt_recovery(self):
         try:
             print("Attempting to recover connection...")
@@ -316,7 +517,7 @@ class ChatController:
                 print("Connection to current service recovered.")
             else:
                 # If current service fails, try the alternative service
-                alternative_service = self.ollama_service if self.current_service == self.deepseek_service else self.deepseek_service
+                alternative_service = self._alternative_service()
                 print(f"Trying alternative service ({alternative_service.model_name})...")
                 if alternative_service.test_connection():
                     self.current_service = alternative_service
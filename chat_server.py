@@ -0,0 +1,370 @@
+"""
+ChatServer - Accepts any number of Pi clients and runs one ChatController per connection
+
+The event loop owns the sockets: it accepts clients, reads and writes frames. Each
+ChatController runs its blocking chat loop in a worker thread and talks to its client
+through an AsyncChannel.
+
+Framed clients get a session token when they connect. If the connection drops, the
+session (conversation and unacknowledged frames) is kept for a grace period so the
+client can reconnect with MSG_RESUME and continue where it left off.
+
+At most max_clients connected sessions run at once. Clients beyond that are told they
+are waiting and greeted in arrival order as sessions end or lose their connection; a
+session waiting for its client to resume does not hold a place.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import queue
+import secrets
+import socket
+import threading
+
+import metrics
+import recording
+from protocol import (MSG_CANCEL, MSG_PING, MSG_PONG, MSG_RESUME, MSG_RESUMED, MSG_SESSION, MSG_TTS, ReplayBuffer,
+                      encode_frame, encode_legacy, parse_legacy, read_frame, read_handshake, tune_socket)
+
+_CLOSED = object()
+
+SENT_BYTES = metrics.counter("socket_sent_bytes_total", "Bytes written to client sockets")
+SENT_FRAMES = metrics.counter("socket_sent_frames_total", "Messages written to client sockets")
+
+class AsyncChannel:
+    """
+    The controller's end of a client session
+
+    Offers the blocking send()/recv() interface of protocol.FramedConnection to the
+    controller thread, while the frames themselves are read and written by the event loop.
+    A framed session outlives its connection: while no client is attached, frames sent by
+    the controller are kept in the replay buffer.
+    """
+
+    def __init__(self, loop, framed, token=None, send_timeout=10.0):
+        self.loop = loop
+        self.framed = framed
+        self.token = token
+        # Names the session in recordings; legacy sessions have no token
+        self.session_id = token or f"legacy-{id(self):x}"
+        self.writer = None
+        self.inbox = queue.Queue()
+        self.timeout = None
+        # Set as soon as a CANCEL arrives, while the controller thread may be busy streaming
+        self.cancel_event = threading.Event()
+        self.replay = ReplayBuffer() if framed else None
+        self.received = 0
+        self.expiry = None
+        # A client that stops reading slows its own session down, but for no longer than this
+        self.send_timeout = send_timeout
+        # Counts against ChatServer.max_clients while set
+        self.holds_slot = False
+
+    def send(self, msg_type: int, text: str = ""):
+        recording.frame(self.session_id, "out", msg_type, text)
+        data = encode_frame(msg_type, text) if self.framed else encode_legacy(msg_type, text)
+        # Wait for the write to drain so a client that stops reading slows its own session down
+        future = asyncio.run_coroutine_threadsafe(self._write(data), self.loop)
+        try:
+            future.result(self.send_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            writer = self.writer
+            print(f"Client stopped reading for {self.send_timeout:.0f}s, dropping the connection")
+            if writer is not None:
+                # close() would wait to flush to a client that is not reading; abort() does not
+                self.loop.call_soon_threadsafe(writer.transport.abort)
+            if self.replay is None:
+                raise ConnectionResetError(f"Client stopped reading for {self.send_timeout:.0f}s")
+            # The frame is in the replay buffer, so carry on without the connection instead of
+            # sitting on an LLM slot; the client gets the rest when it resumes
+
+    async def _write(self, data: bytes):
+        if self.replay is not None:
+            self.replay.record(data)
+        writer = self.writer
+        if writer is None or writer.is_closing():
+            if self.replay is None:
+                raise ConnectionResetError("Connection closed by peer")
+            return  # Replayed when the client resumes
+        try:
+            writer.write(data)
+            SENT_BYTES.inc(len(data))
+            SENT_FRAMES.inc()
+            await writer.drain()
+        except ConnectionError:
+            if self.replay is None:
+                raise
+            self.detach(writer)
+
+    def recv(self):
+        """Block until the reader task delivers a message; same contract as FramedConnection.recv"""
+        try:
+            message = self.inbox.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+        if message is _CLOSED:
+            self.inbox.put(_CLOSED)  # Keep reporting the closed connection on later calls
+            raise ConnectionResetError("Connection closed by peer")
+        return message
+
+    def deliver(self, message):
+        self.received += 1
+        recording.frame(self.session_id, "in", message[0], message[1])
+        if message[0] == MSG_CANCEL:
+            self.cancel_event.set()
+        self.inbox.put(message)
+
+    def attach(self, writer):
+        self.writer = writer
+        if self.expiry:
+            self.expiry.cancel()
+            self.expiry = None
+
+    def detach(self, writer):
+        if self.writer is writer:
+            self.writer = None
+        writer.close()
+
+    def resume(self, writer, client_received: int) -> bool:
+        """Attach a reconnected client and replay the frames it missed; runs on the event loop"""
+        missed = self.replay.since(client_received)
+        if missed is None:
+            return False
+        if self.writer is not None:
+            self.detach(self.writer)  # The old connection is dead even if we have not noticed yet
+        self.attach(writer)
+        # No await between these writes, so no new frame from the controller can slip in between
+        writer.write(encode_frame(MSG_RESUMED, str(self.received)))
+        for frame in missed:
+            writer.write(frame)
+        return True
+
+    def mark_closed(self):
+        self.inbox.put(_CLOSED)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        if self.writer is not None:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+class ChatServer:
+    def __init__(self, controller_factory, host='192.168.143.248', port=65432, max_clients=8,
+                 socket_timeout=60.0, heartbeat_timeout=15.0, session_grace=120.0, send_timeout=10.0):
+        # controller_factory(channel) builds a ChatController for one client session
+        self.controller_factory = controller_factory
+        self.host = host
+        self.port = port
+        self.socket_timeout = socket_timeout
+        # A client that sends heartbeats and then goes quiet this long is treated as gone
+        self.heartbeat_timeout = heartbeat_timeout
+        # How long a session waits for its client to reconnect before it is closed
+        self.session_grace = session_grace
+        self.send_timeout = send_timeout
+        # Connected sessions allowed to run at once; later clients wait in self.waiting
+        self.max_clients = max_clients
+        self.running = 0
+        self.waiting = collections.deque()
+        self.channels = set()
+        self.sessions = {}
+        metrics.gauge("chat_sessions_active", "Client sessions, connected or waiting to resume",
+                      fn=lambda: len(self.channels))
+        metrics.gauge("chat_sessions_detached", "Sessions whose client is disconnected",
+                      fn=lambda: sum(1 for channel in list(self.channels) if channel.writer is None))
+        metrics.gauge("chat_sessions_waiting", "Clients waiting for a free session",
+                      fn=lambda: len(self.waiting))
+        metrics.gauge("chat_inbox_depth", "Client messages not yet read by their controller",
+                      fn=lambda: sum(channel.inbox.qsize() for channel in list(self.channels)))
+
+    async def serve(self, on_listening=None):
+        """Serve clients until cancelled; on_listening() is called once the socket is bound"""
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        print(f"Server listening on {self.host}:{self.port} (up to {self.max_clients} clients)")
+        if on_listening:
+            on_listening()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Unblock every controller waiting for input so its thread can finish
+            for channel in list(self.channels):
+                channel.mark_closed()
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            tune_socket(sock)
+        try:
+            framed, first_bytes = await read_handshake(reader)
+            first_message = await read_frame(reader) if framed else None
+        except ConnectionResetError:
+            writer.close()
+            return
+        loop = asyncio.get_running_loop()
+
+        if not framed:
+            print(f"Connected by {addr} (legacy string prefixes protocol)")
+            channel = self._start_session(loop, addr, AsyncChannel(loop, framed=False,
+                                                                   send_timeout=self.send_timeout))
+            channel.attach(writer)
+            await self._read_legacy(reader, channel, first_bytes)
+            channel.mark_closed()
+            writer.close()
+            if not channel.started:
+                self.channels.discard(channel)  # Left while waiting in line
+            return
+
+        if first_message[0] == MSG_RESUME:
+            token, _, count = first_message[1].partition(" ")
+            channel = self.sessions.get(token)
+            if channel and channel.resume(writer, int(count or 0)):
+                print(f"Resumed session {token[:8]} from {addr}")
+                if channel.started and not channel.holds_slot:
+                    # Already greeted, so it goes ahead of new clients even if that briefly
+                    # runs more than max_clients sessions
+                    channel.holds_slot = True
+                    self.running += 1
+                elif not channel.started:
+                    self._admit(loop)  # Back in its place in line
+                await self._read_frames(reader, writer, channel, addr)
+                return
+            print(f"Could not resume session {token[:8]} for {addr}, starting a new one")
+            first_message = None
+
+        token = secrets.token_hex(16)
+        print(f"Connected by {addr} (framed protocol, session {token[:8]})")
+        channel = self._start_session(loop, addr, AsyncChannel(loop, framed=True, token=token,
+                                                               send_timeout=self.send_timeout))
+        self.sessions[token] = channel
+        channel.attach(writer)
+        writer.write(encode_frame(MSG_SESSION, token))
+        if first_message:
+            channel.deliver(first_message)
+        await self._read_frames(reader, writer, channel, addr)
+
+    def _start_session(self, loop, addr, channel):
+        """Register a new session and run it now, or queue it if max_clients are running"""
+        channel.settimeout(self.socket_timeout)
+        channel.addr = addr
+        channel.started = False
+        self.channels.add(channel)
+        if self.running < self.max_clients:
+            self._run_in_thread(loop, channel)
+        else:
+            self.waiting.append(channel)
+            print(f"All {self.max_clients} sessions busy, {addr} is number {len(self.waiting)} in line")
+            notice = (f"All desks are busy right now, you are number {len(self.waiting)} in line. "
+                      f"I'll greet you as soon as one is free.")
+            # Spoken by the Pi while it waits for the greeting, which follows once the session starts
+            data = encode_frame(MSG_TTS, notice) if channel.framed else encode_legacy(MSG_TTS, notice)
+            loop.create_task(channel._write(data))
+        return channel
+
+    def _run_in_thread(self, loop, channel):
+        channel.started = True
+        channel.holds_slot = True
+        self.running += 1
+
+        def run():
+            try:
+                self._run_session(channel, channel.addr)
+            finally:
+                loop.call_soon_threadsafe(finished)
+
+        def finished():
+            self.channels.discard(channel)
+            if channel.token:
+                self.sessions.pop(channel.token, None)
+            if channel.writer is not None:
+                channel.writer.close()
+            self._release_slot(channel)
+            print(f"Session ended for {channel.addr} ({len(self.channels)} sessions active)")
+
+        # A thread per session rather than a bounded pool: a session waiting for its client to
+        # resume keeps its thread but gives up its place, so the limit is enforced in _release_slot
+        threading.Thread(target=run, name=f"session-{channel.session_id[:8]}", daemon=True).start()
+
+    def _release_slot(self, channel):
+        """Give the channel's place to the longest waiting client; runs on the event loop"""
+        if not channel.holds_slot:
+            return
+        channel.holds_slot = False
+        self.running -= 1
+        self._admit(asyncio.get_running_loop())
+
+    def _admit(self, loop):
+        """Start waiting sessions in arrival order while there is room; runs on the event loop"""
+        for channel in list(self.waiting):
+            if self.running >= self.max_clients:
+                break
+            if channel not in self.channels:
+                self.waiting.remove(channel)
+            elif channel.writer is not None:
+                # A client that lost its connection while in line keeps its place until it resumes
+                self.waiting.remove(channel)
+                print(f"Starting the session of {channel.addr} after waiting in line")
+                self._run_in_thread(loop, channel)
+
+    async def _read_frames(self, reader, writer, channel, addr):
+        """Demultiplex the client's frames into messages for the controller thread"""
+        heartbeats = False
+        try:
+            while True:
+                # Only clients that send heartbeats can be held to them
+                timeout = self.heartbeat_timeout if heartbeats else None
+                try:
+                    message = await asyncio.wait_for(read_frame(reader), timeout)
+                except asyncio.TimeoutError:
+                    print(f"No heartbeat from {addr} for {self.heartbeat_timeout:.0f}s, dropping the connection")
+                    break
+                if message[0] == MSG_PING:
+                    heartbeats = True
+                    channel.replay.acknowledge(int(message[1] or 0))
+                    writer.write(encode_frame(MSG_PONG, str(channel.received)))
+                    continue
+                channel.deliver(message)
+        except ConnectionError:
+            pass
+
+        if channel.writer is not None and channel.writer is not writer:
+            writer.close()  # Already replaced by a resumed connection
+            return
+        channel.detach(writer)
+        if channel.token in self.sessions:
+            print(f"Connection from {addr} lost, keeping session {channel.token[:8]} for "
+                  f"{self.session_grace:.0f}s")
+            channel.expiry = asyncio.get_running_loop().call_later(self.session_grace, self._expire, channel)
+            # Nobody is listening, so the place goes to the next client in line
+            self._release_slot(channel)
+
+    def _expire(self, channel):
+        if channel.writer is None and self.sessions.pop(channel.token, None):
+            print(f"Session {channel.token[:8]} expired without a reconnect")
+            if not channel.started:
+                # Never left the line; there is no controller thread to wind down
+                self.channels.discard(channel)
+                if channel in self.waiting:
+                    self.waiting.remove(channel)
+                return
+            channel.mark_closed()
+
+    async def _read_legacy(self, reader, channel, first_bytes):
+        """Legacy clients: one read is one message, as with the old recv(1024) loop"""
+        try:
+            data = first_bytes + await reader.read(1024 - len(first_bytes))
+            while data:
+                channel.deliver(parse_legacy(data))
+                data = await reader.read(1024)
+        except ConnectionError:
+            pass
+
+    def _run_session(self, channel, addr):
+        recording.set_session(channel.session_id)
+        try:
+            controller = self.controller_factory(channel)
+            controller.run_chat_loop()
+        except Exception as e:
+            print(f"Session error for {addr}: {e}")
@@ -0,0 +1,98 @@
+"""
+CircuitBreaker - Tracks LLM backend health so a dead backend fails fast
+"""
+import threading
+import time
+from typing import Optional
+
+class CircuitBreaker:
+    """
+    Closed: requests flow normally.
+    Open: requests are rejected immediately until the backoff expires.
+    Half-open: one trial request is let through and every other caller is rejected
+    until it finishes; success closes the circuit, failure re-opens it with a doubled
+    backoff. A trial that is abandoned (release_trial) or never reports back within
+    trial_timeout lets the next caller try instead.
+    """
+
+    def __init__(self, name, failure_threshold=2, base_backoff=5.0, max_backoff=300.0, health_ttl=30.0,
+                 trial_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.health_ttl = health_ttl
+        self.trial_timeout = trial_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.trial_started = 0.0
+        self.healthy = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def cached_health(self) -> Optional[bool]:
+        """
+        Return False while the circuit is open, True if the last success is younger than
+        the TTL, else None. A failure that has not opened the circuit yet is not cached, so
+        a single transient error does not make the backend look down for the whole TTL.
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() < self.open_until:
+                return False
+            if self.healthy and time.monotonic() - self.checked_at < self.health_ttl:
+                return True
+            return None
+
+    def allow_request(self) -> bool:
+        """Check if a request may be sent to the backend right now"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open":
+                if now < self.open_until:
+                    return False
+                self.state = "half-open"
+                print(f"{self.name}: circuit half-open, sending a trial request")
+            elif self.state == "half-open":
+                if self.trial_in_flight and now - self.trial_started < self.trial_timeout:
+                    return False
+            else:
+                return True
+            self.trial_in_flight = True
+            self.trial_started = now
+            return True
+
+    def release_trial(self):
+        """The caller gave up on its request without a verdict; let the next caller try"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets the next trial request through"""
+        with self._lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"{self.name}: circuit closed, backend recovered")
+            self.state = "closed"
+            self.trial_in_flight = False
+            self.consecutive_failures = 0
+            self.healthy = True
+            self.checked_at = time.monotonic()
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            self.healthy = False
+            self.checked_at = time.monotonic()
+            if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+                exponent = max(0, self.consecutive_failures - self.failure_threshold)
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** exponent))
+                self.state = "open"
+                self.open_until = time.monotonic() + backoff
+                print(f"{self.name}: circuit open for {backoff:.0f}s after "
+                      f"{self.consecutive_failures} failure(s){f' ({error})' if error else ''}")
@@ -3,33 +3,62 @@ ContextEngine - A RAG implementation for providing conversation context
 """
 import os
 import json
-from typing import List, Dict, Any
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional
 
-try:
-    from sentence_transformers import SentenceTransformer
-    EMBEDDINGS_AVAILABLE = True
-except ImportError:
-    EMBEDDINGS_AVAILABLE = False
+import metrics
+import tracing
+from lazy_import import lazy_import, module_available
+
+# Imported on first use: sentence_transformers pulls in torch, which takes seconds to import
+sentence_transformers = lazy_import("sentence_transformers")
+EMBEDDINGS_AVAILABLE = module_available("sentence_transformers")
+if not EMBEDDINGS_AVAILABLE:
     print("Warning: sentence-transformers not installed. Context retrieval will be limited.")
     print("Install with: pip install sentence-transformers")
 
+RETRIEVAL_SECONDS = metrics.histogram("context_retrieval_seconds", "Time to retrieve context for a user turn")
+
+def content_key(content: str) -> str:
+    """Short stable key for a message text, used to remember messages removed by compaction"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
 class ContextEngine:
-    def __init__(self, history_service, embeddings_file="chat_embeddings.json", model_name="all-MiniLM-L6-v2"):
+    def __init__(self, history_service, embeddings_file="chat_embeddings.json", model_name="all-MiniLM-L6-v2",
+                 stable_prefix=False, lazy=False):
         self.history_service = history_service
         self.embeddings_file = embeddings_file
         self.model_name = model_name
+        # Put retrieved context after the history instead of after the system prompt, so the
+        # system prompt + history prefix is identical from turn to turn and the backend can
+        # reuse its prompt (KV) cache instead of re-prefilling the whole conversation
+        self.stable_prefix = stable_prefix
         self.model = None
         self.embeddings = self._load_embeddings()
-        self.current_user_query = None
-        if EMBEDDINGS_AVAILABLE:
-            try:
-                self.model = SentenceTransformer(model_name)
-                print(f"Context: Loaded embedding model {model_name}")
+        # Per session thread, so one session's query never stands in for another's
+        self._local = threading.local()
+        # Sessions run in parallel threads; serialize changes to the index and its file
+        self._lock = threading.RLock()
+        # Lazy engines are loaded later by calling load(), e.g. from a background startup
+        # step; until then retrieval is skipped as if embeddings were unavailable
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """Load the embedding model and embed the history messages not indexed yet"""
+        if not EMBEDDINGS_AVAILABLE or self.model is not None:
+            return
+        try:
+            model = sentence_transformers.SentenceTransformer(self.model_name)
+            print(f"Context: Loaded embedding model {self.model_name}")
+            with self._lock:
+                self.model = model
                 self._update_embeddings()
-            except Exception as e:
-                print(f"Warning: Failed to initialize embeddings model: {e}")
-                self.model = None
-    
+        except Exception as e:
+            print(f"Warning: Failed to initialize embeddings model: {e}")
+            self.model = None
+
     def _load_embeddings(self) -> Dict[str, Any]:
         if os.path.exists(self.embeddings_file):
             try:
@@ -41,7 +70,7 @@ class ContextEngine:
     
     def _save_embeddings(self):
         try:
-            with open(self.embeddings_file, "w") as f:
+            with self._lock, open(self.embeddings_file, "w") as f:
                 json.dump(self.embeddings, f)
         except IOError as e:
             print(f"Warning: Could not save embeddings: {e}")
@@ -52,9 +81,15 @@ class ContextEngine:
         all_messages = self.history_service.get_all_messages()
         new_messages = []
         existing_messages = [msg["content"] for msg in self.embeddings["messages"]]
+        # Sessions summarized and messages dropped by memory_compactor must not come back
+        compacted_sessions = set(self.embeddings.get("compacted_sessions", []))
+        excluded = set(self.embeddings.get("excluded", []))
         for msg in all_messages:
-            if msg["role"] != "system" and msg["content"] not in existing_messages:
-                new_messages.append(msg)
+            if msg["role"] == "system" or msg["content"] in existing_messages:
+                continue
+            if msg.get("session_id") in compacted_sessions or content_key(msg["content"]) in excluded:
+                continue
+            new_messages.append(msg)
         if not new_messages:
             return
         try:
@@ -73,15 +108,30 @@ class ContextEngine:
         except Exception as e:
             print(f"Warning: Failed to generate embeddings: {e}")
     
+    def embed(self, text: str) -> Optional[List[float]]:
+        """Embed text with the loaded model, reusing the vector when the same text is embedded twice in a row"""
+        if not self.model:
+            return None
+        last_embedding = getattr(self._local, "last_embedding", None)
+        if last_embedding and last_embedding[0] == text:
+            return last_embedding[1]
+        with tracing.span("context.embed"):
+            vector = self.model.encode(text).tolist()
+        self._local.last_embedding = (text, vector)
+        return vector
+    
     def _compute_similarity(self, query_vector, doc_vector) -> float:
         return sum(a * b for a, b in zip(query_vector, doc_vector))
     
     def augment_with_context(self, current_messages: List[Dict[str, str]], latest_input: str) -> List[Dict[str, str]]:
-        self.current_user_query = latest_input
+        with tracing.span("context.retrieval", indexed=len(self.embeddings["vectors"])), RETRIEVAL_SECONDS.time():
+            return self._augment_with_context(current_messages, latest_input)
+    
+    def _augment_with_context(self, current_messages, latest_input):
         if not self.model or not self.embeddings["messages"]:
             return current_messages
         try:
-            query_vector = self.model.encode(latest_input).tolist()
+            query_vector = self.embed(latest_input)
             similarities = [(i, self._compute_similarity(query_vector, doc_vector)) 
                             for i, doc_vector in enumerate(self.embeddings["vectors"])]
             similarities.sort(key=lambda x: x[1], reverse=True)
@@ -99,32 +149,41 @@ class ContextEngine:
                 context_content += f"[{msg['role']}]: {msg['content']}\n\n"
             augmented_messages = list(current_messages)
             insert_pos = 0
-            for i, msg in enumerate(augmented_messages):
-                if msg["role"] == "system":
-                    insert_pos = i + 1
-                else:
-                    break
+            if self.stable_prefix:
+                insert_pos = len(augmented_messages)
+                if augmented_messages and augmented_messages[-1]["role"] == "user":
+                    insert_pos -= 1
+            else:
+                for i, msg in enumerate(augmented_messages):
+                    if msg["role"] == "system":
+                        insert_pos = i + 1
+                    else:
+                        break
             augmented_messages.insert(insert_pos, {"role": "system", "content": context_content})
             return augmented_messages
         except Exception as e:
             print(f"Warning: Error in context retrieval: {e}")
             return current_messages
     
-    def add_message(self, message: Dict[str, str]):
-        if not self.model or message["role"] == "system" or message["content"] == self.current_user_query:
+    def add_message(self, message: Dict[str, str], current_query: Optional[str] = None):
+        """Index a message; the caller's current query is left out, as during augment_with_context"""
+        if not self.model or message["role"] == "system" or message["content"] == current_query:
             return
         try:
             existing_contents = [msg["content"] for msg in self.embeddings["messages"]]
             if message["content"] in existing_contents:
                 return
+            if content_key(message["content"]) in self.embeddings.get("excluded", []):
+                return
             vector = self.model.encode(message["content"]).tolist()
-            self.embeddings["messages"].append({
-                "content": message["content"],
-                "role": message["role"],
-                "session_id": message.get("session_id", "unknown"),
-                "timestamp": message.get("timestamp", "")
-            })
-            self.embeddings["vectors"].append(vector)
-            self._save_embeddings()
+            with self._lock:
+                self.embeddings["messages"].append({
+                    "content": message["content"],
+                    "role": message["role"],
+                    "session_id": message.get("session_id", "unknown"),
+                    "timestamp": message.get("timestamp", "")
+                })
+                self.embeddings["vectors"].append(vector)
+                self._save_embeddings()
         except Exception as e:
             print(f"Warning: Failed to add message to embeddings: {e}")
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""
+ConversationWindow - Bounds the prompt by folding old turns into a running summary
+"""
+import contextlib
+import threading
+import time
+from typing import Dict, List
+
+class ConversationWindow:
+    def __init__(self, summarizer_service, max_turns=6, fold_turns=4, llm_semaphore=None):
+        # Local model used to write the summary in the background between turns
+        self.summarizer_service = summarizer_service
+        # The LLM slots shared with the chat sessions, so a summary never adds to their load
+        self.llm_semaphore = llm_semaphore
+        # The last max_turns user/assistant exchanges are always sent verbatim
+        self.max_messages = max_turns * 2
+        # Older messages are folded in batches rather than one turn at a time, so the prompt
+        # prefix (and the backend's prompt cache) stays unchanged for several turns in a row
+        self.fold_messages = fold_turns * 2
+        self.summary = ""
+        self.folded_count = 0
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    def _split(self, session: List[Dict[str, str]]):
+        """Split the session into its leading system messages and the conversation"""
+        leading = 0
+        while leading < len(session) and session[leading]["role"] == "system":
+            leading += 1
+        return session[:leading], session[leading:]
+
+    def build(self, session: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Return the messages to send: system prompt, running summary and the recent turns"""
+        system_messages, conversation = self._split(session)
+        with self._lock:
+            summary, folded_count = self.summary, self.folded_count
+        recent = conversation[folded_count:]
+        # Hard cap in case summarization is slow or failing, so the prompt stays bounded. Turns
+        # are dropped in whole fold batches from the last fold, so the cut (and the prompt
+        # prefix) stays put for several turns while the summary is retried
+        max_unfolded = self.max_messages + 2 * self.fold_messages
+        excess = len(recent) - max_unfolded
+        if excess > 0:
+            recent = recent[-(-excess // self.fold_messages) * self.fold_messages:]
+        messages = list(system_messages)
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        return messages + recent
+
+    def maybe_summarize(self, session: List[Dict[str, str]]):
+        """Start folding old turns into the summary in the background once enough have piled up"""
+        _, conversation = self._split(session)
+        with self._lock:
+            if self._summarizing:
+                return
+            fold_end = len(conversation) - self.max_messages
+            if fold_end - self.folded_count < self.fold_messages:
+                return
+            self._summarizing = True
+            to_fold = conversation[self.folded_count:fold_end]
+            previous_summary = self.summary
+        thread = threading.Thread(target=self._summarize, args=(previous_summary, to_fold, fold_end), daemon=True)
+        thread.start()
+
+    def _summarize(self, previous_summary: str, to_fold: List[Dict[str, str]], fold_end: int):
+        try:
+            start_time = time.perf_counter()
+            transcript = "\n".join(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}" for msg in to_fold
+            )
+            prompt = f"Previous summary:\n{previous_summary}\n\n" if previous_summary else ""
+            prompt += f"Conversation:\n{transcript}"
+            with self.llm_semaphore or contextlib.nullcontext():
+                summary = self.summarizer_service.generate([
+                    {"role": "system", "content": "Summarize the conversation below in a few sentences, "
+                                                  "merging it with the previous summary if there is one. "
+                                                  "Keep names, facts, decisions and open questions. "
+                                                  "Reply with the summary only."},
+                    {"role": "user", "content": prompt},
+                ])
+            if not summary or summary.startswith("Error"):
+                print(f"Window: summarization failed, keeping turns verbatim ({summary})")
+                return
+            with self._lock:
+                self.summary = summary.strip()
+                self.folded_count = fold_end
+            print(f"Window: folded {len(to_fold)} messages into the summary in "
+                  f"{time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            print(f"Warning: Error while summarizing the conversation: {e}")
+        finally:
+            with self._lock:
+                self._summarizing = False
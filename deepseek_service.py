@@ -1,16 +1,73 @@
-import requests
-from sseclient import SSEClient
+import asyncio
 import json
+import threading
 import time
 import os
 
+import tracing
+from async_bridge import StreamStatus, run_sync
+from circuit_breaker import CircuitBreaker
+from lazy_import import lazy_import, module_available
+
+# Deferred until the first DeepSeek call
+requests = lazy_import("requests")
+httpx = lazy_import("httpx")
+
+try:
+    import orjson
+    _json_loads = orjson.loads  # Several times faster on the small per-token chunks
+except ImportError:
+    _json_loads = json.loads
+
+HTTPX_AVAILABLE = module_available("httpx")
+HTTP2_AVAILABLE = module_available("h2")  # Enables HTTP/2 in httpx
+
+def parse_sse_line(line):
+    """
+    Parse one raw line of the chat completions SSE stream
+
+    Returns:
+    - (token or None, True if the stream is finished)
+    """
+    # Only "data:" lines carry payloads; blank separators, comments and keep-alives are skipped
+    if not line.startswith(b"data:"):
+        return None, False
+    data = line[6:] if line[5:6] == b" " else line[5:]
+    if data == b"[DONE]":
+        return None, True
+    choices = _json_loads(data).get("choices")
+    if not choices:
+        return None, False
+    choice = choices[0]
+    delta = choice.get("delta")
+    return (delta.get("content") if delta else None), False
+
 class DeepSeekService:
-    def __init__(self, api_key, model_name="deepseek-chat"):
+    def __init__(self, api_key, model_name="deepseek-chat", pool_size=None, api_base=None):
         # Store API key and model name, set base URL for DeepSeek API
         self.api_key = api_key.strip() if api_key else ""
         self.model_name = model_name
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
+        # DEEPSEEK_BASE_URL points the service at another OpenAI-compatible server, e.g.
+        # benchmarks/fake_llm_server.py for offline benchmarks
+        api_base = (api_base or os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")).rstrip("/")
+        self.base_url = f"{api_base}/v1/chat/completions"
+        self.models_url = f"{api_base}/models"
+        self._request_state = threading.local()
         self.last_error = None
+        self.breaker = CircuitBreaker("DeepSeek")
+        
+        # One keep-alive session for all calls so DNS, TCP and TLS setup is paid once,
+        # not on every turn. The pool only needs a few sockets: one streaming reply
+        # plus the occasional concurrent health check. It is created on first use, so a
+        # server that only talks to Ollama never imports requests.
+        self.pool_size = pool_size or int(os.environ.get("DEEPSEEK_POOL_SIZE", "4"))
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.async_client = None  # Created on first async use, on the loop that uses it
         
         # Diagnostics - print API key info (first 4 chars only for security)
         if self.api_key:
@@ -18,19 +75,43 @@ class DeepSeekService:
         else:
             print("WARNING: DeepSeek API key not set or empty")
 
+    @property
+    def session(self):
+        """Pooled requests session, created on first use"""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                                        max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(self.headers)
+                self._session = session
+            return self._session
+
+    @property
+    def last_error(self):
+        """Per-thread, so concurrent sessions never see each other's failures"""
+        return getattr(self._request_state, "last_error", None)
+
+    @last_error.setter
+    def last_error(self, value):
+        self._request_state.last_error = value
+
     def generate_stream(self, messages):
+        self.last_error = None
         # Ensure we have a valid API key
         if not self.api_key:
             self.last_error = "No API key configured"
             yield "I cannot access the cloud model because no API key is configured. Please check your config.env file."
             return
 
-        # Prepare headers with API key and JSON content type
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-        
+        # Fail fast while the backend is known to be down instead of waiting for the timeout
+        if not self.breaker.allow_request():
+            self.last_error = "DeepSeek circuit open"
+            yield f" [Cloud model unavailable, retrying in {self.breaker.retry_in():.0f}s] "
+            return
+
         # Format payload with messages, enable streaming
         payload = {
             "model": self.model_name,
@@ -39,16 +120,20 @@ class DeepSeekService:
             "temperature": 0.7  # Controls creativity (0-1)
         }
         
+        llm_span = tracing.span("deepseek.generate", model=self.model_name, messages=len(messages))
         try:
             print(f"Connecting to DeepSeek API at {self.base_url}...")
-            # Send POST request with streaming enabled
-            response = requests.post(
+            start_time = time.perf_counter()
+            # Send POST request with streaming enabled over the pooled session
+            response = self.session.post(
                 self.base_url, 
-                headers=headers, 
                 json=payload, 
                 stream=True,
                 timeout=45  # Increased timeout to prevent hanging
             )
+            ttfb = time.perf_counter() - start_time
+            self._log_connection_stats(ttfb)
+            llm_span.set(ttfb_ms=ttfb * 1000, status=response.status_code)
             
             # Check if request was successful
             if response.status_code != 200:
@@ -62,44 +147,222 @@ class DeepSeekService:
                 
                 error_message = error_data.get("error", {}).get("message", f"API error: {response.status_code}")
                 self.last_error = error_message
+                self.breaker.record_failure(error_message)
                 yield f" [Error: {error_message}] "
                 return
             
-            # Parse SSE stream
-            client = SSEClient(response)
+            # Parse the SSE stream straight from the raw lines; chunk_size=None hands over
+            # each chunk as soon as it arrives instead of waiting for a fixed-size buffer
             tokens_received = 0
             
-            for event in client.events():
-                if event.event == "message":
-                    try:
-                        data = json.loads(event.data)
-                        if "choices" in data and data["choices"]:
-                            token = data["choices"][0]["delta"].get("content", "")
-                            if token:  # Yield non-empty tokens
-                                tokens_received += 1
-                                yield token
-                                
-                            # Check if we're at the end
-                            if data.get("choices", [{}])[0].get("finish_reason") == "stop":
-                                break
-                    except json.JSONDecodeError:
-                        yield " [Error parsing response] "
-                    except Exception as e:
-                        yield f" [Stream error: {str(e)}] "
-                        
+            for line in response.iter_lines(chunk_size=None):
+                # A corrupt stream fails the request; the half-read connection is dropped
+                # instead of going back to the pool
+                try:
+                    token, finished = parse_sse_line(line)
+                except ValueError as e:
+                    self.last_error = f"Error parsing response: {e}"
+                    self.breaker.record_failure(self.last_error)
+                    llm_span.set(error=self.last_error)
+                    response.close()
+                    yield " [Error parsing response] "
+                    return
+                except Exception as e:
+                    self.last_error = f"Stream error: {e}"
+                    self.breaker.record_failure(e)
+                    llm_span.set(error=self.last_error)
+                    response.close()
+                    yield f" [Stream error: {str(e)}] "
+                    return
+                if token:  # Yield non-empty tokens
+                    tokens_received += 1
+                    if tokens_received == 1:
+                        tracing.instant("deepseek.first_token", ttft_ms=(time.perf_counter() - start_time) * 1000)
+                    llm_span.set(tokens=tokens_received)
+                    yield token
+                # Reading through [DONE] leaves the connection clean for reuse by the pool
+                if finished:
+                    break
+            
             # Verify we got a valid response
             if tokens_received == 0:
+                self.last_error = "No tokens received"
+                self.breaker.record_failure(self.last_error)
                 yield " [No response content received from cloud service] "
+            else:
+                self.breaker.record_success()
                 
+        except GeneratorExit:
+            # Abandoned mid-stream (barge-in): drop the connection instead of returning it to
+            # the pool half-read, which also ends the generation we are billed for
+            response.close()
+            self.breaker.release_trial()
+            llm_span.set(cancelled=True)
+            raise
         except requests.exceptions.Timeout:
             self.last_error = "Request timed out"
+            self.breaker.record_failure(self.last_error)
+            llm_span.set(error=self.last_error)
             yield " [DeepSeek request timed out. The service might be busy.] "
         except requests.exceptions.RequestException as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
+            llm_span.set(error=str(e))
             yield f" [Error connecting to DeepSeek: {str(e)}] "
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
+            llm_span.set(error=str(e))
             yield f" [Unexpected error: {str(e)}] "
+        finally:
+            llm_span.end()
+
+    def _get_async_client(self):
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(
+                headers=dict(self.headers),
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self.async_client
+
+    async def agenerate_stream(self, messages, timeout=45.0, status=None):
+        """
+        Async variant of generate_stream
+
+        timeout bounds the connect and each read, so a stalled stream is abandoned without
+        blocking the event loop. Cancelling the consuming task closes the HTTP stream.
+        A StreamStatus passed as status receives the error, if any, that the stream
+        reports as text.
+        """
+        if status is None:
+            status = StreamStatus()
+        self.last_error = None
+        if not HTTPX_AVAILABLE:
+            self.last_error = status.error = "httpx not installed"
+            yield " [Async DeepSeek streaming needs httpx: pip install httpx] "
+            return
+        if not self.api_key:
+            self.last_error = status.error = "No API key configured"
+            yield "I cannot access the cloud model because no API key is configured. Please check your config.env file."
+            return
+        if not self.breaker.allow_request():
+            self.last_error = status.error = "DeepSeek circuit open"
+            yield f" [Cloud model unavailable, retrying in {self.breaker.retry_in():.0f}s] "
+            return
+
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "stream": True,
+            "temperature": 0.7
+        }
+        try:
+            start_time = time.perf_counter()
+            client = self._get_async_client()
+            async with client.stream("POST", self.base_url, json=payload, timeout=timeout) as response:
+                print(f"DeepSeek: TTFB {(time.perf_counter() - start_time) * 1000:.0f} ms ({response.http_version})")
+                if response.status_code != 200:
+                    await response.aread()
+                    try:
+                        error_message = response.json().get("error", {}).get("message", f"API error: {response.status_code}")
+                    except Exception:
+                        error_message = f"API error: {response.status_code}"
+                    self.last_error = status.error = error_message
+                    self.breaker.record_failure(error_message)
+                    yield f" [Error: {error_message}] "
+                    return
+
+                tokens_received = 0
+                finished = False
+                buffer = b""
+                async for chunk in response.aiter_bytes():
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        try:
+                            token, finished = parse_sse_line(line.rstrip(b"\r"))
+                        except ValueError as e:
+                            # A corrupt stream fails the request
+                            self.last_error = status.error = f"Error parsing response: {e}"
+                            self.breaker.record_failure(self.last_error)
+                            yield " [Error parsing response] "
+                            return
+                        if token:
+                            tokens_received += 1
+                            yield token
+                        if finished:
+                            break
+                    if finished:
+                        break
+
+            if tokens_received == 0:
+                self.last_error = status.error = "No tokens received"
+                self.breaker.record_failure(self.last_error)
+                yield " [No response content received from cloud service] "
+            else:
+                self.breaker.record_success()
+
+        except (asyncio.CancelledError, GeneratorExit):
+            self.last_error = status.error = "Cancelled"
+            self.breaker.release_trial()
+            raise
+        except httpx.TimeoutException:
+            self.last_error = status.error = "Request timed out"
+            self.breaker.record_failure(self.last_error)
+            yield " [DeepSeek request timed out. The service might be busy.] "
+        except httpx.HTTPError as e:
+            self.last_error = status.error = str(e)
+            self.breaker.record_failure(e)
+            yield f" [Error connecting to DeepSeek: {str(e)}] "
+        except Exception as e:
+            self.last_error = status.error = str(e)
+            self.breaker.record_failure(e)
+            yield f" [Unexpected error: {str(e)}] "
+
+    def connection_stats(self):
+        """
+        (requests sent, connections opened) over the pooled session
+
+        requests keys its urllib3 pools with the TLS settings of each request, so
+        poolmanager.connection_from_url() would build a fresh, empty pool; the counters
+        are summed over the pools the adapter actually used instead.
+        """
+        if self._session is None:
+            return 0, 0
+        pools = self._session.get_adapter(self.base_url).poolmanager.pools
+        opened = requests_sent = 0
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+        return requests_sent, opened
+
+    def _log_connection_stats(self, ttfb):
+        """Log time-to-first-byte and how often the pooled connection was reused"""
+        try:
+            requests_sent, opened = self.connection_stats()
+            print(f"DeepSeek: TTFB {ttfb * 1000:.0f} ms "
+                  f"(requests: {requests_sent}, connections opened: {opened}, reused: {requests_sent - opened})")
+        except Exception:
+            print(f"DeepSeek: TTFB {ttfb * 1000:.0f} ms")
+
+    def close(self):
+        """Close pooled connections"""
+        if self._session is not None:
+            self._session.close()
+        if self.async_client is not None:
+            # The async client belongs to the bridge loop that streamed through it (hedged generation)
+            try:
+                run_sync(self.aclose(), timeout=5)
+            except Exception as e:
+                print(f"Warning: Could not close the async DeepSeek client: {e}")
+
+    async def aclose(self):
+        """Close the async client's pooled connections"""
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
 
     def generate(self, messages):
         # Non-streaming version for full response
@@ -107,10 +370,10 @@ class DeepSeekService:
             self.last_error = "No API key configured"
             return "I cannot access the cloud model because no API key is configured. Please check your config.env file."
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        if not self.breaker.allow_request():
+            self.last_error = "DeepSeek circuit open"
+            return "Cloud model unavailable. Please try again shortly."
+
         payload = {
             "model": self.model_name,
             "messages": messages,
@@ -119,12 +382,13 @@ class DeepSeekService:
         }
         
         try:
-            response = requests.post(
+            start_time = time.perf_counter()
+            response = self.session.post(
                 self.base_url, 
-                headers=headers, 
                 json=payload,
                 timeout=45  # Increased timeout
             )
+            self._log_connection_stats(time.perf_counter() - start_time)
             
             if response.status_code != 200:
                 error_data = None
@@ -135,49 +399,49 @@ class DeepSeekService:
                 
                 error_message = error_data.get("error", {}).get("message", f"API error: {response.status_code}")
                 self.last_error = error_message
+                self.breaker.record_failure(error_message)
                 return f"Error from DeepSeek API: {error_message}"
             
             data = response.json()
+            self.breaker.record_success()
             return data["choices"][0]["message"]["content"]
         except requests.exceptions.Timeout:
             self.last_error = "Request timed out"
+            self.breaker.record_failure(self.last_error)
             return "DeepSeek request timed out. The service might be busy."
         except requests.exceptions.RequestException as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
             return f"Error connecting to DeepSeek: {str(e)}"
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
             return f"Unexpected error: {str(e)}"
 
-    def test_connection(self):
-        """Test API connection with improved error handling"""
+    def test_connection(self, force=False):
+        """
+        Test API connection with improved error handling
+
+        Probes the cheap model-list endpoint instead of running a completion, and answers
+        from the cached health state unless it is stale or force is set.
+        """
         if not self.api_key:
             print("DeepSeek test connection failed: No API key configured")
             self.last_error = "No API key configured"
             return False
+
+        if not force:
+            cached = self.breaker.cached_health()
+            if cached is not None:
+                return cached
+        if not force and not self.breaker.allow_request():
+            return False
             
         try:
             print(f"Testing DeepSeek connection with API key: {self.api_key[:4]}...{self.api_key[-4:]}")
-            # Send a small test query with short timeout
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-            payload = {
-                "model": self.model_name,
-                "messages": [{"role": "user", "content": "Hi"}],
-                "stream": False,
-                "max_tokens": 5,  # Limit response size for quick test
-                "temperature": 0.7
-            }
-            
+            start_time = time.perf_counter()
             # Use a short timeout for the connection test
-            response = requests.post(
-                self.base_url, 
-                headers=headers, 
-                json=payload,
-                timeout=10
-            )
+            response = self.session.get(self.models_url, timeout=5)
             
             print(f"DeepSeek test response status: {response.status_code}")
             
@@ -191,14 +455,24 @@ class DeepSeekService:
                 
                 error_message = error_data.get("error", {}).get("message", f"API error: {response.status_code}")
                 self.last_error = error_message
+                self.breaker.record_failure(error_message)
                 print(f"DeepSeek test connection failed: {error_message}")
                 return False
+
+            model_ids = [model.get("id") for model in response.json().get("data", [])]
+            if model_ids and self.model_name not in model_ids:
+                self.last_error = f"Model '{self.model_name}' not available"
+                self.breaker.record_failure(self.last_error)
+                print(f"DeepSeek test connection failed: {self.last_error}")
+                return False
                 
             # If we got here, the connection is good
-            print("DeepSeek test connection successful")
+            print(f"DeepSeek test connection successful ({(time.perf_counter() - start_time) * 1000:.0f} ms)")
             self.last_error = None
+            self.breaker.record_success()
             return True
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
             print(f"DeepSeek test connection failed: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,101 @@
+"""
+HedgedGenerator - Races the local and cloud LLM backends and keeps the first to answer
+"""
+import asyncio
+
+from async_bridge import StreamStatus, iterate_sync
+
+_DONE = object()
+
+class HedgedGenerator:
+    def __init__(self, hedge_delay=1.5):
+        # Seconds to wait for the preferred backend's first token before launching the other one
+        self.hedge_delay = hedge_delay
+        # Backend that produced the last hedged response, and the error it reported if any
+        self.last_service = None
+        self.last_error = None
+
+    def generate_stream(self, primary, secondary, messages):
+        """Sync adapter so ChatController can iterate the hedged stream like any service"""
+        return iterate_sync(self.agenerate_stream(primary, secondary, messages))
+
+    async def agenerate_stream(self, primary, secondary, messages):
+        """
+        Stream from primary; if it has not produced a token within hedge_delay (or fails
+        outright), start secondary too and stream whichever produces a real token first.
+        The losing request is cancelled, which closes its HTTP stream.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        tasks = {}
+        start_time = loop.time()
+
+        def launch(service):
+            async def pump():
+                # The services report failures as text; the per-call status marks those tokens
+                status = StreamStatus()
+                try:
+                    async for token in service.agenerate_stream(messages, status=status):
+                        events.put_nowait((service, token, status.error is not None))
+                finally:
+                    events.put_nowait((service, _DONE, False))
+            tasks[service] = asyncio.create_task(pump())
+
+        launch(primary)
+        winner = None
+        first_token = None
+        finished = set()
+        errors = {}
+        try:
+            while winner is None:
+                hedged = secondary in tasks
+                timeout = None if hedged else max(0.0, start_time + self.hedge_delay - loop.time())
+                try:
+                    service, token, is_error = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"\n[Hedge: no token from {primary.model_name} after {self.hedge_delay:.1f}s, "
+                          f"starting {secondary.model_name}]", flush=True)
+                    launch(secondary)
+                    continue
+
+                if token is _DONE:
+                    finished.add(service)
+                    if not hedged:
+                        # Primary gave up before the hedge delay; fail over right away
+                        launch(secondary)
+                    elif finished == set(tasks):
+                        break
+                    continue
+                if is_error:
+                    errors.setdefault(service, token)
+                    continue
+                if token:
+                    winner, first_token = service, token
+
+            self.last_service = winner or primary
+            if winner is None:
+                self.last_error = errors.get(primary) or errors.get(secondary) or "[No response from either model]"
+                yield self.last_error
+                return
+            self.last_error = None
+
+            for service, task in tasks.items():
+                if service is not winner:
+                    task.cancel()
+            if len(tasks) > 1:
+                print(f"\n[Hedge: {winner.model_name} answered first after "
+                      f"{(loop.time() - start_time) * 1000:.0f} ms]", flush=True)
+
+            yield first_token
+            while True:
+                service, token, is_error = await events.get()
+                if service is not winner:
+                    continue
+                if token is _DONE:
+                    break
+                if is_error:
+                    self.last_error = token
+                yield token
+        finally:
+            for task in tasks.values():
+                task.cancel()
@@ -3,6 +3,7 @@ HistoryService - Handles saving and loading chat history
 """
 import json
 import os
+import threading
 import uuid
 from datetime import datetime
 
@@ -10,6 +11,7 @@ class HistoryService:
     def __init__(self, history_file="chat_history.json"):
         self.history_file = history_file
         self.history = self._load_history()
+        self._lock = threading.RLock()
     
     def _load_history(self):
         if os.path.exists(self.history_file):
@@ -21,7 +23,7 @@ class HistoryService:
         return {"sessions": []}
     
     def save_history(self):
-        with open(self.history_file, "w") as f:
+        with self._lock, open(self.history_file, "w") as f:
             json.dump(self.history, f, indent=2)
     
     def add_session(self, session_messages):
@@ -32,8 +34,9 @@ class HistoryService:
             "timestamp": datetime.now().isoformat(),
             "messages": [{"timestamp": datetime.now().isoformat(), **msg} for msg in session_messages]
         }
-        self.history["sessions"].append(session_entry)
-        self.save_history()
+        with self._lock:
+            self.history["sessions"].append(session_entry)
+            self.save_history()
     
     def get_all_messages(self):
         all_messages = []
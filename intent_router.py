@@ -0,0 +1,128 @@
+"""
+IntentRouter - Answers deterministic intents locally without calling the LLM
+"""
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+class IntentRouter:
+    def __init__(self, task_service):
+        self.task_service = task_service
+
+        # Intent patterns, matched against the whole normalized utterance so that
+        # questions like "what is the time complexity of quicksort" still reach the LLM
+        self.intent_patterns = [
+            ("datetime", [
+                r"(?:hey |ok )?(?:what|what's|whats) (?:is )?(?:the )?(?:current )?(?:date and time|time and date)(?: now| today| right now)?",
+                r"(?:hey |ok )?(?:what|what's|whats) (?:is )?(?:the )?(?:current )?time(?: is it)?(?: now| right now)?",
+                r"(?:hey |ok )?what time is it(?: now| right now)?",
+                r"(?:can you |could you )?(?:please )?tell me (?:what )?(?:the )?(?:current )?time(?: it is)?(?: now| please)?",
+                r"(?:do you know )?what time it is",
+                r"(?:hey |ok )?(?:what|what's|whats) (?:is )?(?:the |today's |todays )?(?:current )?date(?: today)?",
+                r"(?:hey |ok )?what day is (?:it|today)(?: today)?",
+                r"(?:what|what's|whats) (?:is )?today",
+                r"(?:can you |could you )?(?:please )?tell me (?:the |today's |todays )?date(?: please)?",
+            ]),
+            ("overdue_tasks", [
+                r"(?:what are |show |show me |list |tell me )?(?:all )?(?:my )?overdue (?:tasks|reminders|to-?dos)",
+                r"(?:what|which) (?:tasks|reminders) are overdue",
+                r"(?:do i have|are there) any overdue (?:tasks|reminders)",
+            ]),
+            ("list_tasks", [
+                r"(?:what are|what're|whats|what's|list|show|show me|tell me|read|read out|read me) (?:all )?(?:of )?(?:my )?(?:pending |current |open )?(?:tasks|to-?dos|to do list|to-?do list|task list|reminders)(?: for today)?",
+                r"what (?:do i have|is) on my (?:task list|to-?do list|to do list|list)",
+                r"(?:do i have|are there) any (?:pending )?(?:tasks|reminders|to-?dos)",
+                r"(?:my )?(?:pending )?(?:tasks|task list)",
+            ]),
+            ("complete_task", [
+                r"(?:please )?(?:mark|set) (?:the )?(?:task )?(?P<task>.+?) (?:as )?(?:done|complete|completed|finished)",
+                r"(?:please )?(?:complete|finish|close) (?:the )?task (?P<task>.+)",
+            ]),
+            ("complete_task_casual", [
+                r"i(?: have|'ve)? (?:finished|completed) (?:the )?(?:task )?(?P<task>.+)",
+                r"i(?: am|'m) done with (?:the )?(?:task )?(?P<task>.+)",
+            ]),
+        ]
+        self.compiled_patterns = [
+            (intent, [re.compile(pattern) for pattern in patterns])
+            for intent, patterns in self.intent_patterns
+        ]
+
+    def _normalize(self, text: str) -> str:
+        text = text.lower().replace("’", "'").strip()
+        text = re.sub(r"[?.!,]+$", "", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    def match(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """
+        Match user input against the local intents
+
+        Returns:
+        - Dictionary with the intent name and captured groups, or None if no intent matched
+        """
+        text = self._normalize(user_input)
+        for intent, patterns in self.compiled_patterns:
+            for pattern in patterns:
+                match = pattern.fullmatch(text)
+                if match:
+                    return {"intent": intent, "groups": match.groupdict()}
+        return None
+
+    def route(self, user_input: str) -> Optional[str]:
+        """
+        Answer the user input locally if it is a deterministic intent
+
+        Returns:
+        - The response text, or None if the input should go to the LLM
+        """
+        start_time = time.perf_counter()
+        intent_match = self.match(user_input)
+        if not intent_match:
+            return None
+
+        intent = intent_match["intent"]
+        if intent == "datetime":
+            response = self.task_service.handle_date_query(user_input)
+        elif intent == "list_tasks":
+            response = self._describe_tasks(self.task_service.get_pending_tasks(), "pending")
+        elif intent == "overdue_tasks":
+            response = self._describe_tasks(self.task_service.get_overdue_tasks(), "overdue")
+        else:
+            response = self._complete_task(intent_match["groups"]["task"],
+                                           explicit=(intent == "complete_task"))
+
+        if response is not None:
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            print(f"Intent: answered '{intent}' locally in {elapsed_ms:.1f} ms")
+        return response
+
+    def _format_due(self, task: Dict[str, Any]) -> str:
+        if not task.get("due_at"):
+            return ""
+        try:
+            due_date = datetime.fromisoformat(task["due_at"])
+        except ValueError:
+            return ""
+        return f", due {due_date.strftime('%A, %B %d at %I:%M %p')}"
+
+    def _describe_tasks(self, tasks: List[Dict[str, Any]], label: str) -> str:
+        if not tasks:
+            return f"You have no {label} tasks."
+        if len(tasks) == 1:
+            return f"You have one {label} task: {tasks[0]['description']}{self._format_due(tasks[0])}."
+        items = "; ".join(
+            f"{i}. {task['description']}{self._format_due(task)}" for i, task in enumerate(tasks, 1)
+        )
+        return f"You have {len(tasks)} {label} tasks: {items}."
+
+    def _complete_task(self, task_ref: str, explicit: bool) -> Optional[str]:
+        task = self.task_service.find_pending_task(task_ref)
+        if not task:
+            # Casual phrasing ("I finished the book") may not be about a task at all
+            if not explicit:
+                return None
+            return f"I couldn't find a pending task matching '{task_ref}'."
+        if not self.task_service.complete_task(task["task_id"]):
+            return f"Sorry, I couldn't update the task '{task['description']}'."
+        return f"Marked '{task['description']}' as completed."
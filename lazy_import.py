@@ -0,0 +1,63 @@
+"""
+Lazy imports - Defer heavy optional dependencies until they are first used
+
+lazy_import("cv2") returns a stand-in module that imports the real one on the first
+attribute access, so importing a module of ours no longer pays for torch, OpenCV or
+pygame up front. module_available() answers the *_AVAILABLE checks without importing.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        # Two threads touching the module at once must not import it twice
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        # Only called for attributes the stand-in itself does not have
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_module is not None else "not loaded yet"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+def lazy_import(name: str):
+    """The module if it was already imported, else a LazyModule that imports it on first use"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+def preload(*modules):
+    """Import LazyModules in a background thread, e.g. while waiting on the network"""
+    def load_all():
+        for module in modules:
+            if isinstance(module, LazyModule):
+                try:
+                    module._load()
+                except Exception as e:
+                    print(f"Warning: Could not preload {module.__name__}: {e}")
+    threading.Thread(target=load_all, name="preload", daemon=True).start()
+
+def module_available(name: str) -> bool:
+    """Whether a module can be imported, without importing it (parent packages excepted)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
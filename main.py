@@ -1,28 +1,29 @@
+from startup import PROCESS_START, StartupGraph
 from chat_controller import ChatController
 from ollama_service import OllamaService
 from deepseek_service import DeepSeekService
 from history_service import HistoryService
 from context_engine import ContextEngine
 from task_service import TaskService
-import socket
+from intent_router import IntentRouter
+from hedged_generator import HedgedGenerator
+from backend_router import BackendRouter
+from response_cache import SemanticResponseCache
+from conversation_window import ConversationWindow
+from chat_server import ChatServer
+import metrics
+import recording
+import tracing
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv  # Import python-dotenv
 
-def start_server(host='192.168.143.248', port=65432):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # Add socket option to reuse address
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
-    server_socket.listen(1)
-    print(f"Server listening on {host}:{port}")
-    conn, addr = server_socket.accept()
-    print(f"Connected by {addr}")
-    # Set a timeout to make socket operations non-blocking
-    timeout = float(os.environ.get('SOCKET_TIMEOUT', '60.0'))
-    conn.settimeout(timeout)  # Use configured timeout
-    return conn, server_socket
-
 def main():
+    startup = StartupGraph()
+    phase_start = time.perf_counter()
+    startup.mark("imports", PROCESS_START, phase_start)
     # Load environment variables from config.env
     load_dotenv('config.env')  # Specify the file name explicitly
     
@@ -39,6 +40,27 @@ def main():
     tasks_file = os.environ.get('TASKS_FILE', 'tasks.json')
     deepseek_api_key = os.environ.get('DEEPSEEK_API_KEY', '')
     deepseek_model = os.environ.get('DEEPSEEK_MODEL', 'deepseek-chat')
+    stable_prefix = os.environ.get('STABLE_PREFIX', 'true').lower() == 'true'
+    hedge_delay = float(os.environ.get('HEDGE_DELAY', '0'))
+    auto_routing = os.environ.get('AUTO_ROUTING', 'false').lower() == 'true'
+    response_cache_enabled = os.environ.get('RESPONSE_CACHE', 'true').lower() == 'true'
+    response_cache_threshold = float(os.environ.get('RESPONSE_CACHE_THRESHOLD', '0.92'))
+    response_cache_ttl = float(os.environ.get('RESPONSE_CACHE_TTL', '86400'))
+    window_turns = int(os.environ.get('CONVERSATION_WINDOW_TURNS', '6'))
+    coalesce_window = float(os.environ.get('TTS_COALESCE_MS', '250')) / 1000
+    server_host = os.environ.get('SERVER_HOST', '192.168.143.248')
+    server_port = int(os.environ.get('SERVER_PORT', '65432'))
+    max_clients = int(os.environ.get('MAX_CLIENTS', '8'))
+    llm_concurrency = int(os.environ.get('LLM_CONCURRENCY', '2'))
+    socket_timeout = float(os.environ.get('SOCKET_TIMEOUT', '60.0'))
+    heartbeat_timeout = float(os.environ.get('HEARTBEAT_TIMEOUT', '15'))
+    session_grace = float(os.environ.get('SESSION_GRACE_SECONDS', '120'))
+    send_timeout = float(os.environ.get('SEND_TIMEOUT', '10'))
+    trace_file = os.environ.get('TRACE_FILE', '')
+    record_file = os.environ.get('RECORD_FILE', '')
+    metrics_port = int(os.environ.get('METRICS_PORT', '0'))
+    metrics_host = os.environ.get('METRICS_HOST', '127.0.0.1')
+    metrics_file = os.environ.get('METRICS_FILE', '')
     system_prompt = """
     You are AI Desk Buddy, a helpful assistant. 
     Use the context from previous conversations to provide relevant answers.
@@ -47,51 +69,106 @@ def main():
     When using the DeepSeek cloud model, you have more capabilities and can provide more detailed responses.
     """
 
-    # Initialize services
+    # Per-turn latency spans, off unless TRACE_FILE is set
+    tracing.configure(trace_file, process_name="server")
+    # Client frames and backend token streams for benchmarks/replay.py, off unless RECORD_FILE is set
+    recording.configure(record_file)
+    # Prometheus text format on localhost unless METRICS_HOST opts in to another interface;
+    # METRICS_PORT=0 turns the endpoint off
+    if metrics_port:
+        metrics.start_http_server(metrics_port, host=metrics_host)
+    startup.mark("config", phase_start)
+
+    # Initialize services shared by all client sessions; the slow parts (embedding model,
+    # backend probes) run as background startup steps once the socket is bound
+    phase_start = time.perf_counter()
     history_service = HistoryService(history_file)
     ollama_service = OllamaService(model_name)
     deepseek_service = DeepSeekService(deepseek_api_key, deepseek_model)
-    context_engine = ContextEngine(history_service, embeddings_file)
+    if record_file:
+        ollama_service = recording.RecordedBackend(ollama_service, "ollama")
+        deepseek_service = recording.RecordedBackend(deepseek_service, "deepseek")
+    context_engine = ContextEngine(history_service, embeddings_file, stable_prefix=stable_prefix, lazy=True)
     task_service = TaskService(tasks_file)
+    intent_router = IntentRouter(task_service)
+    backend_router = BackendRouter(ollama_service, deepseek_service) if auto_routing else None
+    response_cache = SemanticResponseCache(
+        context_engine, threshold=response_cache_threshold, ttl=response_cache_ttl
+    ) if response_cache_enabled else None
+    # Bounds concurrent generations across all clients; a local model serves one request at a time well
+    llm_semaphore = threading.BoundedSemaphore(llm_concurrency)
     
-    # Test Ollama connection
-    print("Testing Ollama connection...")
-    if ollama_service.test_connection():
-        print("✓ Ollama connection successful")
-    else:
-        print("⚠ Ollama connection failed. Check if Ollama is running.")
-    
-    # Test DeepSeek connection
-    print("Testing DeepSeek connection...")
-    if deepseek_service.test_connection():
-        print("✓ DeepSeek connection successful")
-    else:
-        print("⚠ DeepSeek connection failed. Check your API key and internet connection.")
-    
-    conn, server_socket = start_server()
+    startup.mark("services", phase_start)
+
+    def probe_ollama():
+        print("Testing Ollama connection...")
+        if ollama_service.test_connection():
+            print("✓ Ollama connection successful")
+        else:
+            print("⚠ Ollama connection failed. Check if Ollama is running.")
+            raise RuntimeError(ollama_service.last_error or "Ollama is not reachable")
+
+    def probe_deepseek():
+        print("Testing DeepSeek connection...")
+        if deepseek_service.test_connection():
+            print("✓ DeepSeek connection successful")
+        else:
+            print("⚠ DeepSeek connection failed. Check your API key and internet connection.")
+
+    # Independent of each other; turns that arrive before a step has finished simply run
+    # without retrieval or against a backend that is still loading
+    startup.add("context_engine", context_engine.load)
+    startup.add("ollama_probe", probe_ollama)
+    # Load the model now so the first question doesn't pay for a cold start
+    startup.add("ollama_warm_up", ollama_service.warm_up, after=["ollama_probe"])
+    startup.add("deepseek_probe", probe_deepseek)
     
-    chat_controller = ChatController(
-        ollama_service=ollama_service,
-        deepseek_service=deepseek_service,
-        history_service=history_service,
-        context_engine=context_engine,
-        task_service=task_service,
-        conn=conn,
-        system_prompt=system_prompt,
-        use_pi_input=True
-    )
+    def create_controller(channel):
+        """Build the per-connection session; the services above are shared"""
+        return ChatController(
+            ollama_service=ollama_service,
+            deepseek_service=deepseek_service,
+            history_service=history_service,
+            context_engine=context_engine,
+            task_service=task_service,
+            intent_router=intent_router,
+            # Hedged generation is opt-in: HEDGE_DELAY > 0 races the other backend after that many seconds
+            hedged_generator=HedgedGenerator(hedge_delay) if hedge_delay > 0 else None,
+            backend_router=backend_router,
+            response_cache=response_cache,
+            # Summaries are written by the local model so long sessions don't cost cloud tokens
+            conversation_window=(ConversationWindow(ollama_service, max_turns=window_turns, llm_semaphore=llm_semaphore)
+                                 if window_turns > 0 else None),
+            coalesce_window=coalesce_window,
+            llm_semaphore=llm_semaphore,
+            conn=channel,
+            system_prompt=system_prompt,
+            use_pi_input=True
+        )
     
+    server = ChatServer(create_controller, host=server_host, port=server_port, max_clients=max_clients,
+                        socket_timeout=socket_timeout, heartbeat_timeout=heartbeat_timeout,
+                        session_grace=session_grace, send_timeout=send_timeout)
+    listen_start = time.perf_counter()
+
+    def on_listening():
+        startup.mark("listen", listen_start)
+        startup.start()
+
     try:
-        chat_controller.run_chat_loop()
+        asyncio.run(server.serve(on_listening))
     except KeyboardInterrupt:
         print("\nExiting AI Desk Buddy. Goodbye!")
     except Exception as e:
         print(f"\nUnexpected error: {e}")
     finally:
         history_service.save_history()
-        conn.close()
-        server_socket.close()  # Also close the server socket
+        deepseek_service.close()
+        tracing.configure(None)
+        recording.configure(None)
+        if metrics_file:
+            metrics.dump(metrics_file)
         print("All connections closed. Goodbye!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,246 @@
+"""
+MarkdownStripper - Removes Markdown formatting from a token stream before it is spoken
+
+LLM tokens split Markdown markers arbitrarily ("*", "*bold", "*"), so the stripper keeps
+its parsing state between feed() calls and holds back only the few characters it cannot
+classify yet. Whitespace is passed through unchanged.
+"""
+import re
+
+# Characters that can start inline formatting; everything between them is copied in one slice
+_INLINE_SPECIAL = re.compile(r"[*_~`\[\]\n]")
+_CODE_SPAN_SPECIAL = re.compile(r"[`\n]")
+
+class MarkdownStripper:
+    def __init__(self, max_link_text=200):
+        # Link text is held back until "](" confirms it is a link; longer runs are released as-is
+        self.max_link_text = max_link_text
+        self.reset()
+
+    def reset(self):
+        self.pending = ""          # Input held back because the next characters decide what it is
+        self.prev_char = "\n"      # Last input character consumed, for emphasis flanking rules
+        self.at_line_start = True
+        self.in_fence = False
+        self.skip_line = False     # Dropping the rest of a fence or rule line
+        self.in_code_span = False
+        self.in_link_url = False
+        self.url_depth = 0
+        self.link_text = None      # Output collected since "[" while it may still be a link
+
+    def feed(self, text: str) -> str:
+        """Consume the next piece of the stream and return the clean text that is now final"""
+        return self._process(self.pending + text, final=False)
+
+    def flush(self) -> str:
+        """Finish the stream, releasing anything held back, and reset for the next one"""
+        output = self._process(self.pending, final=True)
+        if self.link_text is not None:
+            output += "[" + "".join(self.link_text)
+        self.reset()
+        return output
+
+    def _process(self, data: str, final: bool) -> str:
+        out = []
+        self.pending = ""
+        i, n = 0, len(data)
+
+        def emit(text):
+            if self.link_text is not None:
+                self.link_text.append(text)
+            else:
+                out.append(text)
+
+        def release_link(as_link):
+            text = "".join(self.link_text)
+            self.link_text = None
+            emit(text if as_link else "[" + text)
+
+        while i < n:
+            if self.skip_line:
+                end = data.find("\n", i)
+                if end < 0:
+                    i = n
+                    break
+                self.skip_line = False
+                self.at_line_start = True
+                i = end + 1
+                continue
+
+            if self.in_link_url:
+                # Skip the URL, allowing balanced parentheses inside it
+                while i < n and self.url_depth:
+                    if data[i] == "(":
+                        self.url_depth += 1
+                    elif data[i] == ")":
+                        self.url_depth -= 1
+                    i += 1
+                if self.url_depth:
+                    break
+                self.in_link_url = False
+                release_link(True)
+                continue
+
+            if self.at_line_start:
+                j = i
+                while j < n and data[j] in " \t":
+                    j += 1
+                if j == n and not final:
+                    self.pending = data[i:]
+                    break
+                c = data[j] if j < n else ""
+
+                # Code fences: drop the ``` lines, keep the code itself
+                if c in "`~":
+                    if n - j < 3 and not final:
+                        self.pending = data[i:]
+                        break
+                    if data.startswith(c * 3, j):
+                        self.in_fence = not self.in_fence
+                        self.skip_line = True
+                        i = j + 3
+                        continue
+
+                if not self.in_fence:
+                    # Headings, bullets and block quotes: drop the marker
+                    if c == "#":
+                        k = j
+                        while k < n and data[k] == "#":
+                            k += 1
+                        if k == n and not final:
+                            self.pending = data[i:]
+                            break
+                        if k - j <= 6 and (k == n or data[k] in " \t"):
+                            self.at_line_start = False
+                            self.prev_char = " "
+                            i = k + 1
+                            continue
+
+                    # Horizontal rules (---, ***, ___): drop the whole line
+                    if c in "-*_":
+                        end = data.find("\n", j)
+                        line = data[j:end if end >= 0 else n]
+                        rule_chars = set(line) <= {c, " ", "\t", "\r"}
+                        # Hold the line back while it could still become a rule
+                        if rule_chars and end < 0 and not final and len(line) < 80:
+                            self.pending = data[i:]
+                            break
+                        if rule_chars and line.count(c) >= 3:
+                            self.skip_line = True
+                            i = j
+                            continue
+
+                    if c in "-*+>":
+                        if j + 1 == n and not final:
+                            self.pending = data[i:]
+                            break
+                        if c == ">" or j + 1 == n or data[j + 1] in " \t":
+                            self.at_line_start = False
+                            self.prev_char = " "
+                            i = j + 2 if j + 1 < n and data[j + 1] in " \t" else j + 1
+                            continue
+
+                self.at_line_start = False
+                if j > i:
+                    emit(data[i:j])
+                i = j
+                continue
+
+            if self.in_fence:
+                end = data.find("\n", i)
+                if end < 0:
+                    emit(data[i:])
+                    i = n
+                    break
+                emit(data[i:end + 1])
+                self.at_line_start = True
+                i = end + 1
+                continue
+
+            match = (_CODE_SPAN_SPECIAL if self.in_code_span else _INLINE_SPECIAL).search(data, i)
+            if not match:
+                emit(data[i:])
+                i = n
+                break
+            j = match.start()
+            if j > i:
+                emit(data[i:j])
+            c = data[j]
+
+            if c == "\n":
+                if self.link_text is not None:
+                    release_link(False)
+                self.in_code_span = False
+                self.at_line_start = True
+                emit("\n")
+                i = j + 1
+
+            elif c == "`":
+                k = j
+                while k < n and data[k] == "`":
+                    k += 1
+                if k == n and not final:
+                    self.pending = data[j:]
+                    i = j
+                    break
+                self.in_code_span = not self.in_code_span
+                i = k
+
+            elif c in "*_~":
+                k = j
+                while k < n and data[k] == c:
+                    k += 1
+                if k == n and not final:
+                    self.pending = data[j:]
+                    i = j
+                    break
+                prev = data[j - 1] if j > 0 else self.prev_char
+                nxt = data[k] if k < n else " "
+                marker = data[j:k]
+                if c == "~" and len(marker) < 2:
+                    literal = True  # "~5 minutes"
+                elif c == "_" and prev.isalnum() and nxt.isalnum():
+                    literal = True  # snake_case
+                elif c == "*" and prev.isdigit() and nxt.isdigit():
+                    literal = True  # "5*3"
+                else:
+                    literal = prev.isspace() and nxt.isspace()  # "2 * 3"
+                if literal:
+                    emit(marker)
+                i = k
+
+            elif c == "[":
+                if self.link_text is None:
+                    self.link_text = []
+                else:
+                    emit("[")
+                i = j + 1
+
+            else:  # "]"
+                if self.link_text is None:
+                    emit("]")
+                    i = j + 1
+                elif j + 1 == n and not final:
+                    self.pending = data[j:]
+                    i = j
+                    break
+                elif j + 1 < n and data[j + 1] == "(":
+                    self.in_link_url = True
+                    self.url_depth = 1
+                    i = j + 2
+                else:
+                    self.link_text.append("]")
+                    release_link(False)
+                    i = j + 1
+
+            if self.link_text is not None and sum(map(len, self.link_text)) > self.max_link_text:
+                release_link(False)
+
+        if i > 0:
+            self.prev_char = data[i - 1]
+        return "".join(out)
+
+def strip_markdown(text):
+    """Remove common Markdown formatting from a complete text."""
+    stripper = MarkdownStripper()
+    return (stripper.feed(text) + stripper.flush()).strip()
@@ -0,0 +1,200 @@
+"""
+MemoryCompactor - Offline compaction of the long-term memory index
+
+Drops low-information messages, collapses near-duplicates and replaces old sessions
+with one summary entry each. Run it while the server is stopped:
+
+    python memory_compactor.py --older-than-days 14
+"""
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any
+
+from dotenv import load_dotenv
+
+from context_engine import ContextEngine, content_key
+from history_service import HistoryService
+
+class MemoryCompactor:
+    def __init__(self, context_engine, history_service, summarizer_service=None,
+                 dedup_threshold=0.95, older_than_days=14, min_words=3):
+        self.context_engine = context_engine
+        self.history_service = history_service
+        # Optional LLM for abstractive summaries; without it summaries are extractive
+        self.summarizer_service = summarizer_service
+        self.dedup_threshold = dedup_threshold
+        self.older_than_days = older_than_days
+        self.min_words = min_words
+        self.low_info_patterns = [
+            re.compile(pattern, re.IGNORECASE) for pattern in [
+                r"^(hi|hello|hey)( there)?[\s,!.]*(how are you|how is it going|how's it going|how is going|"
+                r"what's up|whats up|what's going on|whats going on)?[\s?!.]*$",
+                r"^(ok|okay|yes|no|thanks|thank you|bye|ok bye|good (morning|afternoon|evening|night))\W*$",
+                r"^let me think",
+                r"^switch to (cloud|local)$",
+                r"^(please respond with 'yes' or 'no'|no response received within the timeout)",
+                r"^\s*\[.*\]\s*$",  # bare error markers such as "[Error with Ollama: ...]"
+            ]
+        ]
+
+    def _is_low_info(self, content: str) -> bool:
+        text = content.strip()
+        if len(text.split()) < self.min_words:
+            return True
+        return any(pattern.search(text) for pattern in self.low_info_patterns)
+
+    def measure(self, messages: List[Dict[str, Any]], vectors: List[List[float]],
+                sample_size=20, repeats=5) -> Dict[str, Any]:
+        """Index size and retrieval latency, using stored vectors as queries"""
+        size_bytes = len(json.dumps({"messages": messages, "vectors": vectors}))
+        queries = vectors[::max(1, len(vectors) // sample_size)][:sample_size]
+        latency_ms = 0.0
+        if queries:
+            start_time = time.perf_counter()
+            for _ in range(repeats):
+                for query_vector in queries:
+                    scores = [(i, self.context_engine._compute_similarity(query_vector, doc_vector))
+                              for i, doc_vector in enumerate(vectors)]
+                    scores.sort(key=lambda x: x[1], reverse=True)
+            latency_ms = (time.perf_counter() - start_time) * 1000 / (repeats * len(queries))
+        return {"entries": len(vectors), "size_bytes": size_bytes, "query_ms": latency_ms}
+
+    def _summarize_session(self, session: Dict[str, Any]) -> str:
+        turns = [msg for msg in session["messages"] if msg["role"] in ("user", "assistant")
+                 and not self._is_low_info(msg["content"])]
+        date = session.get("timestamp", "")[:10]
+        if not turns:
+            return ""
+        if self.summarizer_service:
+            transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in turns)
+            summary = self.summarizer_service.generate([
+                {"role": "system", "content": "Summarize this conversation in two or three sentences. "
+                                              "Keep names, facts about the user, decisions and tasks. "
+                                              "Reply with the summary only."},
+                {"role": "user", "content": transcript},
+            ])
+            if summary and not summary.startswith("Error"):
+                return f"Summary of conversation on {date}: {summary.strip()}"
+        # Extractive fallback: what the user talked about
+        topics = "; ".join(msg["content"].strip() for msg in turns if msg["role"] == "user")
+        if len(topics) > 400:
+            topics = topics[:397] + "..."
+        return f"Summary of conversation on {date}: the user talked about {topics}" if topics else ""
+
+    def compact(self, dry_run=False) -> Dict[str, Any]:
+        engine = self.context_engine
+        store = engine.embeddings
+        before = self.measure(store["messages"], store["vectors"])
+
+        compacted_sessions = set(store.get("compacted_sessions", []))
+        excluded = set(store.get("excluded", []))
+        # Live-added entries carry no session id, so map them back through the history
+        session_of = {msg["content"]: msg["session_id"] for msg in self.history_service.get_all_messages()}
+
+        entries = list(zip(store["messages"], store["vectors"]))
+        stats = {"low_info": 0, "duplicates": 0, "summarized_sessions": 0, "summarized_messages": 0}
+
+        # 1. Replace old sessions with one summary entry each
+        cutoff = (datetime.now() - timedelta(days=self.older_than_days)).isoformat()
+        old_sessions = {
+            session["session_id"]: session for session in self.history_service.history["sessions"]
+            if session.get("timestamp", "") < cutoff and session["session_id"] not in compacted_sessions
+        }
+        summary_entries = []
+        if old_sessions and engine.model:
+            for session_id, session in old_sessions.items():
+                summary = self._summarize_session(session)
+                if summary:
+                    summary_entries.append(({
+                        "content": summary,
+                        "role": "summary",
+                        "session_id": session_id,
+                        "timestamp": session.get("timestamp", "")
+                    }, engine.embed(summary)))
+                compacted_sessions.add(session_id)
+                stats["summarized_sessions"] += 1
+            kept = []
+            for msg, vector in entries:
+                if msg["role"] != "summary" and \
+                        session_of.get(msg["content"], msg.get("session_id")) in old_sessions:
+                    stats["summarized_messages"] += 1
+                    continue
+                kept.append((msg, vector))
+            entries = kept
+        elif old_sessions:
+            print("Compaction: embedding model unavailable, skipping session summaries")
+
+        # 2. Drop greetings, fillers and error markers
+        kept = []
+        for msg, vector in entries:
+            if msg["role"] != "summary" and self._is_low_info(msg["content"]):
+                excluded.add(content_key(msg["content"]))
+                stats["low_info"] += 1
+                continue
+            kept.append((msg, vector))
+        entries = kept
+
+        # 3. Collapse near-duplicates, keeping the most recent copy
+        kept = []
+        for msg, vector in reversed(entries):
+            duplicate = any(
+                kept_msg["role"] == msg["role"] and
+                engine._compute_similarity(vector, kept_vector) >= self.dedup_threshold
+                for kept_msg, kept_vector in kept
+            )
+            if duplicate:
+                excluded.add(content_key(msg["content"]))
+                stats["duplicates"] += 1
+                continue
+            kept.append((msg, vector))
+        entries = list(reversed(kept)) + summary_entries
+        after = self.measure([msg for msg, _ in entries], [vector for _, vector in entries])
+
+        if not dry_run:
+            store["messages"] = [msg for msg, _ in entries]
+            store["vectors"] = [vector for _, vector in entries]
+            store["compacted_sessions"] = sorted(compacted_sessions)
+            store["excluded"] = sorted(excluded)
+            engine._save_embeddings()
+        return {"before": before, "after": after, **stats}
+
+def print_report(report: Dict[str, Any]):
+    before, after = report["before"], report["after"]
+    print("\n--- Memory compaction report ---")
+    print(f"Dropped low-information messages: {report['low_info']}")
+    print(f"Collapsed near-duplicates:        {report['duplicates']}")
+    print(f"Summarized sessions:              {report['summarized_sessions']} "
+          f"({report['summarized_messages']} messages)")
+    print(f"Index entries: {before['entries']} -> {after['entries']}")
+    print(f"Index size:    {before['size_bytes'] / 1024:.0f} KiB -> {after['size_bytes'] / 1024:.0f} KiB")
+    print(f"Query latency: {before['query_ms']:.2f} ms -> {after['query_ms']:.2f} ms (similarity scan)")
+    print("--------------------------------")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the AI Desk Buddy long-term memory index")
+    parser.add_argument("--older-than-days", type=int, default=14,
+                        help="Summarize sessions older than this many days")
+    parser.add_argument("--dedup-threshold", type=float, default=0.95,
+                        help="Cosine similarity above which messages count as duplicates")
+    parser.add_argument("--llm", action="store_true", help="Write session summaries with the local Ollama model")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without saving")
+    args = parser.parse_args()
+
+    load_dotenv('config.env')
+    history_service = HistoryService(os.environ.get('HISTORY_FILE', 'chat_history.json'))
+    context_engine = ContextEngine(history_service, os.environ.get('EMBEDDINGS_FILE', 'embeddings.pkl'))
+    summarizer_service = None
+    if args.llm:
+        from ollama_service import OllamaService
+        summarizer_service = OllamaService(os.environ.get('MODEL_NAME', 'gemma'))
+
+    compactor = MemoryCompactor(context_engine, history_service, summarizer_service,
+                                dedup_threshold=args.dedup_threshold, older_than_days=args.older_than_days)
+    print_report(compactor.compact(dry_run=args.dry_run))
+
+if __name__ == "__main__":
+    main()
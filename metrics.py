@@ -0,0 +1,235 @@
+"""
+Metrics - In-process counters, gauges and latency histograms
+
+Metrics are created once at module level, next to the code that records them:
+
+    RETRIEVAL_SECONDS = metrics.histogram("context_retrieval_seconds", "Context retrieval latency")
+    RETRIEVAL_SECONDS.observe(elapsed)
+
+The registry is served in the Prometheus text format by start_http_server() and can be
+written to a file with dump(), e.g. at shutdown. Histograms keep HDR-style log-linear
+buckets, so percentiles stay within about 1.5% at any scale without a preset bucket list;
+they are exposed as Prometheus summaries (quantiles, sum and count).
+"""
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.9, 0.99, 1.0)  # 1.0 is the maximum
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class Gauge:
+    """A value that goes up and down; with fn it is read from fn() at collection time"""
+
+    def __init__(self, fn=None):
+        self.value = 0.0
+        self.fn = fn
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def samples(self, name, labels):
+        if self.fn is None:
+            yield name, labels, self.value
+            return
+        try:
+            yield name, labels, float(self.fn())
+        except Exception:
+            pass  # The object behind fn is gone or busy; skip this sample
+
+class Histogram:
+    """
+    Latency distribution in log-linear buckets
+
+    Every power of two is split into sub_buckets equal parts, so a recorded value lands in a
+    bucket at most 1/sub_buckets of its size wide, whatever its magnitude.
+    """
+
+    def __init__(self, sub_buckets=64):
+        self.sub_buckets = sub_buckets
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, value):
+        if value <= 0:
+            return None
+        mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, mantissa in [0.5, 1)
+        return exponent * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+
+    def _upper_bound(self, bucket):
+        if bucket is None:
+            return 0.0
+        exponent, sub = divmod(bucket, self.sub_buckets)
+        return math.ldexp(0.5 + (sub + 1) / (2 * self.sub_buckets), exponent)
+
+    def observe(self, value: float):
+        bucket = self._bucket(value)
+        with self._lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def time(self):
+        """Context manager that observes the duration of its block in seconds"""
+        return _Timer(self)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            if not self.count:
+                return math.nan
+            rank = q * self.count
+            seen = 0
+            # None (zero or negative values) sorts first
+            for bucket in sorted(self.buckets, key=lambda b: -math.inf if b is None else b):
+                seen += self.buckets[bucket]
+                if seen >= rank:
+                    # The bucket's upper edge, but never beyond what was actually recorded
+                    return min(self._upper_bound(bucket), self.max)
+            return self.max
+
+    def samples(self, name, labels):
+        for q in QUANTILES:
+            yield name, {**labels, "quantile": str(q)}, self.quantile(q)
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "summary"}
+
+class Registry:
+    def __init__(self):
+        self.families = {}  # name -> (type, help, {label items: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, factory):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            kind, _, children = self.families.setdefault(name, (cls, help_text, {}))
+            if kind is not cls:
+                raise ValueError(f"Metric {name} is already registered as a {_TYPES[kind]}")
+            if key not in children:
+                children[key] = factory()
+            return children[key]
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels, Counter)
+
+    def gauge(self, name: str, help_text: str, fn=None, **labels) -> Gauge:
+        gauge = self._get(Gauge, name, help_text, labels, Gauge)
+        if fn is not None:
+            gauge.fn = fn  # The latest owner wins, e.g. a service created again
+        return gauge
+
+    def histogram(self, name: str, help_text: str, **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, Histogram)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            families = [(name, kind, help_text, list(children.items()))
+                        for name, (kind, help_text, children) in sorted(self.families.items())]
+        lines = []
+        for name, kind, help_text, children in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {_TYPES[kind]}")
+            for key, metric in children:
+                for sample_name, labels, value in metric.samples(name, dict(key)):
+                    lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _format_value(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+registry = Registry()
+
+def counter(name: str, help_text: str, **labels) -> Counter:
+    return registry.counter(name, help_text, **labels)
+
+def gauge(name: str, help_text: str, fn=None, **labels) -> Gauge:
+    return registry.gauge(name, help_text, fn, **labels)
+
+def histogram(name: str, help_text: str, **labels) -> Histogram:
+    return registry.histogram(name, help_text, **labels)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per scrape would drown the chat log
+
+def start_http_server(port: int, host="127.0.0.1"):
+    """Serve /metrics from a background thread; returns the server, or None if the port is taken"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Warning: Could not serve metrics on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+def dump(path: str):
+    """Write the current metrics to a file in the Prometheus text format"""
+    try:
+        with open(path, "w") as f:
+            f.write(registry.render())
+        print(f"Metrics written to {path}")
+    except IOError as e:
+        print(f"Warning: Could not write metrics: {e}")
@@ -1,52 +1,224 @@
 """
 OllamaService - Handles interactions with the Ollama model
 """
+import asyncio
 import ollama
+import os
+import threading
 import time
 
+import tracing
+from async_bridge import StreamStatus
+from circuit_breaker import CircuitBreaker
+
 class OllamaService:
-    def __init__(self, model_name="llama3.2:3b"):
+    def __init__(self, model_name="llama3.2:3b", host=None, keep_alive=None):
         self.model_name = model_name
+        self._request_state = threading.local()
         self.last_error = None
-    
+        self.breaker = CircuitBreaker("Ollama")
+        # One persistent client (and HTTP connection pool) for all requests;
+        # host defaults to OLLAMA_HOST or the local server
+        self.client = ollama.Client(host=host)
+        self.async_client = ollama.AsyncClient(host=host)
+        # How long Ollama keeps the model resident after a request ("30m", "-1m" = forever)
+        keep_alive = keep_alive or os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+        self.keep_alive = int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive
+
+    @property
+    def last_error(self):
+        """Error of the calling thread's last request; sessions share one service instance"""
+        return getattr(self._request_state, "last_error", None)
+
+    @last_error.setter
+    def last_error(self, value):
+        self._request_state.last_error = value
+
+    def warm_up(self):
+        """Load the model into memory ahead of the first user turn"""
+        try:
+            start_time = time.perf_counter()
+            # An empty prompt makes Ollama load the model without generating anything
+            response = self.client.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+            load_ms = response.get("load_duration", 0) / 1e6
+            print(f"Ollama: model {self.model_name} loaded in {(time.perf_counter() - start_time) * 1000:.0f} ms "
+                  f"(load {load_ms:.0f} ms, keep_alive {self.keep_alive})")
+            self.breaker.record_success()
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            self.breaker.record_failure(e)
+            print(f"Ollama warm-up failed: {e}")
+            return False
+
+    def _log_turn_stats(self, ttft, final_chunk):
+        """
+        Log time-to-first-token (labelled cold when the request had to load the model)
+        and the prefill cost, i.e. prompt tokens Ollama actually had to evaluate
+        rather than reuse from its prompt cache
+        """
+        load_ms = (final_chunk.get("load_duration") or 0) / 1e6
+        prefill_tokens = final_chunk.get("prompt_eval_count") or 0
+        prefill_ms = (final_chunk.get("prompt_eval_duration") or 0) / 1e6
+        state = "cold" if load_ms > 500 else "warm"
+        print(f"\n[Ollama: {state} start, TTFT {ttft * 1000:.0f} ms, model load {load_ms:.0f} ms, "
+              f"prefill {prefill_tokens} tokens in {prefill_ms:.0f} ms]", flush=True)
+
     def generate_stream(self, messages):
+        self.last_error = None
+        if not self.breaker.allow_request():
+            self.last_error = "Ollama circuit open"
+            yield f"[Local model unavailable, retrying in {self.breaker.retry_in():.0f}s]"
+            return
+        llm_span = tracing.span("ollama.generate", model=self.model_name, messages=len(messages))
         try:
-            stream = ollama.chat(model=self.model_name, messages=messages, stream=True)
+            start_time = time.perf_counter()
+            stream = self.client.chat(model=self.model_name, messages=messages, stream=True,
+                                      keep_alive=self.keep_alive)
             tokens_received = 0
-            
+            ttft = None
+
             for chunk in stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                    tracing.instant("ollama.first_token", ttft_ms=ttft * 1000)
                 tokens_received += 1
+                llm_span.set(tokens=tokens_received)
                 token = chunk["message"]["content"]
+                if chunk.get("done"):
+                    self._log_turn_stats(ttft, chunk)
                 yield token
-                
+
             if tokens_received == 0:
                 self.last_error = "No tokens received"
+                self.breaker.record_failure(self.last_error)
                 yield "[No response content received from local model]"
-                
+            else:
+                self.breaker.record_success()
+
+        except GeneratorExit:
+            # The caller stopped reading (barge-in): closing the HTTP stream makes Ollama stop generating
+            stream.close()
+            self.breaker.release_trial()
+            llm_span.set(cancelled=True)
+            raise
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
+            llm_span.set(error=str(e))
             yield f"[Error with Ollama: {str(e)}]"
-    
+        finally:
+            llm_span.end()
+
+    async def agenerate_stream(self, messages, timeout=45.0, status=None):
+        """
+        Async variant of generate_stream
+
+        timeout bounds the wait for each chunk, so a stalled model is abandoned without
+        blocking the event loop. Cancelling the consuming task closes the HTTP stream,
+        which makes Ollama stop generating. A StreamStatus passed as status receives
+        the error, if any, that the stream reports as text.
+        """
+        if status is None:
+            status = StreamStatus()
+        self.last_error = None
+        if not self.breaker.allow_request():
+            self.last_error = status.error = "Ollama circuit open"
+            yield f"[Local model unavailable, retrying in {self.breaker.retry_in():.0f}s]"
+            return
+        stream = None
+        try:
+            start_time = time.perf_counter()
+            stream = await asyncio.wait_for(
+                self.async_client.chat(model=self.model_name, messages=messages, stream=True,
+                                       keep_alive=self.keep_alive),
+                timeout
+            )
+            tokens_received = 0
+            ttft = None
+
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                tokens_received += 1
+                if chunk.get("done"):
+                    self._log_turn_stats(ttft, chunk)
+                yield chunk["message"]["content"]
+
+            if tokens_received == 0:
+                self.last_error = status.error = "No tokens received"
+                self.breaker.record_failure(self.last_error)
+                yield "[No response content received from local model]"
+            else:
+                self.breaker.record_success()
+
+        except (asyncio.CancelledError, GeneratorExit):
+            self.last_error = status.error = "Cancelled"
+            self.breaker.release_trial()
+            raise
+        except asyncio.TimeoutError:
+            self.last_error = status.error = "Request timed out"
+            self.breaker.record_failure(self.last_error)
+            yield "[Ollama request timed out]"
+        except Exception as e:
+            self.last_error = status.error = str(e)
+            self.breaker.record_failure(e)
+            yield f"[Error with Ollama: {str(e)}]"
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
     def generate(self, messages):
+        if not self.breaker.allow_request():
+            self.last_error = "Ollama circuit open"
+            return "Error with Ollama: local model unavailable"
         try:
-            response = ollama.chat(model=self.model_name, messages=messages)
+            response = self.client.chat(model=self.model_name, messages=messages,
+                                        keep_alive=self.keep_alive)
+            self.breaker.record_success()
             return response["message"]["content"]
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
             return f"Error with Ollama: {str(e)}"
-    
-    def test_connection(self):
-        """Test connection to Ollama server"""
+
+    def _model_available(self, models):
+        """Check the model list from /api/tags for our model (untagged names mean :latest)"""
+        wanted = self.model_name if ":" in self.model_name else f"{self.model_name}:latest"
+        for model in models:
+            name = model.get("model") or model.get("name") or ""
+            if name == wanted or name == self.model_name:
+                return True
+        return False
+
+    def test_connection(self, force=False):
+        """
+        Test connection to Ollama server
+
+        Uses the cheap model-list endpoint instead of a completion, and answers from the
+        cached health state unless it is stale or force is set.
+        """
+        if not force:
+            cached = self.breaker.cached_health()
+            if cached is not None:
+                return cached
+        if not force and not self.breaker.allow_request():
+            return False
         try:
-            # Try a simple query to see if Ollama is responsive
-            ollama.chat(
-                model=self.model_name, 
-                messages=[{"role": "user", "content": "Hi"}],
-                options={"num_predict": 1}  # Limit to a single token for speed
-            )
+            start_time = time.perf_counter()
+            models = self.client.list()["models"]
+            if not self._model_available(models):
+                raise RuntimeError(f"model '{self.model_name}' is not pulled")
             self.last_error = None
+            self.breaker.record_success()
+            print(f"Ollama health probe OK in {(time.perf_counter() - start_time) * 1000:.0f} ms")
             return True
         except Exception as e:
             self.last_error = str(e)
+            self.breaker.record_failure(e)
             print(f"Ollama test connection failed: {e}")
-            return False
\ No newline at end of file
+            return False
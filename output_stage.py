@@ -0,0 +1,43 @@
+"""
+TokenCoalescer - Batches LLM tokens into phrases before they are framed and sent to the Pi
+"""
+import time
+
+class TokenCoalescer:
+    def __init__(self, emit, window=0.25, max_chars=200, boundaries=".!?,;:\n"):
+        # emit(text) is called once per batch instead of once per token
+        self.emit = emit
+        # A batch is sent when it ends on a phrase boundary, when its first token has waited
+        # window seconds, or when it grows past max_chars. The Pi's TTS only speaks whole
+        # sentences, so holding a few tokens for a phrase is not audible.
+        self.window = window
+        self.max_chars = max_chars
+        self.boundaries = boundaries
+        self.buffer = []
+        self.buffered_chars = 0
+        self.started_at = 0.0
+        self.tokens = 0
+        self.batches = 0
+
+    def add(self, token):
+        if not token:
+            return
+        if not self.buffer:
+            self.started_at = time.monotonic()
+        self.buffer.append(token)
+        self.buffered_chars += len(token)
+        self.tokens += 1
+        last_char = token.rstrip(" ")[-1:]
+        if ((last_char and last_char in self.boundaries)
+                or self.buffered_chars >= self.max_chars
+                or time.monotonic() - self.started_at >= self.window):
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered_chars = 0
+        self.batches += 1
+        self.emit(text)
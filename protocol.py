@@ -0,0 +1,238 @@
+"""
+Protocol - Length-prefixed framing for the link between the Pi client and the server
+
+Every message is a 5-byte header (payload length, message type) followed by a UTF-8
+payload, so messages survive TCP splitting and coalescing writes. A framed client opens
+the connection with MAGIC; clients that do not are served with the old string prefixes.
+"""
+import asyncio
+import socket
+import struct
+from collections import deque
+import threading
+import time
+
+MAGIC = b"ADB\x01"
+
+MSG_NAME = 1
+MSG_INPUT = 2
+MSG_TTS = 3
+MSG_TTS_END = 4
+MSG_EXIT = 5
+MSG_CANCEL = 6       # Pi -> server: stop generating the current response (barge-in)
+MSG_CANCEL_ACK = 7   # server -> Pi: every frame of the cancelled response has been sent
+
+# Session control. PING/PONG carry the sender's count of data frames received, which
+# doubles as an acknowledgement; RESUME carries "<token> <count>" and RESUMED "<count>".
+MSG_PING = 8
+MSG_PONG = 9
+MSG_SESSION = 10     # server -> Pi: token of a newly started session
+MSG_RESUME = 11      # Pi -> server: first frame on a reconnect, to continue a session
+MSG_RESUMED = 12     # server -> Pi: session found, missing frames follow
+CONTROL_TYPES = {MSG_PING, MSG_PONG, MSG_SESSION, MSG_RESUME, MSG_RESUMED}
+
+# Set on the type byte when the payload starts with a trace ID: one length byte, then
+# the ID in ASCII, then the text. Used on INPUT so a turn can be traced across the link.
+TRACE_FLAG = 0x80
+
+# The string prefixes of the legacy protocol, one message per recv()
+LEGACY_PREFIXES = {
+    MSG_NAME: "NAME:",
+    MSG_INPUT: "INPUT:",
+    MSG_TTS: "TTS:",
+    MSG_TTS_END: "TTS_END:",
+    MSG_EXIT: "EXIT:",
+    MSG_CANCEL: "CANCEL:",
+    MSG_CANCEL_ACK: "CANCEL_ACK:",
+}
+
+HEADER = struct.Struct("!IB")
+MAX_PAYLOAD = 16 * 1024 * 1024
+SOCKET_BUFFER_SIZE = 256 * 1024
+RECV_SIZE = 64 * 1024
+
+class Message(tuple):
+    """A received (message type, text) pair; trace_id is set when the frame carried one"""
+
+    def __new__(cls, msg_type, text, trace_id=None):
+        message = super().__new__(cls, (msg_type, text))
+        message.trace_id = trace_id
+        return message
+
+def encode_frame(msg_type: int, text: str = "", trace_id: str = None) -> bytes:
+    payload = text.encode("utf-8")
+    if trace_id:
+        trace = trace_id.encode("ascii")
+        payload = bytes([len(trace)]) + trace + payload
+        msg_type |= TRACE_FLAG
+    return HEADER.pack(len(payload), msg_type) + payload
+
+def decode_payload(msg_type: int, payload: bytes) -> Message:
+    if msg_type & TRACE_FLAG:
+        length = payload[0]
+        return Message(msg_type & ~TRACE_FLAG, payload[1 + length:].decode("utf-8"),
+                       payload[1:1 + length].decode("ascii"))
+    return Message(msg_type, payload.decode("utf-8"))
+
+def encode_legacy(msg_type: int, text: str = "") -> bytes:
+    return f"{LEGACY_PREFIXES[msg_type]}{text}".encode()
+
+def parse_legacy(data: bytes):
+    """Split one legacy message into (message type, text); the type is None if unrecognised"""
+    text = data.decode("utf-8", errors="replace")
+    # TTS_END: must be checked before TTS:, which is a prefix of it
+    for msg_type in (MSG_TTS_END, MSG_NAME, MSG_INPUT, MSG_TTS, MSG_EXIT, MSG_CANCEL_ACK, MSG_CANCEL):
+        prefix = LEGACY_PREFIXES[msg_type]
+        if text.startswith(prefix):
+            return msg_type, text[len(prefix):]
+    return None, text
+
+def tune_socket(sock: socket.socket):
+    """Send small frames immediately and give the kernel room for bursts of tokens"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    except OSError as e:
+        print(f"Warning: Could not tune socket options: {e}")
+
+class ReplayBuffer:
+    """Sent data frames the peer has not acknowledged yet, kept for replay after a reconnect"""
+
+    def __init__(self, max_frames=2048):
+        self.frames = deque()
+        self.max_frames = max_frames
+        self.base = 0  # Sequence number of frames[0]
+
+    @property
+    def sent(self):
+        return self.base + len(self.frames)
+
+    def record(self, frame: bytes):
+        self.frames.append(frame)
+        if len(self.frames) > self.max_frames:
+            self.frames.popleft()
+            self.base += 1
+
+    def acknowledge(self, count: int):
+        """Forget the frames the peer reports as received"""
+        while self.base < count and self.frames:
+            self.frames.popleft()
+            self.base += 1
+
+    def since(self, count: int):
+        """Frames after the first count, or None if some of them were already dropped"""
+        if count < self.base:
+            return None
+        return list(self.frames)[count - self.base:]
+
+class FramedConnection:
+    """A socket that sends and receives whole messages as (message type, text) pairs"""
+
+    def __init__(self, sock: socket.socket, framed=True):
+        self.sock = sock
+        self.framed = framed
+        self._buffer = bytearray()
+        # Set when a CANCEL arrives; the controller checks it while streaming a response
+        self.cancel_event = threading.Event()
+
+    def send(self, msg_type: int, text: str = "", trace_id: str = None):
+        if self.framed:
+            self.sock.sendall(encode_frame(msg_type, text, trace_id))
+        else:
+            self.sock.sendall(encode_legacy(msg_type, text))
+
+    def recv(self):
+        """
+        Block until a whole message has arrived
+
+        Returns:
+        - Message (message type, text); the type is None for unrecognised legacy data
+
+        Raises socket.timeout if the socket timeout expires first (a partially received
+        frame is kept for the next call) and ConnectionResetError if the peer closed.
+        """
+        message = self._recv_frame() if self.framed else self._recv_legacy()
+        if message[0] == MSG_CANCEL:
+            self.cancel_event.set()
+        return message
+
+    def _recv_frame(self):
+        while True:
+            if len(self._buffer) >= HEADER.size:
+                length, msg_type = HEADER.unpack_from(self._buffer)
+                if length > MAX_PAYLOAD:
+                    raise ConnectionResetError(f"Frame of {length} bytes exceeds the protocol limit")
+                end = HEADER.size + length
+                if len(self._buffer) >= end:
+                    payload = bytes(self._buffer[HEADER.size:end])
+                    del self._buffer[:end]
+                    return decode_payload(msg_type, payload)
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionResetError("Connection closed by peer")
+            self._buffer += data
+
+    def _recv_legacy(self):
+        data = self.sock.recv(1024)
+        if not data:
+            raise ConnectionResetError("Connection closed by peer")
+        return Message(*parse_legacy(data))
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+
+def accept_handshake(sock: socket.socket) -> FramedConnection:
+    """Detect whether a newly accepted client speaks the framed protocol"""
+    tune_socket(sock)
+    peeked = b""
+    # Legacy clients start with a message such as "NAME:...", which never matches MAGIC
+    while len(peeked) < len(MAGIC) and MAGIC.startswith(peeked):
+        if peeked:
+            time.sleep(0.01)  # Part of the first write has arrived; wait for the rest
+        peeked = sock.recv(len(MAGIC), socket.MSG_PEEK)
+        if not peeked:
+            raise ConnectionResetError("Connection closed before the handshake")
+    if peeked == MAGIC:
+        sock.recv(len(MAGIC))
+        return FramedConnection(sock, framed=True)
+    return FramedConnection(sock, framed=False)
+
+def client_handshake(sock: socket.socket) -> FramedConnection:
+    """Announce the framed protocol on a newly connected socket"""
+    tune_socket(sock)
+    sock.sendall(MAGIC)
+    return FramedConnection(sock, framed=True)
+
+async def read_handshake(reader: asyncio.StreamReader):
+    """
+    Asyncio counterpart of accept_handshake
+
+    Returns:
+    - (True if the client speaks the framed protocol, bytes already read that belong to
+      the first legacy message)
+    """
+    first = b""
+    while len(first) < len(MAGIC) and MAGIC.startswith(first):
+        data = await reader.read(len(MAGIC) - len(first))
+        if not data:
+            raise ConnectionResetError("Connection closed before the handshake")
+        first += data
+    if first == MAGIC:
+        return True, b""
+    return False, first
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Read one whole frame and return it as a Message"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        length, msg_type = HEADER.unpack(header)
+        if length > MAX_PAYLOAD:
+            raise ConnectionResetError(f"Frame of {length} bytes exceeds the protocol limit")
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError("Connection closed by peer")
+    return decode_payload(msg_type, payload)
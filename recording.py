@@ -0,0 +1,160 @@
+"""
+Recording - Capture a server run's client frames and backend token streams
+
+With RECORD_FILE set, the server appends one JSON line per event: every frame a client
+sends or receives, and every backend call with its prompt, its tokens and how it ended,
+all with wall-clock timestamps. benchmarks/replay.py drives a server with the recorded
+client input against stub backends that replay the recorded tokens, and compares the
+per-stage timings of two recordings:
+
+    RECORD_FILE=session.jsonl python main.py
+    python benchmarks/replay.py replay session.jsonl -o replay.jsonl
+
+Recording is off unless configure() is given a path; a frame then costs one attribute check.
+"""
+import itertools
+import json
+import threading
+import time
+
+from async_bridge import StreamStatus
+
+_local = threading.local()
+
+def set_session(session):
+    """Attribute backend calls made by the calling thread to a client session"""
+    _local.session = session
+
+def get_session():
+    return getattr(_local, "session", None)
+
+class Recorder:
+    """Appends events to a JSON lines file, flushed as they happen"""
+
+    def __init__(self, path=None):
+        self._file = None
+        self._lock = threading.Lock()
+        self._call_ids = itertools.count(1)
+        if path:
+            self.open(path)
+
+    def open(self, path: str):
+        with self._lock:
+            self._file = open(path, "w", encoding="utf-8")
+        self._write({"event": "start"})
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def frame(self, session, direction: str, msg_type: int, text: str):
+        """A message sent ("out") to or received ("in") from a client"""
+        if self._file is None:
+            return
+        self._write({"event": "frame", "session": session, "dir": direction, "type": msg_type, "text": text})
+
+    def call(self, backend: str, model: str, messages, stream=True):
+        """Start of a backend request; returns the call ID for token() and end()"""
+        if self._file is None:
+            return None
+        call_id = next(self._call_ids)
+        self._write({"event": "call", "id": call_id, "session": get_session(), "backend": backend,
+                     "model": model, "stream": stream, "messages": messages})
+        return call_id
+
+    def token(self, call_id, text: str):
+        if call_id is None or self._file is None:
+            return
+        self._write({"event": "token", "id": call_id, "text": text})
+
+    def end(self, call_id, error=None, cancelled=False):
+        if call_id is None or self._file is None:
+            return
+        self._write({"event": "end", "id": call_id, "error": error, "cancelled": cancelled})
+
+    def _write(self, event):
+        event["time"] = time.time()
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+recorder = Recorder()
+
+def configure(path=None):
+    """Turn recording on for this process (off again with an empty path)"""
+    recorder.close()
+    if path:
+        recorder.open(path)
+    return recorder
+
+def frame(session, direction: str, msg_type: int, text: str):
+    recorder.frame(session, direction, msg_type, text)
+
+class RecordedBackend:
+    """
+    Wraps an LLM service and records every request it serves
+
+    Everything but the generation methods is passed through, so the wrapper can stand in
+    for the service anywhere, including last_error after a stream.
+    """
+
+    def __init__(self, service, backend: str):
+        self._service = service
+        self._backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self._service, name)
+
+    def generate_stream(self, messages):
+        call_id = recorder.call(self._backend, self._service.model_name, messages)
+        finished = False
+        try:
+            for token in self._service.generate_stream(messages):
+                recorder.token(call_id, token)
+                yield token
+            finished = True
+        finally:
+            recorder.end(call_id, error=self._service.last_error, cancelled=not finished)
+
+    async def agenerate_stream(self, messages, status=None, **kwargs):
+        call_id = recorder.call(self._backend, self._service.model_name, messages)
+        # Async streams share the loop thread, so the error comes from this call's status
+        if status is None:
+            status = StreamStatus()
+        finished = False
+        try:
+            async for token in self._service.agenerate_stream(messages, status=status, **kwargs):
+                recorder.token(call_id, token)
+                yield token
+            finished = True
+        finally:
+            recorder.end(call_id, error=status.error, cancelled=not finished)
+
+    def generate(self, messages):
+        call_id = recorder.call(self._backend, self._service.model_name, messages, stream=False)
+        self._service.last_error = None  # generate() only sets it on failure
+        response = self._service.generate(messages)
+        if response:
+            recorder.token(call_id, response)
+        recorder.end(call_id, error=self._service.last_error)
+        return response
+
+def load_events(path: str):
+    """Read a recording, skipping a line cut short by a crash"""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return events
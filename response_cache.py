@@ -0,0 +1,81 @@
+"""
+SemanticResponseCache - Reuses answers to questions that were already asked in other words
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+class SemanticResponseCache:
+    def __init__(self, context_engine, threshold=0.92, ttl=24 * 3600, max_entries=256):
+        self.context_engine = context_engine
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # query -> {"vector", "response", "created_at"}; order doubles as LRU order
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # Answers that depend on the clock, the user's own data or the running conversation
+        self.time_sensitive_pattern = re.compile(
+            r"\b(today|tonight|now|current|currently|latest|recent|news|weather|time|date|"
+            r"tomorrow|yesterday|this (?:week|month|year)|remind|task|tasks|schedule|my)\b"
+        )
+        self.follow_up_pattern = re.compile(
+            r"\b(it|that|this|those|these|they|them|he|she|him|her|again|more|else|above|previous|last)\b"
+        )
+
+    def is_cacheable(self, query: str) -> bool:
+        """Check if the query is self-contained and its answer does not change over time"""
+        text = query.lower()
+        if len(text.split()) < 3:
+            return False
+        return not self.time_sensitive_pattern.search(text) and not self.follow_up_pattern.search(text)
+
+    def _similarity(self, a: List[float], b: List[float]) -> float:
+        # The embedding model produces normalized vectors, so the dot product is the cosine
+        return sum(x * y for x, y in zip(a, b))
+
+    def _embed(self, query: str) -> Optional[List[float]]:
+        try:
+            return self.context_engine.embed(query)
+        except Exception as e:
+            print(f"Warning: Could not embed query for the response cache: {e}")
+            return None
+
+    def lookup(self, query: str) -> Optional[str]:
+        """Return a cached response for a semantically equivalent query, or None"""
+        vector = self._embed(query)
+        if vector is None:
+            return None
+        now = time.time()
+        with self._lock:
+            best_query, best_score = None, 0.0
+            for cached_query, entry in list(self.entries.items()):
+                if now - entry["created_at"] > self.ttl:
+                    del self.entries[cached_query]
+                    continue
+                score = self._similarity(vector, entry["vector"])
+                if score > best_score:
+                    best_query, best_score = cached_query, score
+            if best_query is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_query)
+            self.hits += 1
+            print(f"Cache: hit for '{best_query[:50]}' (similarity {best_score:.3f}, "
+                  f"{self.hits} hits / {self.misses} misses)")
+            return self.entries[best_query]["response"]
+
+    def store(self, query: str, response: str):
+        vector = self._embed(query)
+        if vector is None or not response.strip():
+            return
+        with self._lock:
+            self.entries[query] = {"vector": vector, "response": response, "created_at": time.time()}
+            self.entries.move_to_end(query)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,77 @@
+"""
+StartupGraph - Runs the server's slow initializers concurrently, in dependency order
+
+Each step is a named function with the names of the steps it needs. Steps start as soon
+as their dependencies have finished, each in its own thread, so the socket can be bound
+and clients served while models load and backends are probed in the background.
+"""
+import threading
+import time
+
+# Imported first by main.py, so this is as close to interpreter start as we can measure
+PROCESS_START = time.perf_counter()
+
+class StartupGraph:
+    def __init__(self):
+        self.steps = {}
+        self.timings = {}  # name -> (start offset, end offset) in seconds since PROCESS_START
+        self.errors = {}
+        self._done = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name: str, start: float, end: float = None):
+        """Record a phase that already ran in the main thread, e.g. imports or binding the socket"""
+        end = time.perf_counter() if end is None else end
+        self.timings[name] = (start - PROCESS_START, end - PROCESS_START)
+
+    def add(self, name: str, func, after=()):
+        """Register func to run once every step named in after has finished"""
+        for dependency in after:
+            if dependency not in self.steps:
+                raise ValueError(f"Startup step '{name}' depends on unknown step '{dependency}'")
+        self.steps[name] = (func, tuple(after))
+        self._done[name] = threading.Event()
+
+    def start(self):
+        """Start every step in the background and return immediately"""
+        for name in self.steps:
+            threading.Thread(target=self._run_step, args=(name,), name=f"startup-{name}", daemon=True).start()
+        threading.Thread(target=self._report_when_done, name="startup-report", daemon=True).start()
+
+    def _run_step(self, name):
+        func, after = self.steps[name]
+        for dependency in after:
+            self._done[dependency].wait()
+        start = time.perf_counter()
+        try:
+            if any(dependency in self.errors for dependency in after):
+                raise RuntimeError("skipped, a dependency failed")
+            func()
+        except Exception as e:
+            self.errors[name] = str(e)
+            print(f"Startup: {name} failed: {e}")
+        finally:
+            with self._lock:
+                self.mark(name, start)
+            self._done[name].set()
+
+    def wait(self, name: str, timeout=None) -> bool:
+        """Block until a step has finished; True if it finished within timeout"""
+        return self._done[name].wait(timeout)
+
+    def _report_when_done(self):
+        for event in self._done.values():
+            event.wait()
+        print(self.report())
+
+    def report(self) -> str:
+        """Timing of every phase, in the order they started"""
+        with self._lock:
+            timings = sorted(self.timings.items(), key=lambda item: item[1][0])
+        total = max((end for _, (_, end) in timings), default=0.0)
+        lines = [f"Startup timing ({total * 1000:.0f} ms until every step finished):"]
+        for name, (start, end) in timings:
+            status = " FAILED" if name in self.errors else ""
+            lines.append(f"- {name:<16} {start * 1000:7.0f} -> {end * 1000:7.0f} ms "
+                         f"({(end - start) * 1000:6.0f} ms){status}")
+        return "\n".join(lines)
@@ -3,6 +3,7 @@ TaskService - Handles task recognition, storage, and management
 """
 import os
 import json
+import threading
 import uuid
 from datetime import datetime, timedelta
 import re
@@ -15,6 +16,7 @@ class TaskService:
     def __init__(self, tasks_file="tasks.json"):
         self.tasks_file = tasks_file
         self.tasks = self._load_tasks()
+        self._lock = threading.RLock()
         self.task_recognizer = TaskRecognizer()
         self.datetime_util = DateTimeUtility()
     
@@ -28,7 +30,7 @@ class TaskService:
         return {"tasks": []}
     
     def _save_tasks(self):
-        with open(self.tasks_file, "w") as f:
+        with self._lock, open(self.tasks_file, "w") as f:
             json.dump(self.tasks, f, indent=2)
     
     def extract_task(self, user_input: str) -> Optional[Dict[str, Any]]:
@@ -54,20 +56,23 @@ class TaskService:
         if session_id:
             task["session_id"] = session_id
             
-        self.tasks["tasks"].append(task)
-        self._save_tasks()
+        # Sessions share the task list: hold the lock across the change and its save
+        with self._lock:
+            self.tasks["tasks"].append(task)
+            self._save_tasks()
         return task_id
     
     def update_task(self, task_id: str, **kwargs) -> bool:
         """
         Update task properties
         """
-        for i, task in enumerate(self.tasks["tasks"]):
-            if task["task_id"] == task_id:
-                for key, value in kwargs.items():
-                    task[key] = value
-                self._save_tasks()
-                return True
+        with self._lock:
+            for i, task in enumerate(self.tasks["tasks"]):
+                if task["task_id"] == task_id:
+                    for key, value in kwargs.items():
+                        task[key] = value
+                    self._save_tasks()
+                    return True
         return False
     
     def complete_task(self, task_id: str) -> bool:
@@ -104,15 +109,48 @@ class TaskService:
             if "due_at" in task and task["due_at"] < now
         ]
     
+    def find_pending_task(self, task_ref: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a pending task from a spoken reference
+
+        Parameters:
+        - task_ref: A task number ("2", "number 2") or words from the task description
+
+        Returns:
+        - The best matching pending task or None
+        """
+        pending = self.get_pending_tasks()
+        task_ref = task_ref.lower().strip()
+
+        # Numbers refer to the order tasks are listed in
+        number_match = re.fullmatch(r"(?:number\s+|no\.?\s*|#)?(\d+)", task_ref)
+        if number_match:
+            index = int(number_match.group(1)) - 1
+            return pending[index] if 0 <= index < len(pending) else None
+
+        stopwords = {"the", "a", "an", "my", "to", "of", "for", "task", "on", "and"}
+        ref_words = set(re.findall(r"[a-z0-9']+", task_ref)) - stopwords
+        if not ref_words:
+            return None
+
+        best_task, best_score = None, 0.0
+        for task in pending:
+            desc_words = set(re.findall(r"[a-z0-9']+", task["description"].lower())) - stopwords
+            score = len(ref_words & desc_words) / len(ref_words)
+            if score > best_score:
+                best_task, best_score = task, score
+        return best_task if best_score > 0.5 else None
+
     def delete_task(self, task_id: str) -> bool:
         """
         Delete a task
         """
-        for i, task in enumerate(self.tasks["tasks"]):
-            if task["task_id"] == task_id:
-                self.tasks["tasks"].pop(i)
-                self._save_tasks()
-                return True
+        with self._lock:
+            for i, task in enumerate(self.tasks["tasks"]):
+                if task["task_id"] == task_id:
+                    self.tasks["tasks"].pop(i)
+                    self._save_tasks()
+                    return True
         return False
     
     def handle_date_query(self, query: str) -> str:
@@ -0,0 +1,82 @@
+"""
+TokenReader - Reads a backend's token stream on its own thread so a barge-in never waits for it
+"""
+import queue
+import threading
+
+import recording
+import tracing
+
+_DONE = object()
+
+class _ReadError:
+    def __init__(self, exc):
+        self.exc = exc
+
+class TokenReader:
+    """
+    Runs one generation on a reader thread and hands its tokens over through a queue
+
+    The consumer waits on the queue instead of the backend, so it stops as soon as
+    cancel_event is set, even while the backend is still working on its first token. The
+    reader runs with the caller's trace ID and recording session, and judges whether the
+    generation failed itself, because last_error and the router's choice are per thread.
+    """
+
+    def __init__(self, generate, turn_failed, cancel_event, on_done=None, poll_interval=0.05):
+        # generate() returns (object reporting the backend that answered, token iterator)
+        self.generate = generate
+        self.turn_failed = turn_failed
+        self.cancel_event = cancel_event
+        # Called once the backend stream is closed, e.g. to give the LLM slot back
+        self.on_done = on_done
+        self.poll_interval = poll_interval
+        self.failed = False
+        self._tokens = queue.Queue()
+        self._stop = threading.Event()
+        thread = threading.Thread(target=self._read, args=(tracing.get_trace_id(), recording.get_session()),
+                                  name="token-reader", daemon=True)
+        thread.start()
+
+    def _read(self, trace_id, session):
+        tracing.set_trace_id(trace_id)
+        recording.set_session(session)
+        token_stream = None
+        try:
+            source, token_stream = self.generate()
+            for token in token_stream:
+                if self._stop.is_set():
+                    break
+                self._tokens.put(token)
+            else:
+                self.failed = self.turn_failed(source)
+        except Exception as e:
+            self.failed = True
+            self._tokens.put(_ReadError(e))
+        finally:
+            # Closing tears down the backend request. A generator can only be closed by the
+            # thread iterating it, so this happens as soon as the read in progress returns.
+            close = getattr(token_stream, "close", None)
+            if close:
+                close()
+            if self.on_done:
+                self.on_done()
+            self._tokens.put(_DONE)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._tokens.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self.cancel_event.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _ReadError):
+                raise item.exc
+            yield item
+
+    def close(self):
+        """Stop reading; the backend stream is closed once the reader regains control"""
+        self._stop.set()
@@ -0,0 +1,183 @@
+"""
+Tracing - Per-turn latency spans written as a Chrome trace file
+
+Each user turn gets a trace ID on the Pi, which travels to the server with the INPUT
+frame. Both processes record timed spans (retrieval, time to first token, synthesis,
+playback, ...) tagged with that ID into their own trace file. Open a file in
+chrome://tracing or https://ui.perfetto.dev, or merge the Pi's and the server's first:
+
+    python tracing.py merge pi_trace.json server_trace.json -o turn_trace.json
+
+Tracing is off unless configure() is given a path; spans then cost one attribute check.
+"""
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+
+_local = threading.local()
+
+def new_trace_id() -> str:
+    return secrets.token_hex(8)
+
+def set_trace_id(trace_id):
+    """Make trace_id the current turn of the calling thread; spans without an explicit ID use it"""
+    _local.trace_id = trace_id
+
+def get_trace_id():
+    return getattr(_local, "trace_id", None)
+
+class Span:
+    """A timed section of a turn; use as a context manager or call end() explicitly"""
+
+    def __init__(self, tracer, name, trace_id, args):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.args = args
+        self.start = time.time()
+        self.ended = False
+
+    def set(self, **args):
+        """Attach more arguments, e.g. token counts known only at the end"""
+        self.args.update(args)
+
+    def end(self, **args):
+        if self.ended:
+            return
+        self.ended = True
+        self.args.update(args)
+        self.tracer._write_complete(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.args["error"] = str(exc) or exc_type.__name__
+        self.end()
+        return False
+
+class _NoSpan:
+    """Returned while tracing is off"""
+
+    trace_id = None
+
+    def set(self, **args):
+        pass
+
+    def end(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+class Tracer:
+    """
+    Appends trace events to a file in the Chrome JSON array format
+
+    The closing bracket is optional in that format, so every event is written and flushed
+    as it happens and a trace from a crashed process still opens.
+    """
+
+    def __init__(self, path=None, process_name="server"):
+        self.pid = os.getpid()
+        self._file = None
+        self._lock = threading.Lock()
+        if path:
+            self.open(path, process_name)
+
+    def open(self, path: str, process_name="server"):
+        with self._lock:
+            self._file = open(path, "w")
+            self._file.write("[\n")
+        self._write({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": process_name}})
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def span(self, name: str, trace_id=None, **args):
+        """Start a span; trace_id defaults to the calling thread's current turn"""
+        if self._file is None:
+            return _NO_SPAN
+        return Span(self, name, trace_id or get_trace_id(), args)
+
+    def instant(self, name: str, trace_id=None, **args):
+        """Record a point in time, such as the first token of a response"""
+        if self._file is None:
+            return
+        args["trace_id"] = trace_id or get_trace_id()
+        self._write({"name": name, "ph": "i", "s": "t", "ts": time.time() * 1e6, "pid": self.pid,
+                     "tid": threading.get_ident(), "args": args})
+
+    def _write_complete(self, span):
+        span.args["trace_id"] = span.trace_id
+        end = time.time()
+        self._write({"name": span.name, "ph": "X", "ts": span.start * 1e6, "dur": (end - span.start) * 1e6,
+                     "pid": self.pid, "tid": threading.get_ident(), "args": span.args})
+
+    def _write(self, event):
+        # Wall-clock timestamps so the Pi's and the server's files line up when merged
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + ",\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+tracer = Tracer()
+
+def configure(path=None, process_name="server"):
+    """Turn tracing on for this process (off again with an empty path)"""
+    tracer.close()
+    if path:
+        tracer.open(path, process_name)
+    return tracer
+
+def span(name: str, trace_id=None, **args):
+    return tracer.span(name, trace_id, **args)
+
+def instant(name: str, trace_id=None, **args):
+    tracer.instant(name, trace_id, **args)
+
+def load_events(path: str):
+    """Read a trace file written by Tracer, with or without its closing bracket"""
+    with open(path) as f:
+        text = f.read().rstrip().rstrip(",")
+    if not text.endswith("]"):
+        text += "]"
+    return json.loads(text)
+
+def merge(paths, output: str):
+    events = []
+    for path in paths:
+        events.extend(load_events(path))
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge Pi and server trace files into one")
+    parser.add_argument("command", choices=["merge"])
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-o", "--output", default="turn_trace.json")
+    args = parser.parse_args()
+    count = merge(args.paths, args.output)
+    print(f"Wrote {count} events from {len(args.paths)} files to {args.output}")
+
+if __name__ == "__main__":
+    main()